@@ -1,6 +1,7 @@
 import unittest
 from main import trips, create_trip, view_trips, update_trip, delete_trip
-from unittest.mock import patch
+from unittest.mock import patch, Mock, MagicMock
+from types import SimpleNamespace
 from main import travelers, create_traveler, view_travelers, update_traveler, delete_traveler
 import datetime
 from main import trips, trip_legs, create_trip_leg
@@ -8,6 +9,45 @@ from main import users, create_user
 from io import StringIO
 from main import generate_financial_report, trips, trip_legs
 from main import reporting_menu, display_main_menu, trip_management_menu
+from snapshot import save_snapshot, load_snapshot
+from main import encode_leg_categories, count_by_category, leg_categories
+from collections import Counter
+from main import record_change, report_cache_stats
+from main import export_itineraries, legs_by_trip
+from main import enable_change_feed, disable_change_feed, read_changes, find_change_offset, last_change_sequence
+from main import read_snapshot, insert_record, update_record, remove_record
+from main import undo, redo, record_as_of, change_history
+from gui import PageCache, CollectionTab, LoginFrame, RecordForm, FIELDS as GUI_FIELDS
+from main import compute_occupancy
+from main import compute_demographics, ages_on, to_datetime64
+from main import find_duplicate_travelers, merge_travelers
+from main import batch_update, collection_versions
+from main import archive_completed_trips, read_archive
+from main import top_n_series, histogram_series, aggregate_chart
+from replay import replay_session, summarize, ReplayMismatch
+from main import check_credentials, authenticate, validate_session_token, end_session, is_password_hash
+from main import record_history_menu, verify_password, DEFAULT_ADMIN_PASSWORD
+from main import compute_coordinator_workload, trips_for_coordinator, view_coordinator_workload
+from query import Query
+from main import check_leg_cost, audit_leg_costs, leg_cost_stats
+from main import convert_group_totals, currencies, RateTable, RATES_PATH, format_itinerary
+from main import leg_timeline, timeline_issues, check_leg_schedule, get_leg_times
+from main import BudgetModel, trips_with_legs, what_if_menu
+from main import emergency_roster, write_roster, trip_calendar, emergency_roster_menu
+from main import Store, use_store, default_store, trip_cost_totals, users_by_username, report_cache
+from main import CategoryDictionary
+import concurrent.futures
+from columnar import export_columnar, load_columnar
+import csv
+import numpy as np
+import time
+import math
+import sys
+import shutil
+import os
+import tempfile
+import queue
+import threading
 
 
 # Trip management test
@@ -16,6 +56,7 @@ class TestTripManagement(unittest.TestCase):
 
     def setUp(self):
         """Set up initial data for testing."""
+        self.enterContext(use_store(Store()))
         self.test_trip = {
             "id": "test123",
             "name": "Test Trip",
@@ -28,10 +69,6 @@ class TestTripManagement(unittest.TestCase):
         }
         trips.append(self.test_trip)
 
-    def tearDown(self):
-        """Clean up after each test."""
-        trips.clear()
-
     def test_create_trip(self):
         """Test creating a new trip."""
         initial_count = len(trips)
@@ -61,6 +98,7 @@ class TestTravelerManagement(unittest.TestCase):
 
     def setUp(self):
         """Set up initial data for testing."""
+        self.enterContext(use_store(Store()))
         self.test_traveler = {
             "id": "test123",
             "name": "John Doe",
@@ -72,10 +110,6 @@ class TestTravelerManagement(unittest.TestCase):
         }
         travelers.append(self.test_traveler)
 
-    def tearDown(self):
-        """Clean up after each test."""
-        travelers.clear()
-
 #create traveler
     @patch('main.get_input', side_effect=["Jane Doe", "456 Elm St", "01/01/1995", "1234567890", "Driver's License", "B9876543"])
     @patch('main.get_date_input', return_value=datetime.date(1995, 1, 1))
@@ -118,6 +152,7 @@ class TestTripLegManagement(unittest.TestCase):
 
     def setUp(self):
         """Set up initial data for testing."""
+        self.enterContext(use_store(Store()))
         self.test_trip = {
             "id": "trip123",
             "name": "Test Trip",
@@ -130,13 +165,8 @@ class TestTripLegManagement(unittest.TestCase):
         }
         trips.append(self.test_trip)
 
-    def tearDown(self):
-        """Clean up after each test."""
-        trips.clear()
-        trip_legs.clear()
-
 #create trip leg
-    @patch('main.get_input', side_effect=["trip123", "New York", "Los Angeles", "Airline", "Flight", "transfer"])
+    @patch('main.get_input', side_effect=["trip123", "New York", "Los Angeles", "Airline", "Flight", "transfer", "", "", ""])
     @patch('main.get_int_input', return_value=500)
     def test_create_trip_leg(self, mock_int_input, mock_input):
         """Test creating a new trip leg."""
@@ -146,25 +176,14 @@ class TestTripLegManagement(unittest.TestCase):
         self.assertEqual(trip_legs[-1]["start_location"], "New York")
         self.assertEqual(trip_legs[-1]["destination"], "Los Angeles")
         self.assertEqual(trip_legs[-1]["cost"], 500)
-        self.assertIn(trip_legs[-1]["id"], self.test_trip["legs"])
+        self.assertIn(trip_legs[-1]["id"], trips[0]["legs"])  # Trips are updated by replacing the record
 
 #Users testing
 class TestUserManagement(unittest.TestCase):
 
     def setUp(self):
-        """Set up initial data for testing."""
-        self.default_admin = {
-            "id": "admin1",
-            "username": "admin",
-            "password": "admin123",
-            "role": "administrator"
-        }
-        users.clear()
-        users.append(self.default_admin)
-
-    def tearDown(self):
-        """Clean up after each test."""
-        users.clear()
+        """Start each test with a store holding only the default admin."""
+        self.enterContext(use_store(Store()))
 
 #Create user test
     @patch('main.get_input', side_effect=["manager", "testuser", "password123"])
@@ -175,6 +194,7 @@ class TestUserManagement(unittest.TestCase):
         self.assertEqual(len(users), initial_count + 1)
         self.assertEqual(users[-1]["username"], "testuser")
         self.assertEqual(users[-1]["role"], "manager")
+        self.assertTrue(is_password_hash(users[-1]["password"]))
 
     @patch('main.get_input', side_effect=["invalid_role", "manager", "testuser", "password123"])
     def test_create_user_invalid_role(self, mock_input):
@@ -189,6 +209,7 @@ class TestGenerateFinancialReport(unittest.TestCase):
 
     def setUp(self):
         """Set up test data for trips and trip legs."""
+        self.enterContext(use_store(Store()))
         self.test_trip = {
             "id": "trip123",
             "name": "Test Trip",
@@ -212,11 +233,6 @@ class TestGenerateFinancialReport(unittest.TestCase):
         trips.append(self.test_trip)
         trip_legs.append(self.test_leg)
 
-    def tearDown(self):
-        """Clean up test data."""
-        trips.clear()
-        trip_legs.clear()
-
 #financial report test
     @patch('sys.stdout', new_callable=StringIO)
     def test_generate_financial_report(self, mock_stdout):
@@ -243,7 +259,7 @@ class TestGenerateFinancialReport(unittest.TestCase):
 class TestMenuFunctions(unittest.TestCase):
 
 #reporting menu
-    @patch('main.get_input', side_effect=["1", "4"])  # Simulate selecting "Financial Report" and then "Back to Main Menu"
+    @patch('main.get_input', side_effect=["1", "9"])  # Simulate selecting "Financial Report" and then "Back to Main Menu"
     @patch('sys.stdout', new_callable=StringIO)
     def test_reporting_menu(self, mock_stdout, mock_input):
         """Test the reporting menu options."""
@@ -253,6 +269,17 @@ class TestMenuFunctions(unittest.TestCase):
             self.assertIn("=== Reporting and Analytics ===", output)
             self.assertTrue(mock_generate_financial_report.called)
 
+    @patch('main.get_input', side_effect=["3", "4", "9"])  # Existing options keep their numbers
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_reporting_menu_numbering(self, mock_stdout, mock_input):
+        """Test that the original report options keep their numbers and new ones come after them."""
+        with patch('main.generate_trip_performance_report') as mock_performance, \
+                patch('main.generate_demographics_report') as mock_demographics:
+            reporting_menu()
+        self.assertTrue(mock_performance.called)
+        self.assertTrue(mock_demographics.called)
+        self.assertIn("3. Trip Performance Report", mock_stdout.getvalue())
+
 #trip management menu
     @patch('main.get_input', side_effect=["1", "5"])  # Simulate selecting "Create Trip" and then "Back to Main Menu"
     @patch('sys.stdout', new_callable=StringIO)
@@ -271,5 +298,1293 @@ class TestMenuFunctions(unittest.TestCase):
         with patch('main.reporting_menu') as mock_reporting_menu:
             display_main_menu()
 
+#Binary snapshot test
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        """Write a small dataset to a temporary snapshot file."""
+        self.enterContext(use_store(Store()))
+        self.collections = {
+            "trips": [{
+                "id": "trip123",
+                "name": "Test Trip",
+                "start_date": datetime.date(2023, 10, 1),
+                "duration": 5,
+                "coordinator": "John Doe",
+                "contact": "1234567890",
+                "travelers": ["trav1", "trav2"],
+                "legs": ["leg123"]
+            }],
+            "travelers": [],
+            "trip_legs": [{
+                "id": "leg123",
+                "trip_id": "trip123",
+                "start_location": "New York",
+                "destination": "Los Angeles",
+                "transport_provider": "Airline",
+                "transport_mode": "Flight",
+                "leg_type": "transfer",
+                "cost": 500,
+                "currency": "USD",
+                "departure": datetime.datetime(2023, 10, 1, 9, 30),
+                "arrival": None
+            }],
+            "users": []
+        }
+        handle, self.path = tempfile.mkstemp(suffix=".snap")
+        os.close(handle)
+        save_snapshot(self.path, self.collections)
+
+    def tearDown(self):
+        """Remove the snapshot file."""
+        os.remove(self.path)
+
+#snapshot round trip
+    def test_snapshot_round_trip(self):
+        """Test that records read back from a snapshot match the originals."""
+        with load_snapshot(self.path) as snap:
+            self.assertEqual(len(snap.trips), 1)
+            self.assertEqual(snap.trips[0], self.collections["trips"][0])
+            self.assertEqual(snap.trip_legs[0], self.collections["trip_legs"][0])
+            self.assertEqual(len(snap.travelers), 0)
+
+#invalid snapshot file
+    def test_load_invalid_snapshot(self):
+        """Test that a file which is not a snapshot, or is cut off within the header, is rejected."""
+        with open(self.path, "rb") as f:
+            header = f.read(20)
+        for size in (4, 20):  # The start of the magic number, and the header without the section table
+            with open(self.path, "wb") as f:
+                f.write(header[:size])
+            with self.assertRaises(ValueError):
+                load_snapshot(self.path)
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot" * 10)
+        with self.assertRaises(ValueError):
+            load_snapshot(self.path)
+
+#Dictionary encoding of leg attributes
+class TestLegCategories(unittest.TestCase):
+
+    def test_categories_ignore_case(self):
+        """Test that differently cased values share one category."""
+        legs = [{"transport_mode": "Hovercraft"}, {"transport_mode": "hovercraft "}, {"transport_mode": "Tram"}]
+        for leg in legs:
+            encode_leg_categories(leg)
+        self.assertEqual(legs[1]["transport_mode"], "Hovercraft")
+        self.assertIs(legs[0]["transport_mode"], legs[1]["transport_mode"])
+
+    def test_count_by_category(self):
+        """Test counting legs per transport mode."""
+        legs = [{"transport_mode": "Monorail"}, {"transport_mode": "MONORAIL"}, {"transport_mode": "Cable Car"}]
+        counts = count_by_category("transport_mode", legs)
+        self.assertEqual(counts, {"Monorail": 2, "Cable Car": 1})
+
+    def test_count_from_code_columns(self):
+        """Test that counts of the current trip legs follow creates, updates and deletes."""
+        with use_store(Store()):
+            for i, mode in enumerate(["Bus", "Ferry", "bus", "Train", "Ferry"]):
+                insert_record("trip_legs", {"id": f"l{i}", "trip_id": "t1", "transport_mode": mode})
+            self.assertEqual(list(count_by_category("transport_mode", trip_legs).items()),
+                             [("Bus", 2), ("Ferry", 2), ("Train", 1)])
+            remove_record("trip_legs", trip_legs[0])
+            update_record("trip_legs", trip_legs[0], {"transport_mode": "Tram"})
+            expected = Counter({"Tram": 1, "Bus": 1, "Train": 1, "Ferry": 1})
+            self.assertEqual(list(count_by_category("transport_mode", trip_legs).items()), list(expected.items()))
+            with read_snapshot() as snap:
+                self.assertEqual(count_by_category("transport_mode", snap.trip_legs), expected)
+                insert_record("trip_legs", {"id": "l5", "trip_id": "t1", "transport_mode": "Bus"})
+                self.assertEqual(count_by_category("transport_mode", snap.trip_legs), expected)  # Not the live data
+            self.assertEqual(count_by_category("transport_mode", trip_legs)["Bus"], 2)
+
+#Report cache test
+class TestReportCache(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a trip with one leg and an empty report cache."""
+        self.enterContext(use_store(Store()))
+        self.test_trip = {
+            "id": "trip123",
+            "name": "Test Trip",
+            "start_date": datetime.date(2023, 10, 1),
+            "duration": 5,
+            "coordinator": "John Doe",
+            "contact": "1234567890",
+            "travelers": [],
+            "legs": ["leg123"]
+        }
+        self.test_leg = {
+            "id": "leg123",
+            "trip_id": "trip123",
+            "start_location": "New York",
+            "destination": "Los Angeles",
+            "transport_provider": "Airline",
+            "transport_mode": "Flight",
+            "leg_type": "transfer",
+            "cost": 500
+        }
+        trips.append(self.test_trip)
+        trip_legs.append(self.test_leg)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_repeated_report_is_cached(self, mock_stdout):
+        """Test that an unchanged report is served from the cache."""
+        generate_financial_report()
+        generate_financial_report()
+        self.assertEqual(report_cache_stats, {"hits": 1, "misses": 1})
+        self.assertEqual(mock_stdout.getvalue().count("Total Revenue: $500"), 2)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_change_invalidates_cache(self, mock_stdout):
+        """Test that a recorded change causes the report to be recomputed."""
+        generate_financial_report()
+        self.test_leg["cost"] = 750
+        record_change("trip_legs", "update", self.test_leg)
+        generate_financial_report()
+        self.assertEqual(report_cache_stats["misses"], 2)
+        self.assertIn("Total Revenue: $750", mock_stdout.getvalue())
+
+#Itinerary export test
+class TestItineraryExport(unittest.TestCase):
+
+    def setUp(self):
+        """Set up two trips, one with a leg, and an output directory."""
+        self.enterContext(use_store(Store()))
+        self.test_trips = [{
+            "id": "trip123",
+            "name": "Test Trip",
+            "start_date": datetime.date(2023, 10, 1),
+            "duration": 5,
+            "coordinator": "John Doe",
+            "contact": "1234567890",
+            "travelers": [],
+            "legs": ["leg123"]
+        }, {
+            "id": "trip456",
+            "name": "Later Trip",
+            "start_date": datetime.date(2024, 6, 1),
+            "duration": 3,
+            "coordinator": "John Doe",
+            "contact": "1234567890",
+            "travelers": [],
+            "legs": []
+        }]
+        trips.extend(self.test_trips)
+        trip_legs.append({
+            "id": "leg123",
+            "trip_id": "trip123",
+            "start_location": "New York",
+            "destination": "Los Angeles",
+            "transport_provider": "Airline",
+            "transport_mode": "Flight",
+            "leg_type": "transfer",
+            "cost": 500
+        })
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the exported files."""
+        shutil.rmtree(self.output_dir)
+
+    def test_export_all_itineraries(self):
+        """Test that a text and an HTML file are written for every trip."""
+        count = export_itineraries(self.output_dir, workers=1)
+        self.assertEqual(count, 2)
+        with open(os.path.join(self.output_dir, "itinerary_trip123.txt")) as f:
+            text = f.read()
+        self.assertIn("New York to Los Angeles (Flight)", text)
+        self.assertIn("Total Trip Cost: $500", text)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "itinerary_trip456.html")))
+
+    def test_export_date_range(self):
+        """Test that only trips starting in the date range are exported."""
+        count = export_itineraries(self.output_dir, start=datetime.date(2024, 1, 1), workers=1)
+        self.assertEqual(count, 1)
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["itinerary_trip456.html", "itinerary_trip456.txt"])
+
+    def test_legs_index_follows_changes(self):
+        """Test that the trip legs index is updated by recorded changes."""
+        self.assertEqual(len(legs_by_trip.lookup("trip123")), 1)
+        leg = {"id": "leg789", "trip_id": "trip456", "cost": 100}
+        trip_legs.append(leg)
+        record_change("trip_legs", "create", leg)
+        self.assertEqual(legs_by_trip.lookup("trip456"), [leg])
+
+#Change feed test
+class TestChangeFeed(unittest.TestCase):
+
+    def setUp(self):
+        """Start a change feed in a temporary file."""
+        self.enterContext(use_store(Store()))
+        handle, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        enable_change_feed(self.path)
+
+    def tearDown(self):
+        """Stop the feed and remove its file."""
+        disable_change_feed()
+        os.remove(self.path)
+
+    @patch('main.get_input', side_effect=["Jane Doe", "456 Elm St", "1234567890", "Driver's License", "B9876543"])
+    @patch('main.get_date_input', return_value=datetime.date(1995, 1, 1))
+    def test_changes_are_published(self, mock_date_input, mock_input):
+        """Test that creating a traveler writes a numbered event to the feed."""
+        create_traveler()
+        disable_change_feed()
+        events = [event for event, offset in read_changes(self.path)]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["seq"], 1)
+        self.assertEqual(events[0]["collection"], "travelers")
+        self.assertEqual(events[0]["action"], "create")
+        self.assertEqual(events[0]["record"]["dob"], "1995-01-01")
+
+    def test_read_from_offset(self):
+        """Test that readers can continue from a returned offset or a sequence number."""
+        for i in range(5):
+            record_change("users", "create", {"id": f"user{i}", "username": f"user{i}", "password": "secret"})
+        disable_change_feed()
+        first_two = list(read_changes(self.path, limit=2))
+        rest = [event["seq"] for event, offset in read_changes(self.path, first_two[-1][1])]
+        self.assertEqual(rest, [3, 4, 5])
+        self.assertNotIn("password", first_two[0][0]["record"])
+        offset = find_change_offset(self.path, 4)
+        self.assertEqual([event["seq"] for event, _ in read_changes(self.path, offset)], [4, 5])
+
+    def test_partial_last_line(self):
+        """Test that a feed whose last write was interrupted can still be reopened and continued."""
+        for i in range(2):
+            record_change("users", "create", {"id": f"user{i}", "username": f"user{i}"})
+        disable_change_feed()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"seq": 3, "time": "2024-')
+        self.assertEqual(last_change_sequence(self.path), 2)
+        enable_change_feed(self.path)
+        record_change("users", "create", {"id": "user2", "username": "user2"})
+        disable_change_feed()
+        self.assertEqual([event["seq"] for event, _ in read_changes(self.path)], [1, 2, 3])
+
+#Snapshot isolation test
+class TestSnapshotReads(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a traveler."""
+        self.enterContext(use_store(Store()))
+        self.test_traveler = {
+            "id": "test123",
+            "name": "John Doe",
+            "address": "123 Main St",
+            "dob": datetime.date(1990, 1, 1),
+            "emergency_contact": "9876543210",
+            "gov_id_type": "Passport",
+            "gov_id_number": "A1234567"
+        }
+        travelers.append(self.test_traveler)
+
+    def test_snapshot_ignores_later_changes(self):
+        """Test that a snapshot keeps seeing the data as it was when taken."""
+        with read_snapshot() as snap:
+            update_record("travelers", self.test_traveler, {"name": "Updated Name"})
+            insert_record("travelers", dict(self.test_traveler, id="test456"))
+            self.assertEqual(len(snap.travelers), 1)
+            self.assertEqual(snap.travelers[0]["name"], "John Doe")
+        self.assertEqual(travelers[0]["name"], "Updated Name")
+        self.assertEqual(self.test_traveler["name"], "John Doe")  # Old version was not changed in place
+
+    def test_unchanged_snapshots_share_data(self):
+        """Test that snapshots taken without changes in between share the same copy."""
+        with read_snapshot() as first, read_snapshot() as second:
+            self.assertIs(first.travelers, second.travelers)
+        with read_snapshot() as first:
+            remove_record("travelers", self.test_traveler)
+            with read_snapshot() as second:
+                self.assertIsNot(first.travelers, second.travelers)
+                self.assertEqual(len(second.travelers), 0)
+
+    def test_unchanged_data_not_copied_again(self):
+        """Test that a snapshot taken after the previous one closed reuses its copy until the data changes."""
+        with read_snapshot() as snap:
+            copied = snap.travelers
+        with read_snapshot() as snap:
+            self.assertIs(snap.travelers, copied)
+        update_record("travelers", self.test_traveler, {"name": "Updated Name"})
+        with read_snapshot() as snap:
+            self.assertIsNot(snap.travelers, copied)
+            self.assertEqual(snap.travelers[0]["name"], "Updated Name")
+
+#Undo and history test
+class TestUndoHistory(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a traveler, with nothing else to undo."""
+        self.enterContext(use_store(Store()))
+        self.test_traveler = {
+            "id": "test123",
+            "name": "John Doe",
+            "address": "123 Main St",
+            "dob": datetime.date(1990, 1, 1),
+            "emergency_contact": "9876543210",
+            "gov_id_type": "Passport",
+            "gov_id_number": "A1234567"
+        }
+        insert_record("travelers", self.test_traveler)
+
+    @patch('main.get_input', side_effect=["test123", "Updated Name", "", "", "", "", ""])
+    def test_undo_and_redo_update(self, mock_input):
+        """Test undoing and redoing an update to a traveler."""
+        update_traveler()
+        self.assertEqual(travelers[0]["name"], "Updated Name")
+        self.assertTrue(undo())
+        self.assertEqual(travelers[0]["name"], "John Doe")
+        self.assertTrue(redo())
+        self.assertEqual(travelers[0]["name"], "Updated Name")
+
+    def test_undo_delete(self):
+        """Test that undoing a delete restores the record."""
+        remove_record("travelers", self.test_traveler)
+        self.assertEqual(len(travelers), 0)
+        undo()
+        self.assertEqual(travelers, [self.test_traveler])
+
+    def test_user_changes_not_undone(self):
+        """Test that undo skips user accounts, which only administrators may change."""
+        user = insert_record("users", {"id": "undo1", "username": "undouser", "password": "x", "role": "manager"})
+        remove_record("users", user)
+        self.assertTrue(undo())  # Undoes adding the traveler instead
+        self.assertEqual(travelers, [])
+        self.assertFalse(any(user["id"] == "undo1" for user in users))
+        self.assertIn(("users", "undo1"), change_history.records)  # History is still kept
+
+    def test_record_as_of(self):
+        """Test looking up a record as it was before an update."""
+        before_update = time.time()
+        time.sleep(0.01)
+        update_record("travelers", self.test_traveler, {"address": "1 New Road"})
+        old = record_as_of("travelers", "test123", before_update)
+        self.assertEqual(old["address"], "123 Main St")
+        self.assertEqual(record_as_of("travelers", "test123", time.time())["address"], "1 New Road")
+        history = change_history.records[("travelers", "test123")]
+        self.assertEqual(len(history.fields["address"][0]), 2)  # Only the changed field gained a version
+        self.assertEqual(len(history.fields["name"][0]), 1)
+
+#GUI paging test
+class TestGuiPaging(unittest.TestCase):
+
+    def test_rows_are_formatted_page_by_page(self):
+        """Test that only the pages that are viewed are formatted and kept."""
+        records = [{"id": str(i), "name": f"Trip {i}"} for i in range(1000)]
+        columns = [("ID", 50, lambda r: r["id"]), ("Name", 100, lambda r: r["name"])]
+        cache = PageCache(records, columns, page_size=100, max_pages=2)
+        self.assertEqual(cache.row(250), ("250", "Trip 250"))
+        self.assertEqual(list(cache.pages), [2])
+        cache.row(0)
+        cache.row(999)
+        self.assertEqual(list(cache.pages), [0, 9])  # Least recently used page was dropped
+        self.assertEqual(len(cache), 1000)
+
+#Occupancy timeline test
+class TestOccupancyTimeline(unittest.TestCase):
+
+    def test_overlapping_trips(self):
+        """Test daily traveler counts for overlapping trips."""
+        test_trips = [
+            {"start_date": datetime.date(2024, 1, 1), "duration": 3, "travelers": ["a", "b"]},
+            {"start_date": datetime.date(2024, 1, 2), "duration": 1, "travelers": ["c"]},
+            {"start_date": datetime.date(2024, 1, 6), "duration": 2, "travelers": ["d"]},
+            {"start_date": "#", "duration": 5, "travelers": ["e"]},  # No valid date; skipped
+        ]
+        dates, occupancy = compute_occupancy(test_trips)
+        self.assertEqual(str(dates[0]), "2024-01-01")
+        self.assertEqual(len(dates), 7)
+        self.assertEqual(occupancy.tolist(), [2, 3, 2, 0, 0, 1, 1])
+
+    def test_no_trips(self):
+        """Test that no timeline is produced without dated trips."""
+        self.assertEqual(compute_occupancy([]), (None, None))
+
+#Traveler demographics
+class TestDemographics(unittest.TestCase):
+
+    def test_ages_on(self):
+        """Test that ages only go up once the birthday is reached."""
+        dobs, _ = to_datetime64([datetime.date(2000, 3, 15)] * 3)
+        dates, _ = to_datetime64([datetime.date(2020, 3, 14), datetime.date(2020, 3, 15), datetime.date(2021, 1, 1)])
+        self.assertEqual(ages_on(dobs, dates).tolist(), [19, 20, 20])
+
+    def test_age_bands_per_trip(self):
+        """Test current and age-at-departure histograms."""
+        test_travelers = [
+            {"id": "a", "dob": datetime.date(2010, 6, 1)},
+            {"id": "b", "dob": datetime.date(1990, 6, 1)},
+            {"id": "c", "dob": "#"},  # Unknown date of birth; not counted
+        ]
+        test_trips = [
+            {"name": "Trip 1", "start_date": datetime.date(2020, 5, 31), "travelers": ["a", "b", "c"]},
+            {"name": "Trip 2", "start_date": datetime.date(2028, 6, 1), "travelers": ["a"]},
+        ]
+        result = compute_demographics(test_trips, test_travelers, today=datetime.date(2024, 1, 1))
+        self.assertEqual(result["bands"].tolist(), [1, 0, 1, 0, 0, 0])
+        self.assertEqual(result["trip_bands"].tolist(), [[1, 1, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0]])
+        self.assertEqual(result["trip_mean_age"].tolist(), [19.0, 18.0])
+
+#Duplicate traveler detection
+class TestDuplicateTravelers(unittest.TestCase):
+
+    def setUp(self):
+        """Set up travelers that include duplicates."""
+        self.enterContext(use_store(Store()))
+        self.original = {"id": "p1", "name": "John Smith", "address": "1 High St", "dob": datetime.date(1990, 1, 1),
+                         "emergency_contact": "123", "gov_id_type": "Passport", "gov_id_number": "A1234567"}
+        self.similar = dict(self.original, id="p2", name="Jon Smith", gov_id_number="B7654321")
+        self.other = dict(self.original, id="p3", name="Jane Smith", dob=datetime.date(1991, 1, 1),
+                          gov_id_number="C1111111")
+        for traveler in (self.original, self.similar, self.other):
+            insert_record("travelers", traveler)
+        insert_record("trips", {"id": "t1", "name": "Trip", "travelers": ["p2", "p3"], "legs": []})
+        insert_record("trips", {"id": "t2", "name": "Trip 2", "travelers": ["p1", "p2"], "legs": []})
+
+    @patch('main.get_input', side_effect=["John Smith", "1 High St", "123", "passport ", "a123-4567"])
+    @patch('main.get_date_input', return_value=datetime.date(1990, 1, 1))
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_duplicate_gov_id_rejected(self, mock_stdout, mock_date_input, mock_input):
+        """Test that a traveler with an existing government ID is not created."""
+        create_traveler()
+        self.assertEqual(len(travelers), 3)
+        self.assertIn("already exists: John Smith (ID: p1)", mock_stdout.getvalue())
+
+    @patch('main.get_input', side_effect=["p2", "", "", "", "", "", "A1234567"])
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_duplicate_gov_id_update_rejected(self, mock_stdout, mock_input):
+        """Test that a traveler cannot be updated to another traveler's government ID."""
+        update_traveler()
+        self.assertEqual(travelers[1]["gov_id_number"], "B7654321")
+        self.assertIn("already exists: John Smith (ID: p1)", mock_stdout.getvalue())
+
+    def test_duplicate_gov_id_rejected_in_gui(self):
+        """Test that the GUI form checks government IDs when adding and editing travelers."""
+        tab = SimpleNamespace(collection="travelers", table=Mock(), _warn=Mock())
+        values = {key: self.original[key] for key in ("name", "address", "dob", "emergency_contact",
+                                                      "gov_id_type", "gov_id_number")}
+        self.assertIn("(ID: p1)", CollectionTab._create(tab, values))
+        self.assertIn("(ID: p1)", CollectionTab._update(tab, self.similar, {"gov_id_number": "A1234567"}))
+        self.assertEqual(len(travelers), 3)
+        self.assertEqual(travelers[1]["gov_id_number"], "B7654321")
+        self.assertIsNone(CollectionTab._update(tab, self.original, {"address": "2 High St"}))  # Keeps its own ID
+        self.assertEqual(travelers[0]["address"], "2 High St")
+
+    def test_audit_and_merge(self):
+        """Test that similar names with the same date of birth are found and merged."""
+        matches = find_duplicate_travelers()
+        self.assertEqual([(keep['id'], duplicate['id']) for keep, duplicate, _ in matches], [("p1", "p2")])
+        self.assertEqual(merge_travelers(matches[0][0], matches[0][1]), 2)
+        self.assertEqual([traveler['id'] for traveler in travelers], ["p1", "p3"])
+        self.assertEqual(trips[0]["travelers"], ["p1", "p3"])
+        self.assertEqual(trips[1]["travelers"], ["p1"])
+
+#Batch updates
+class TestBatchUpdate(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a few trip legs."""
+        self.enterContext(use_store(Store()))
+        for i in range(4):
+            insert_record("trip_legs", {"id": f"leg{i}", "trip_id": "trip1" if i < 3 else "trip2",
+                                        "start_location": "A", "destination": "B", "transport_provider": "Airline",
+                                        "transport_mode": "Flight", "leg_type": "transfer", "cost": 100})
+
+    def test_update_by_predicate(self):
+        """Test a price change on matching legs with one version bump and one undo step."""
+        version = collection_versions["trip_legs"]
+        updated = batch_update("trip_legs", {"cost": lambda leg: leg["cost"] + 50},
+                               predicate=lambda leg: leg["trip_id"] == "trip1")
+        self.assertEqual(len(updated), 3)
+        self.assertEqual([leg["cost"] for leg in trip_legs], [150, 150, 150, 100])
+        self.assertEqual(collection_versions["trip_legs"], version + 1)
+        self.assertEqual(len(legs_by_trip.lookup("trip1")), 3)
+        self.assertTrue(undo())
+        self.assertEqual([leg["cost"] for leg in trip_legs], [100, 100, 100, 100])
+
+    def test_invalid_batch_changes_nothing(self):
+        """Test that one invalid value or unknown ID rejects the whole batch."""
+        version = collection_versions["trip_legs"]
+        with self.assertRaises(ValueError):
+            batch_update("trip_legs", {"cost": lambda leg: -1 if leg["id"] == "leg2" else 10}, ids=["leg1", "leg2"])
+        with self.assertRaises(ValueError):
+            batch_update("trip_legs", {"cost": 10}, ids=["leg1", "missing"])
+        with self.assertRaises(ValueError):
+            batch_update("trip_legs", {"trip_id": "trip2"}, ids=["leg1"])
+        self.assertEqual([leg["cost"] for leg in trip_legs], [100, 100, 100, 100])
+        self.assertEqual(collection_versions["trip_legs"], version)
+
+#Archiving completed trips
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        """Set up one finished and one upcoming trip in a temporary archive folder."""
+        self.enterContext(use_store(Store()))
+        self.archive_dir = tempfile.mkdtemp()
+        for trip_id, start in (("old", datetime.date(2024, 1, 1)), ("new", datetime.date(2024, 6, 1))):
+            insert_record("trips", {"id": trip_id, "name": f"Trip {trip_id}", "start_date": start, "duration": 5,
+                                    "coordinator": "c1", "contact": "123", "travelers": ["p1"], "legs": []})
+            insert_record("trip_legs", {"id": f"{trip_id}-leg", "trip_id": trip_id, "start_location": "A",
+                                        "destination": "B", "transport_provider": "Airline",
+                                        "transport_mode": "Flight", "leg_type": "transfer", "cost": 100})
+
+    def tearDown(self):
+        """Clean up after each test."""
+        shutil.rmtree(self.archive_dir)
+
+    def test_archive_completed_trips(self):
+        """Test that finished trips and their legs move to a compressed file per period."""
+        undo_depth = len(change_history.undo_stack)
+        archived = archive_completed_trips(datetime.date(2024, 3, 1), self.archive_dir)
+        self.assertEqual(archived, {"2024-01": 1})
+        self.assertEqual([trip["id"] for trip in trips], ["new"])
+        self.assertEqual([leg["id"] for leg in trip_legs], ["new-leg"])
+        self.assertEqual(len(change_history.undo_stack), undo_depth)
+
+        (trip, legs), = list(read_archive(self.archive_dir))
+        self.assertEqual(trip["start_date"], datetime.date(2024, 1, 1))
+        self.assertEqual(trip["travelers"], ["p1"])
+        self.assertEqual([leg["id"] for leg in legs], ["old-leg"])
+
+    def test_archive_twice_after_interruption(self):
+        """Test that trips archived again after an interrupted run are stored once."""
+        with patch('main.remove_records', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                archive_completed_trips(datetime.date(2024, 3, 1), self.archive_dir)
+        self.assertEqual(len(trips), 2)  # The run stopped before the trips were removed
+        archive_completed_trips(datetime.date(2024, 3, 1), self.archive_dir)
+        archive_completed_trips(datetime.date(2024, 7, 1), self.archive_dir)
+        self.assertEqual(sorted(trip["id"] for trip, _ in read_archive(self.archive_dir)), ["new", "old"])
+        self.assertEqual(sorted(os.listdir(self.archive_dir)), ["trips-2024-01.jsonl.gz", "trips-2024-06.jsonl.gz"])
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_reports_include_archive(self, mock_stdout):
+        """Test that reports stream archived trips only when asked to."""
+        archive_completed_trips(datetime.date(2024, 3, 1), self.archive_dir)
+        with patch('main.ARCHIVE_DIR', self.archive_dir), patch('main.save_chart'):
+            self.assertEqual(generate_financial_report()["labels"], ["Trip new"])
+            self.assertEqual(generate_financial_report(include_archive=True)["labels"], ["Trip new", "Trip old"])
+
+#Chart aggregation
+class TestChartAggregation(unittest.TestCase):
+
+    def test_top_n_with_other(self):
+        """Test that the largest values are kept and the rest are summed."""
+        labels, values = top_n_series(["a", "b", "c", "d"], [5, 40, 10, 30], n=2)
+        self.assertEqual(labels, ["b", "d", "Other (2)"])
+        self.assertEqual(values, [40, 30, 15])
+
+    def test_histogram(self):
+        """Test equal-width cost ranges and one bar per small whole number."""
+        labels, counts = histogram_series([0, 10, 20, 95, 100], bins=2, unit="$")
+        self.assertEqual(labels, ["$0-$50", "$50-$100"])
+        self.assertEqual(counts, [3, 2])
+        self.assertEqual(histogram_series([2, 4, 4]), (["2", "3", "4"], [1, 0, 2]))
+
+    def test_chart_size_is_constant(self):
+        """Test that aggregated charts have the same size for any number of trips."""
+        chart = {"kind": "pie", "figsize": (8, 8), "title": "Travelers by Trip",
+                 "labels": [f"Trip {i}" for i in range(5000)], "values": list(range(5000))}
+        self.assertEqual(len(aggregate_chart(chart, "auto", "Travelers")["values"]), 11)
+        self.assertEqual(len(aggregate_chart(chart, "histogram", "Travelers")["values"]), 10)
+
+#Session replay
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a session that logs in, adds a traveler and exits."""
+        self.enterContext(use_store(Store()))
+        self.user = insert_record("users", {"id": "replay1", "username": "replayer", "password": "secret",
+                                            "role": "administrator"})
+        self.steps = [
+            {"prompt": "Username: ", "input": "replayer"}, {"prompt": "Password: ", "input": "secret"},
+            {"prompt": "\nEnter your choice: ", "input": "2"}, {"prompt": "\nEnter your choice: ", "input": "1"},
+            {"prompt": "Full Name: ", "input": "Jane Doe"}, {"prompt": "Address: ", "input": "456 Elm St"},
+            {"prompt": "Date of Birth (DD/MM/YYYY): ", "input": "01/01/1995"},
+            {"prompt": "Emergency Contact: ", "input": "1234567890"},
+            {"prompt": "Government ID Type: ", "input": "Passport"},
+            {"prompt": "Government ID Number: ", "input": "R1234567"},
+            {"prompt": "\nEnter your choice: ", "input": "6"}, {"prompt": "\nEnter your choice: ", "input": "8"},
+        ]
+
+    def test_replay_through_menus(self):
+        """Test that a session runs through the real menus with every action timed."""
+        result = replay_session(self.steps)
+        self.assertTrue(result["completed"])
+        self.assertEqual(result["mismatches"], 0)
+        self.assertEqual(len(result["actions"]), len(self.steps))
+        self.assertEqual(travelers[0]["name"], "Jane Doe")
+        self.assertIn("Traveler 'Jane Doe' created successfully", result["output"])
+        names = [row[0] for row in summarize(result["actions"])]
+        self.assertIn("Traveler Management > Enter your choice: [1]", names)
+
+    def test_change_feed_is_opt_in(self):
+        """Test that the program only writes a change feed when a path is configured."""
+        with patch('main.CHANGE_FEED_PATH', None), patch('main.enable_change_feed') as mock_enable:
+            self.assertTrue(replay_session(self.steps)["completed"])
+        mock_enable.assert_not_called()
+        with patch('main.CHANGE_FEED_PATH', "feed.jsonl"), patch('main.enable_change_feed') as mock_enable:
+            replay_session(self.steps)
+        self.assertNotEqual(mock_enable.call_args[0][0], "feed.jsonl")  # Replays use a temporary feed
+
+    def test_strict_and_short_scripts(self):
+        """Test prompt checking and scripts that end before the program does."""
+        self.steps[1]["prompt"] = "Passcode: "
+        with self.assertRaises(ReplayMismatch):
+            replay_session(self.steps, strict=True)
+        result = replay_session(self.steps[:4])
+        self.assertFalse(result["completed"])
+
+#Login and sessions
+class TestLogin(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a user with a legacy plain text password."""
+        self.enterContext(use_store(Store()))
+        self.user = insert_record("users", {"id": "login1", "username": "loginuser", "password": "secret",
+                                            "role": "coordinator"})
+
+    def test_legacy_password_is_upgraded(self):
+        """Test that a plain text password is replaced by a hash on login."""
+        self.assertIsNone(check_credentials("loginuser", "wrong"))
+        self.assertIsNone(check_credentials("nobody", "secret"))
+        self.assertEqual(check_credentials("loginuser", "secret")["id"], "login1")
+        stored = next(user for user in users if user["id"] == "login1")["password"]
+        self.assertTrue(is_password_hash(stored))
+        self.assertNotIn("secret", stored)
+        self.assertEqual(check_credentials("loginuser", "secret")["id"], "login1")
+
+    def test_passwords_kept_out_of_history(self):
+        """Test that neither the old plain text password nor its hash can be read from the record history."""
+        before_upgrade = time.time()
+        time.sleep(0.01)
+        check_credentials("loginuser", "secret")
+        self.assertEqual(record_as_of("users", "login1", before_upgrade)["username"], "loginuser")
+        self.assertNotIn("password", record_as_of("users", "login1", before_upgrade))
+        self.assertNotIn("password", record_as_of("users", "login1", time.time()))
+        with patch('main.get_input', side_effect=["users", "login1", ""]), \
+                patch('sys.stdout', new_callable=StringIO) as stdout:
+            record_history_menu()
+        self.assertIn("username: loginuser", stdout.getvalue())
+        self.assertNotIn("password", stdout.getvalue())
+
+    def test_default_admin_password_is_hashed(self):
+        """Test that the default administrator is created with a hashed password."""
+        self.assertTrue(is_password_hash(DEFAULT_ADMIN_PASSWORD))
+        self.assertTrue(verify_password("admin123", DEFAULT_ADMIN_PASSWORD))
+
+    def test_gui_login_in_worker_thread(self):
+        """Test that the login window checks the password off the UI thread, in the window's store."""
+        frame = SimpleNamespace(button=MagicMock(), results=queue.Queue(), after=Mock(), on_login=Mock(),
+                                username=Mock(get=Mock(return_value="loginuser")),
+                                password=Mock(get=Mock(return_value="secret")), _poll_result=Mock())
+        frame._worker = lambda *args: LoginFrame._worker(frame, *args)
+        checked_in = []
+        check = lambda *args: checked_in.append(threading.current_thread()) or check_credentials(*args)
+        with patch('main.check_credentials', side_effect=check):
+            LoginFrame._login(frame)
+            deadline = time.time() + 10
+            while frame.results.empty() and time.time() < deadline:
+                time.sleep(0.01)
+        frame.button.config.assert_called_once_with(state="disabled")
+        (thread,) = checked_in
+        self.assertIsNot(thread, threading.current_thread())
+        frame.on_login.assert_not_called()  # The result is handed over on the next poll of the UI thread
+        LoginFrame._poll_result(frame)
+        self.assertEqual(frame.on_login.call_args[0][0]["id"], "login1")
+
+    def test_session_tokens(self):
+        """Test that a token identifies the user until it is ended."""
+        self.assertIsNone(authenticate("loginuser", "wrong"))
+        token = authenticate("loginuser", "secret")
+        self.assertEqual(validate_session_token(token)["id"], "login1")
+        self.assertIsNone(validate_session_token(token, roles=["administrator"]))
+        end_session(token)
+        self.assertIsNone(validate_session_token(token))
+
+#Coordinator workload
+class TestCoordinatorWorkload(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a coordinator with trips referring to them by ID and by username."""
+        self.enterContext(use_store(Store()))
+        self.user = insert_record("users", {"id": "coord1", "username": "alice", "password": "x",
+                                            "role": "coordinator"})
+        for trip_id, coordinator in (("t1", "coord1"), ("t2", "alice"), ("t3", "Someone Else")):
+            insert_record("trips", {"id": trip_id, "name": trip_id, "start_date": datetime.date(2024, 1, 1),
+                                    "duration": 3, "coordinator": coordinator, "contact": "123",
+                                    "travelers": ["p1", "p2"], "legs": []})
+        insert_record("trip_legs", {"id": "l1", "trip_id": "t1", "start_location": "A", "destination": "B",
+                                    "transport_provider": "Airline", "transport_mode": "Flight",
+                                    "leg_type": "transfer", "cost": 250})
+
+    def test_workload_totals(self):
+        """Test totals per coordinator, including trips that match no user."""
+        workload, missing = compute_coordinator_workload()
+        self.assertEqual(workload["coord1"], {"coordinator": "alice", "trips": 2, "travelers": 4, "legs": 1,
+                                              "cost": 250})
+        self.assertEqual(missing, set())
+        self.assertEqual(workload["Someone Else"]["trips"], 1)
+        self.assertEqual(sorted(trip["id"] for trip in trips_for_coordinator(self.user)), ["t1", "t2"])
+
+    @patch('gui.messagebox')
+    def test_gui_links_coordinator(self, mock_messagebox):
+        """Test that trips saved in the GUI store the coordinator's user ID, as the console does."""
+        tab = SimpleNamespace(collection="trips", table=Mock(), _warn=Mock())
+        tab._link_coordinator = lambda value: CollectionTab._link_coordinator(tab, value)
+        values = {"name": "t4", "start_date": datetime.date(2024, 2, 1), "duration": 2, "coordinator": "alice",
+                  "contact": "123"}
+        self.assertIsNone(CollectionTab._create(tab, values))
+        self.assertEqual(trips[-1]["coordinator"], "coord1")
+        CollectionTab._update(tab, trips[2], {**values, "coordinator": "alice"})
+        self.assertEqual(trips[2]["coordinator"], "coord1")
+        mock_messagebox.showwarning.assert_not_called()
+        CollectionTab._update(tab, trips[2], {**values, "coordinator": "Nobody"})
+        self.assertEqual(trips[2]["coordinator"], "Nobody")
+        self.assertIn("no user matches coordinator 'Nobody'", mock_messagebox.showwarning.call_args[0][1])
+
+    def test_index_follows_updates(self):
+        """Test that reassigning and deleting trips is reflected immediately."""
+        update_record("trips", trips[2], {"coordinator": "coord1"})
+        remove_record("trips", trips[0])
+        self.assertEqual(compute_coordinator_workload()[0]["coord1"]["trips"], 2)
+        self.assertNotIn("Someone Else", compute_coordinator_workload()[0])
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_costs_in_several_currencies(self, mock_stdout):
+        """Test that leg costs in other currencies are converted before they are added up."""
+        tmp = self.enterContext(tempfile.TemporaryDirectory())
+        rates_path = os.path.join(tmp, "rates.csv")
+        with open(rates_path, "w") as f:
+            f.write("currency,rate\nUSD,1\nEUR,1.1\n")
+        self.enterContext(patch("main.rate_table", RateTable(rates_path)))
+        insert_record("trip_legs", {"id": "l2", "trip_id": "t2", "start_location": "B", "destination": "C",
+                                    "transport_provider": "Rail", "transport_mode": "Train",
+                                    "leg_type": "transfer", "cost": 100, "currency": "EUR"})
+        insert_record("trip_legs", {"id": "l3", "trip_id": "t2", "start_location": "C", "destination": "D",
+                                    "transport_provider": "Rail", "transport_mode": "Train",
+                                    "leg_type": "transfer", "cost": 100, "currency": "XYZ"})
+        workload, missing = compute_coordinator_workload()
+        self.assertAlmostEqual(workload["coord1"]["cost"], 360)
+        self.assertEqual(missing, {"XYZ"})
+        view_coordinator_workload()
+        self.assertIn("Total Cost: $360", mock_stdout.getvalue())
+        self.assertIn("no exchange rate for XYZ", mock_stdout.getvalue())
+
+#Queries
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        """Set up two trips with legs."""
+        self.enterContext(use_store(Store()))
+        for trip_id, start, coordinator in (("t1", datetime.date(2024, 6, 10), "alice"),
+                                            ("t2", datetime.date(2024, 8, 1), "bob")):
+            insert_record("trips", {"id": trip_id, "name": trip_id, "start_date": start, "duration": 3,
+                                    "coordinator": coordinator, "contact": "123", "travelers": [], "legs": []})
+        for leg_id, trip_id, mode, cost in (("l1", "t1", "Train", 600), ("l2", "t1", "Train", 900),
+                                            ("l3", "t1", "Flight", 700), ("l4", "t2", "Train", 800)):
+            insert_record("trip_legs", {"id": leg_id, "trip_id": trip_id, "start_location": "A", "destination": "B",
+                                        "transport_provider": "Rail", "transport_mode": mode,
+                                        "leg_type": "transfer", "cost": cost})
+
+    def test_join_filter_order(self):
+        """Test filtering legs on their own and their trip's fields, with ordering, limit and projection."""
+        query = (Query("trip_legs").where("transport_mode", "==", "train").where("cost", ">", 500).join("trips")
+                 .where("trip.start_date", "between", (datetime.date(2024, 6, 1), datetime.date(2024, 6, 30)))
+                 .order_by("cost", descending=True).limit(5).select("id", "trip.coordinator"))
+        self.assertEqual(list(query), [{"id": "l2", "trip.coordinator": "alice"},
+                                       {"id": "l1", "trip.coordinator": "alice"}])
+
+    def test_explain_uses_index(self):
+        """Test that the planner picks an index over a full scan, and sees new records."""
+        query = Query("trips").where("coordinator", "==", "bob")
+        self.assertIn("Access: index lookup trips.coordinator", query.explain())
+        self.assertEqual([trip["id"] for trip in query], ["t2"])
+        update_record("trips", trips[0], {"coordinator": "bob"})
+        self.assertEqual(len(list(Query("trips").where("coordinator", "==", "bob"))), 2)
+        self.assertIn("range index trip_legs.cost", Query("trip_legs").where("cost", ">=", 900).explain())
+
+    def test_join_from_trips_has_no_duplicates(self):
+        """Test that trips found through several matching legs are returned once per leg."""
+        rows = list(Query("trips").join("trip_legs").where("leg.transport_mode", "==", "Train"))
+        self.assertEqual(sorted(row["leg.id"] for row in rows), ["l1", "l2", "l4"])
+
+#Cost anomaly detection
+class TestCostAnomalies(unittest.TestCase):
+
+    def setUp(self):
+        """Set up 30 train legs costing between $80 and $120."""
+        self.enterContext(use_store(Store()))
+        for i in range(30):
+            insert_record("trip_legs", {"id": f"l{i}", "trip_id": "t1", "start_location": "A", "destination": "B",
+                                        "transport_provider": "Rail", "transport_mode": "Train",
+                                        "leg_type": "transfer", "cost": 80 + (i * 7) % 41})
+
+    def test_flags_extra_zero(self):
+        """Test that a cost ten times the usual one is flagged and a normal cost is not."""
+        leg = {**trip_legs[0], "id": "new", "cost": 1000}
+        warnings = check_leg_cost(leg)
+        self.assertEqual(len(warnings), 2)  # Once for the mode and once for the provider
+        self.assertIn("unusually high", warnings[0])
+        self.assertEqual(check_leg_cost({**leg, "cost": 105}), [])
+        self.assertEqual(check_leg_cost({**leg, "transport_mode": "Ferry", "transport_provider": "Boats"}), [])
+
+    def test_statistics_follow_changes(self):
+        """Test that updates and deletes keep the running statistics equal to a fresh computation."""
+        check_leg_cost(trip_legs[0])  # Build the statistics
+        update_record("trip_legs", trip_legs[3], {"cost": 1500})
+        remove_record("trip_legs", trip_legs[5])
+        costs = [math.log10(leg["cost"] + 1) for leg in trip_legs]
+        key = ("transport_mode", leg_categories["transport_mode"].find("Train"), currencies.find("USD"))
+        count, mean, m2 = leg_cost_stats.groups[key]
+        self.assertEqual(count, 29)
+        self.assertAlmostEqual(mean, sum(costs) / len(costs))
+        self.assertAlmostEqual(m2, sum((cost - mean) ** 2 for cost in costs))
+        self.assertEqual([leg["id"] for leg, _ in audit_leg_costs()], ["l3"])
+
+    def test_audit_reads_a_snapshot(self):
+        """Test that the audit shares the snapshot copy of the legs and ignores changes made while it runs."""
+        update_record("trip_legs", trip_legs[3], {"cost": 1500})
+        with read_snapshot() as snap:
+            audit = audit_leg_costs()
+            leg, _ = next(audit)
+            self.assertIs(leg, snap.trip_legs[3])
+            insert_record("trip_legs", {**trip_legs[0], "id": "late", "cost": 2000})
+            self.assertEqual(list(audit), [])  # The late leg is not part of this audit
+
+#Currencies
+class TestCurrencies(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a rate table and a trip with legs in dollars and euros."""
+        self.enterContext(use_store(Store()))
+        self.tmp = tempfile.mkdtemp()
+        self.rates_path = os.path.join(self.tmp, "rates.csv")
+        self.write_rates(1.1)
+        self.patcher = patch("main.rate_table", RateTable(self.rates_path))
+        self.patcher.start()
+        self.trip = insert_record("trips", {"id": "t1", "name": "Tour", "start_date": datetime.date(2024, 1, 1),
+                                            "duration": 3, "coordinator": "c", "contact": "1", "travelers": [],
+                                            "legs": []})
+        for leg_id, cost, currency in (("l1", 100, "USD"), ("l2", 100, "EUR")):
+            insert_record("trip_legs", {"id": leg_id, "trip_id": "t1", "start_location": "A", "destination": "B",
+                                        "transport_provider": "Rail", "transport_mode": "Train",
+                                        "leg_type": "transfer", "cost": cost, "currency": currency})
+
+    def tearDown(self):
+        """Clean up after each test."""
+        self.patcher.stop()
+        shutil.rmtree(self.tmp)
+
+    def write_rates(self, euro):
+        """Write the rate table with the given value of one euro in dollars."""
+        with open(self.rates_path, "w") as f:
+            f.write(f"currency,rate\nUSD,1\nEUR,{euro}\n")
+        os.utime(self.rates_path, ns=(0, int(euro * 10 ** 9)))  # Make each version look modified
+
+    def test_group_totals(self):
+        """Test converting groups of legs, leaving out currencies without a rate."""
+        legs = [{"cost": 10, "currency": "USD"}, {"cost": 10, "currency": "EUR"}, {"cost": 5, "currency": "XYZ"}]
+        totals, missing = convert_group_totals([legs[:2], legs[2:], []])
+        self.assertEqual([round(total, 2) for total in totals], [21.0, 0.0, 0.0])
+        self.assertEqual(missing, {"XYZ"})
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_financial_report_follows_rates(self, mock_stdout):
+        """Test that the financial report converts costs and is recomputed when the rates change."""
+        generate_financial_report()
+        self.assertIn("Tour: $210", mock_stdout.getvalue())
+        self.write_rates(1.2)
+        generate_financial_report()
+        self.assertIn("Total Revenue: $220", mock_stdout.getvalue())
+        self.assertEqual(report_cache_stats["hits"], 0)
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_missing_rate_file(self, mock_stdout):
+        """Test that a missing rate file is reported once and euro costs are then left out with a warning."""
+        os.remove(self.rates_path)
+        generate_financial_report()
+        generate_financial_report()
+        output = mock_stdout.getvalue()
+        self.assertEqual(output.count(f"exchange rate file '{self.rates_path}' not found"), 1)
+        self.assertIn("Tour: $100", output)
+        self.assertIn(f"no exchange rate for EUR; those costs are not included until rates are added to "
+                      f"'{self.rates_path}'", output)
+
+    @unittest.skipIf("TMS_RATES" in os.environ, "a rate file is configured")
+    def test_default_rate_file(self):
+        """Test that the default rate file is found next to the program, whatever the working directory."""
+        self.assertEqual(RATES_PATH, os.path.join(os.path.dirname(os.path.abspath(__file__)), "exchange_rates.csv"))
+
+    def test_itinerary(self):
+        """Test that itineraries show each leg's own currency and a converted total."""
+        text = "\n".join(format_itinerary(self.trip, list(trip_legs)))
+        self.assertIn("Cost: \u20ac100", text)
+        self.assertIn("Total Trip Cost: $210 (converted to USD)", text)
+
+#Columnar export
+class TestColumnarExport(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a small dataset and an output directory."""
+        self.enterContext(use_store(Store()))
+        self.tmp = tempfile.mkdtemp()
+        self.data = {
+            "trips": [{"id": f"t{i}", "name": f"Trip {i}", "start_date": datetime.date(2024, 1, i + 1),
+                       "duration": i, "coordinator": "c1", "contact": "1", "travelers": ["p1"] * i,
+                       "legs": [f"l{i}"]} for i in range(5)],
+            "trip_legs": [{"id": f"l{i}", "trip_id": f"t{i}", "start_location": "A", "destination": "B",
+                           "transport_provider": "Rail", "transport_mode": ["Train", "Bus"][i % 2],
+                           "leg_type": "transfer", "cost": 100 * i, "currency": "USD"} for i in range(5)],
+            "travelers": [{"id": "p1", "name": "Ann", "address": "x", "dob": None, "emergency_contact": "1",
+                           "gov_id_type": "Passport", "gov_id_number": "A1"}],
+            "users": [{"id": "u1", "username": "ann", "password": "secret", "role": "coordinator"}],
+        }
+
+    def tearDown(self):
+        """Clean up after each test."""
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        """Test that columns reload memory-mapped, with encoded strings, dates and lists, in small chunks."""
+        export_columnar(self.tmp, self.data, chunk_size=2)
+        loaded = load_columnar(self.tmp)
+        legs, trips_columns = loaded["trip_legs"], loaded["trips"]
+        self.assertIsInstance(legs["cost"], np.memmap)
+        self.assertEqual(legs["cost"].tolist(), [0, 100, 200, 300, 400])
+        self.assertEqual(legs.decode("transport_mode").tolist(), ["Train", "Bus", "Train", "Bus", "Train"])
+        self.assertEqual(len(legs.values["transport_mode"]), 2)
+        self.assertEqual(str(trips_columns["start_date"][2]), "2024-01-03")
+        self.assertEqual(trips_columns.items("travelers", 3).tolist(), ["p1"] * 3)
+        self.assertTrue(np.isnat(loaded["travelers"]["dob"][0]))
+        self.assertNotIn("password", loaded["users"].fields)
+
+    def test_npz_and_csv(self):
+        """Test the .npz bundles and the CSV fallback."""
+        export_columnar(self.tmp, self.data, chunk_size=2)
+        with np.load(os.path.join(self.tmp, "trip_legs.npz")) as bundle:
+            self.assertEqual(bundle["cost"].tolist(), [0, 100, 200, 300, 400])
+        with open(os.path.join(self.tmp, "trips.csv"), newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[2]["travelers"], "p1;p1")
+        self.assertEqual(rows[0]["start_date"], "2024-01-01")
+        shutil.rmtree(os.path.join(self.tmp, "trip_legs"))  # Without the .npy files, the bundle is used
+        self.assertEqual(load_columnar(self.tmp)["trip_legs"]["cost"].tolist(), [0, 100, 200, 300, 400])
+
+#Leg timeline
+class TestLegTimeline(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a trip with three legs entered out of order and one without times."""
+        self.enterContext(use_store(Store()))
+        trips.append({"id": "t1", "name": "Tour", "start_date": datetime.date(2024, 5, 1), "duration": 3,
+                      "coordinator": "c1", "contact": "1", "travelers": [], "legs": []})
+        for leg_id, hour in (("b", 14), ("u", None), ("a", 8), ("c", 20)):
+            departure = datetime.datetime(2024, 5, 1, hour) if hour is not None else None
+            insert_record("trip_legs", self.leg(leg_id, departure))
+
+    def leg(self, leg_id, departure, hours=2):
+        """Build a leg of trip t1."""
+        return {"id": leg_id, "trip_id": "t1", "start_location": leg_id, "destination": leg_id + "'",
+                "transport_provider": "Rail", "transport_mode": "Train", "leg_type": "transfer", "cost": 10,
+                "departure": departure, "arrival": departure + datetime.timedelta(hours=hours) if departure else None}
+
+    def order(self):
+        return [leg['id'] for leg in leg_timeline.lookup("t1")]
+
+    def test_order_follows_changes(self):
+        """Test that the timeline stays in departure order through inserts, updates and deletes."""
+        self.assertEqual(self.order(), ["a", "b", "c", "u"])
+        update_record("trip_legs", trip_legs[0], {"departure": datetime.datetime(2024, 5, 1, 6)})
+        self.assertEqual(self.order(), ["b", "a", "c", "u"])
+        update_record("trip_legs", trip_legs[1], {"departure": datetime.datetime(2024, 5, 1, 23)})
+        self.assertEqual(self.order(), ["b", "a", "c", "u"])
+        insert_record("trip_legs", self.leg("d", datetime.datetime(2024, 5, 1, 10)))
+        self.assertEqual(self.order(), ["b", "a", "d", "c", "u"])
+        remove_record("trip_legs", trip_legs[0])
+        self.assertEqual(self.order(), ["a", "d", "c", "u"])
+        trip_legs.append(self.leg("e", datetime.datetime(2024, 5, 1, 1)))  # Direct edits trigger a rebuild
+        self.assertEqual(self.order(), ["e", "a", "d", "c", "u"])
+
+    def test_gaps_and_overlaps(self):
+        """Test that overlapping legs and long idle times are reported."""
+        issues = timeline_issues(leg_timeline.lookup("t1"))
+        self.assertEqual(issues, [])  # 08-10, 14-16, 20-22 leave gaps under 12 hours
+        overlapping = self.leg("x", datetime.datetime(2024, 5, 1, 15), hours=6)
+        self.assertEqual(len(check_leg_schedule(overlapping)), 2)  # Overlaps b, and c by one hour
+        self.assertEqual(check_leg_schedule(self.leg("y", datetime.datetime(2024, 5, 1, 17))), [])
+        insert_record("trip_legs", self.leg("z", datetime.datetime(2024, 5, 2, 18)))
+        kinds = [issue[0] for issue in timeline_issues(leg_timeline.lookup("t1"))]
+        self.assertEqual(kinds, ["gap"])
+
+    def test_itinerary_in_time_order(self):
+        """Test that the itinerary lists legs by departure time."""
+        lines = format_itinerary(trips[0], list(leg_timeline.lookup("t1")))
+        routes = [line for line in lines if line.startswith("- ")]
+        self.assertEqual(routes[:3], ["- a to a' (Train)", "- b to b' (Train)", "- c to c' (Train)"])
+
+    @patch('main.get_input', side_effect=["01/05/2024 10:00", "01/05/2024 09:00", "01/05/2024 12:00"])
+    def test_arrival_after_departure(self, mock_input):
+        """Test that an arrival before the departure is asked for again."""
+        self.assertEqual(get_leg_times(), (datetime.datetime(2024, 5, 1, 10), datetime.datetime(2024, 5, 1, 12)))
+
+    @patch('gui.messagebox')
+    def test_gui_form_rejects_arrival_before_departure(self, mock_messagebox):
+        """Test that the GUI leg form shows an error instead of saving an arrival before the departure."""
+        times = {"departure": "01/05/2024 10:00", "arrival": "01/05/2024 09:00"}
+        form = SimpleNamespace(fields=[field for field in GUI_FIELDS["trip_legs"] if field[0] in times],
+                               entries={key: Mock(get=Mock(return_value=text)) for key, text in times.items()},
+                               on_save=Mock(return_value=None), destroy=Mock())
+        RecordForm._save(form)
+        form.on_save.assert_not_called()
+        self.assertIn("arrival cannot be before", mock_messagebox.showerror.call_args[0][1])
+        form.entries["arrival"].get.return_value = "01/05/2024 12:00"
+        RecordForm._save(form)
+        form.destroy.assert_called_once()
+
+#Budget what-if scenarios
+class TestBudgetWhatIf(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a June trip and a July trip, each with a train leg and a hotel."""
+        self.enterContext(use_store(Store()))
+        for trip_id, month, travelers_count in (("june", 6, 2), ("july", 7, 3)):
+            insert_record("trips", {"id": trip_id, "name": trip_id, "start_date": datetime.date(2024, month, 10),
+                                    "duration": 3, "coordinator": "c1", "contact": "1",
+                                    "travelers": [f"p{i}" for i in range(travelers_count)], "legs": []})
+            for mode, cost in (("Train", 100), ("Hotel", 300)):
+                insert_record("trip_legs", {"id": f"{trip_id}-{mode}", "trip_id": trip_id, "start_location": "A",
+                                            "destination": "B", "transport_provider": "P", "transport_mode": mode,
+                                            "leg_type": "transfer", "cost": cost, "currency": "USD"})
+        with read_snapshot() as snap:
+            self.model = BudgetModel(trips_with_legs(snap))
+
+    def test_single_scenario(self):
+        """Test a rail price rise plus travelers added to June trips."""
+        result = self.model.simulate([
+            {"transport_mode": "train", "cost_factor": 1.5},
+            {"start": datetime.date(2024, 6, 1), "end": datetime.date(2024, 6, 30), "travelers_add": 5,
+             "cost_add": 10},
+        ])
+        self.assertEqual(result["baseline_cost"], 800)
+        self.assertEqual(result["baseline_travelers"], 5)
+        self.assertEqual(result["total_cost"].tolist(), [800 + 100 + 20])  # Two June legs get 10 each
+        self.assertEqual(result["travelers"].tolist(), [10])
+        self.assertEqual(result["legs_selected"], [2, 2])
+        self.assertEqual(result["trips_selected"], [2, 1])
+        self.assertEqual(len(trip_legs), 4)
+        self.assertEqual(trip_legs[0]["cost"], 100)  # The live data is unchanged
+
+    def test_many_scenarios(self):
+        """Test that per-scenario arrays give one result per scenario, matching a loop over scenarios."""
+        rises = np.linspace(1.0, 2.0, 11)
+        adjustments = [{"transport_mode": "Train", "cost_factor": rises},
+                       {"transport_mode": "Train", "cost_factor": 2.0}, {"leg_type": "transfer", "cost_add": 1}]
+        result = self.model.simulate(adjustments)
+        expected = [200 * rise * 2 + 600 + 4 for rise in rises]
+        np.testing.assert_allclose(result["total_cost"], expected)
+        np.testing.assert_allclose(result["cost_per_traveler"], np.array(expected) / 5)
+        self.assertEqual(self.model.simulate([])["total_cost"].tolist(), [800])
+
+    @patch('main.get_input', side_effect=["Train", "", "", "", "", "10", "", "", "", "n"])
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_menu(self, mock_stdout, mock_input):
+        """Test the what-if menu with a 10% rail price rise."""
+        what_if_menu()
+        output = mock_stdout.getvalue()
+        self.assertIn("Adjustment 1 selects 2 leg(s) on 2 trip(s)", output)
+        self.assertIn("50th percentile: $820 (+2.5%)", output)
+
+#Emergency contact roster
+class TestEmergencyRoster(unittest.TestCase):
+
+    def setUp(self):
+        """Set up two overlapping trips sharing a traveler, with legs in different cities."""
+        self.enterContext(use_store(Store()))
+        self.tmp = tempfile.mkdtemp()
+        for traveler_id, name in (("p1", "Ann"), ("p2", "Bob"), ("p3", "Cy")):
+            insert_record("travelers", {"id": traveler_id, "name": name, "address": "x", "dob": None,
+                                        "emergency_contact": f"07{traveler_id}", "gov_id_type": "Passport",
+                                        "gov_id_number": traveler_id})
+        for trip_id, day, duration, members, city in (("t1", 1, 5, ["p1", "p2"], "Paris"),
+                                                       ("t2", 4, 3, ["p2", "p3"], "Rome")):
+            insert_record("trips", {"id": trip_id, "name": trip_id, "start_date": datetime.date(2024, 6, day),
+                                    "duration": duration, "coordinator": "c1", "contact": "1",
+                                    "travelers": members, "legs": []})
+            insert_record("trip_legs", {"id": f"{trip_id}-leg", "trip_id": trip_id, "start_location": "London",
+                                        "destination": city, "transport_provider": "Rail",
+                                        "transport_mode": "Train", "leg_type": "transfer", "cost": 10})
+
+    def tearDown(self):
+        """Clean up after each test."""
+        shutil.rmtree(self.tmp)
+
+    def names(self, roster):
+        return [traveler['name'] for traveler, _ in roster]
+
+    def test_by_date(self):
+        """Test that trips are active from their start date for `duration` days, and travelers are listed once."""
+        self.assertEqual(self.names(emergency_roster(datetime.date(2024, 6, 3))), ["Ann", "Bob"])
+        roster = emergency_roster(datetime.date(2024, 6, 5))
+        self.assertEqual(sorted(self.names(roster)), ["Ann", "Bob", "Cy"])
+        self.assertEqual(sorted(dict((t['id'], ids) for t, ids in roster)["p2"]), ["t1", "t2"])
+        self.assertEqual(self.names(emergency_roster(datetime.date(2024, 6, 6))), ["Bob", "Cy"])
+        self.assertEqual(emergency_roster(datetime.date(2024, 6, 7)), [])
+
+    def test_by_location(self):
+        """Test rosters for a location, alone and together with a date."""
+        self.assertEqual(self.names(emergency_roster(location="rome")), ["Bob", "Cy"])
+        self.assertEqual(sorted(self.names(emergency_roster(location="London"))), ["Ann", "Bob", "Cy"])
+        self.assertEqual(self.names(emergency_roster(datetime.date(2024, 6, 2), "London")), ["Ann", "Bob"])
+        self.assertEqual(emergency_roster(datetime.date(2024, 6, 2), "Rome"), [])
+        self.assertEqual(emergency_roster(location="Oslo"), [])
+        with self.assertRaises(ValueError):
+            emergency_roster()
+
+    def test_follows_changes(self):
+        """Test that moved and deleted trips and deleted travelers are reflected."""
+        day = datetime.date(2024, 7, 1)
+        self.assertEqual(emergency_roster(day), [])
+        update_record("trips", trips[0], {"start_date": day})
+        self.assertEqual(self.names(emergency_roster(day)), ["Ann", "Bob"])
+        remove_record("travelers", travelers[0])
+        self.assertEqual(self.names(emergency_roster(day)), ["Bob"])
+        remove_record("trips", trips[0])
+        self.assertEqual(emergency_roster(day), [])
+        self.assertEqual(sum(len(keys) for keys in trip_calendar.keys.values()), 1)
+
+    def test_write_roster(self):
+        """Test the CSV written for a roster."""
+        path = os.path.join(self.tmp, "roster.csv")
+        self.assertEqual(write_roster(path, emergency_roster(datetime.date(2024, 6, 5))), 3)
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0], {"traveler_id": "p1", "name": "Ann", "emergency_contact": "07p1", "trips": "t1"})
+        self.assertEqual(rows[1]["trips"], "t1;t2")
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_menu_asks_for_the_file(self, mock_stdout):
+        """Test that the roster menu writes where the user asks and does not overwrite a file unless confirmed."""
+        path = os.path.join(self.tmp, "incident.csv")
+        with patch('main.get_input', side_effect=["05/06/2024", "", path]):
+            emergency_roster_menu()
+        self.assertIn(f"3 traveler(s) written to '{path}'", mock_stdout.getvalue())
+        with open(path, "w") as f:
+            f.write("keep")
+        with patch('main.get_input', side_effect=["05/06/2024", "", path, "n"]):
+            emergency_roster_menu()
+        with open(path) as f:
+            self.assertEqual(f.read(), "keep")
+
+#Separate stores
+class TestStores(unittest.TestCase):
+
+    def setUp(self):
+        """Run each test in a store of its own, so the default data is never touched."""
+        self.enterContext(use_store(Store()))
+
+    def trip(self, trip_id, day=1):
+        return {"id": trip_id, "name": trip_id, "start_date": datetime.date(2024, 6, day), "duration": 2,
+                "coordinator": "c1", "contact": "1", "travelers": ["p1"], "legs": []}
+
+    def leg(self, leg_id, trip_id, cost):
+        return {"id": leg_id, "trip_id": trip_id, "start_location": "A", "destination": "B",
+                "transport_provider": "Rail", "transport_mode": "Train", "leg_type": "transfer", "cost": cost}
+
+    def test_isolated_from_default_store(self):
+        """Test that records, indexes and versions of a store are separate from the default store."""
+        default_trips = default_store.run(len, trips)
+        insert_record("trips", self.trip("s1"))
+        insert_record("trip_legs", self.leg("l1", "s1", 100))
+        self.assertEqual(len(trips), 1)
+        self.assertEqual([leg['id'] for leg in legs_by_trip.lookup("s1")], ["l1"])
+        self.assertEqual([user['username'] for user in users], ["admin"])  # New stores start with the default admin
+        with use_store(default_store):
+            self.assertEqual(len(trips), default_trips)
+            self.assertEqual(legs_by_trip.lookup("s1"), [])
+        self.assertEqual(next(iter(Query("trip_legs").where("trip_id", "==", "s1")))["cost"], 100)
+
+    def test_initial_data_and_reports(self):
+        """Test a store created with data, and a cached report run against it."""
+        store = Store({"trips": [self.trip("s1")], "trip_legs": [self.leg("l1", "s1", 40)],
+                       "users": [{"id": "u1", "username": "ann", "password": "x", "role": "coordinator"}]})
+        self.assertEqual(store.run(lambda: [trip['id'] for trip in trips]), ["s1"])
+        self.assertEqual(store.run(users_by_username.lookup, "ann")[0]["id"], "u1")
+        self.assertEqual(users_by_username.lookup("ann"), [])
+        self.assertEqual(store.run(users_by_username.lookup, "admin"), [])  # Its own users replace the default admin
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            store.run(generate_financial_report)
+            store.run(generate_financial_report)
+        self.assertIn("$40", stdout.getvalue())
+        self.assertEqual(store.run(lambda: dict(report_cache_stats)), {"hits": 1, "misses": 1})
+        self.assertEqual(report_cache_stats, {"hits": 0, "misses": 0})
+
+    def test_stores_in_parallel(self):
+        """Test that several stores changed and read from a thread pool at once do not see each other's data."""
+        stores = [Store() for _ in range(4)]
+
+        def work(number):
+            insert_record("travelers", {"id": "p1", "name": f"Traveler {number}", "address": "x", "dob": None,
+                                        "emergency_contact": "1", "gov_id_type": "Passport", "gov_id_number": "1"})
+            for i in range(50):
+                insert_record("trips", self.trip(f"t{i}", day=1 + i % 20))
+                insert_record("trip_legs", self.leg(f"l{i}", f"t{i}", number + 1))
+            with read_snapshot() as snap:
+                totals, _ = trip_cost_totals(snap)
+            roster = emergency_roster(datetime.date(2024, 6, 1))
+            return sum(totals.values()), [traveler['name'] for traveler, _ in roster]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda pair: pair[1].run(work, pair[0]), enumerate(stores)))
+        self.assertEqual(results, [(50 * (number + 1), [f"Traveler {number}"]) for number in range(4)])
+        self.assertEqual(len(trips), 0)
+
+    def test_category_codes_in_parallel(self):
+        """Test that threads adding categories to one dictionary at once never share a code."""
+        dictionary = CategoryDictionary()
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Switch threads as often as possible
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+                codes = list(pool.map(lambda number: [dictionary.encode(f"Mode {number} {i}") for i in range(500)],
+                                      range(8)))
+        finally:
+            sys.setswitchinterval(interval)
+        for number, store_codes in enumerate(codes):
+            self.assertEqual([dictionary.decode(code) for code in store_codes],
+                             [f"Mode {number} {i}" for i in range(500)])
+        self.assertEqual(len(dictionary), 8 * 500)
+
+    def test_categories_per_store(self):
+        """Test that each store keeps its own spelling of a category, and its categories stay in that store."""
+        first, second = Store(), Store()
+        shouted = {**self.leg("l1", "t1", 10), "destination": "PARIS", "transport_mode": "TRAIN"}
+        first.run(encode_leg_categories, shouted)
+        first.run(insert_record, "trip_legs", shouted)
+        leg = {**self.leg("l1", "t1", 10), "destination": "Paris", "transport_mode": "Train"}
+        second.run(encode_leg_categories, leg)
+        self.assertEqual((leg["destination"], leg["transport_mode"]), ("Paris", "Train"))
+        self.assertEqual(second.run(count_by_category, "transport_mode", [leg]), {"Train": 1})
+        self.assertEqual(first.run(count_by_category, "transport_mode", [leg]), {"TRAIN": 1})
+        self.assertIsNone(leg_categories["destination"].find("Paris"))  # Not in this test's store either
+        self.assertIsNone(currencies.find("EUR"))
+
+    @patch('sys.stdout', new_callable=StringIO)
+    def test_reports_in_parallel(self, mock_stdout):
+        """Test that reports of several stores run from a thread pool only capture their own output."""
+        stores = [Store({"trips": [self.trip(f"Store{number}Trip")],
+                         "trip_legs": [self.leg("l1", f"Store{number}Trip", 1001 + number)]}) for number in range(4)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            for _ in range(3):
+                list(pool.map(lambda store: store.run(generate_financial_report), stores))
+        for number, store in enumerate(stores):
+            text = store.run(lambda: "".join(entry[1] for entry in report_cache.values()))
+            self.assertIn(f"Store{number}Trip: ${1001 + number}", text)
+            self.assertEqual(text.count("Trip: $"), 1)  # Nothing printed by the other stores
+            self.assertEqual(store.run(lambda: dict(report_cache_stats)), {"hits": 2, "misses": 1})
+        self.assertEqual(len(trips), 0)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
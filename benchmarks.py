@@ -0,0 +1,289 @@
+# Benchmarks for the travel management system
+# Generates synthetic datasets and measures how the storage and reporting code scales.
+# Run `python benchmarks.py --help` to list the available benchmarks.
+
+import argparse  # For the command line interface
+import datetime  # For generating dates
+import gc  # For collecting garbage before timing
+import json  # For the JSON baseline
+import os  # For file sizes and paths
+import random  # For generating sample data
+import statistics  # For median timings
+import subprocess  # For measuring cold starts in a fresh interpreter
+import sys  # For locating the Python interpreter
+import tempfile  # For scratch directories
+import time  # For timing benchmarks
+import tracemalloc  # For measuring peak memory of exports
+
+import snapshot  # Binary snapshot format
+
+
+TRANSPORT_MODES = ["Flight", "Train", "Bus", "Ferry", "Car"]
+TRANSPORT_PROVIDERS = ["Airline", "National Rail", "Coach Co", "Sea Lines", "Car Hire"]
+LEG_TYPES = ["accommodation", "poi", "transfer"]
+LOCATIONS = ["London", "Paris", "Rome", "Berlin", "Madrid", "Lisbon", "Vienna", "Prague", "Dublin", "Athens"]
+ID_TYPES = ["Passport", "Driver's License", "ID Card"]
+CURRENCIES = ["USD", "USD", "USD", "EUR", "GBP"]  # Mostly dollars
+
+
+def generate_sample_data(num_trips, travelers_per_trip=4, legs_per_trip=5, seed=0):
+    """
+    Generate a synthetic dataset shaped like the data in `main`.
+    :param num_trips: Number of trips to generate.
+    :param travelers_per_trip: Number of travelers on each trip.
+    :param legs_per_trip: Number of legs on each trip.
+    :param seed: Seed for the random number generator.
+    :return: A dictionary mapping collection names to lists of records.
+    """
+    rng = random.Random(seed)
+    first_day = datetime.date(2020, 1, 1).toordinal()
+    trips, travelers, trip_legs = [], [], []
+    users = [{"id": "admin1", "username": "admin", "password": "admin123", "role": "administrator"}]
+
+    for c in range(max(1, num_trips // 50)):
+        users.append({"id": f"c{c:07d}", "username": f"coordinator{c}", "password": "secret", "role": "coordinator"})
+
+    for t in range(num_trips):
+        trip = {
+            "id": f"t{t:07d}",
+            "name": f"Trip {t}",
+            "start_date": datetime.date.fromordinal(first_day + rng.randrange(3650)),
+            "duration": rng.randint(1, 21),
+            "coordinator": users[1 + t % (len(users) - 1)]["username"],
+            "contact": f"07{rng.randrange(10 ** 9):09d}",
+            "travelers": [],
+            "legs": []
+        }
+        for _ in range(travelers_per_trip):
+            traveler = {
+                "id": f"p{len(travelers):08d}",
+                "name": f"Traveler {len(travelers)}",
+                "address": f"{rng.randint(1, 999)} High Street",
+                "dob": datetime.date.fromordinal(first_day - rng.randrange(365 * 80)),
+                "emergency_contact": f"07{rng.randrange(10 ** 9):09d}",
+                "gov_id_type": rng.choice(ID_TYPES),
+                "gov_id_number": f"X{len(travelers):09d}"
+            }
+            travelers.append(traveler)
+            trip["travelers"].append(traveler["id"])
+        departure = datetime.datetime.combine(trip["start_date"], datetime.time(rng.randrange(6, 12)))
+        for _ in range(legs_per_trip):
+            mode = rng.randrange(len(TRANSPORT_MODES))
+            arrival = departure + datetime.timedelta(minutes=rng.randrange(30, 600, 15))
+            leg = {
+                "id": f"l{len(trip_legs):08d}",
+                "trip_id": trip["id"],
+                "start_location": rng.choice(LOCATIONS),
+                "destination": rng.choice(LOCATIONS),
+                "transport_provider": TRANSPORT_PROVIDERS[mode],
+                "transport_mode": TRANSPORT_MODES[mode],
+                "leg_type": rng.choice(LEG_TYPES),
+                "cost": rng.randint(20, 2000),
+                "currency": rng.choice(CURRENCIES),
+                "departure": departure,
+                "arrival": arrival
+            }
+            departure = arrival + datetime.timedelta(minutes=rng.randrange(30, 240, 15))  # Legs follow each other
+            trip_legs.append(leg)
+            trip["legs"].append(leg["id"])
+        trips.append(trip)
+
+    return {"trips": trips, "travelers": travelers, "trip_legs": trip_legs, "users": users}
+
+
+def _json_default(value):
+    """Serialise dates for the JSON baseline."""
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+# Scripts run in a fresh interpreter so that start-up time and peak RSS are measured cold
+_JSON_LOADER = """
+import json, resource, sys, time
+start = time.perf_counter()
+with open(sys.argv[1]) as f:
+    data = json.load(f)
+opened = time.perf_counter()
+sample = [data["trips"][i] for i in range(0, len(data["trips"]), max(1, len(data["trips"]) // 100))]
+done = time.perf_counter()
+print(json.dumps({"open": opened - start, "sample": done - opened,
+                  "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+_SNAPSHOT_LOADER = """
+import json, resource, sys, time
+import snapshot
+start = time.perf_counter()
+data = snapshot.load_snapshot(sys.argv[1])
+opened = time.perf_counter()
+sample = [data.trips[i] for i in range(0, len(data.trips), max(1, len(data.trips) // 100))]
+done = time.perf_counter()
+print(json.dumps({"open": opened - start, "sample": done - opened,
+                  "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+_BASELINE_LOADER = """
+import json, resource
+print(json.dumps({"rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+
+def _run_loader(script, path):
+    """Run a loader script in a fresh interpreter and return its measurements."""
+    result = subprocess.run([sys.executable, "-c", script, path], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout)
+
+
+def benchmark_snapshot(num_trips):
+    """
+    Compare cold-start time and peak RSS of the binary snapshot against a JSON dump of the same data.
+    :param num_trips: Number of trips in the generated dataset.
+    """
+    data = generate_sample_data(num_trips)
+    print(f"\n=== Snapshot Benchmark ({num_trips} trips, {len(data['travelers'])} travelers, "
+          f"{len(data['trip_legs'])} legs) ===")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "data.json")
+        snapshot_path = os.path.join(tmp, "data.snap")
+        with open(json_path, "w") as f:
+            json.dump(data, f, default=_json_default)
+        snapshot.save_snapshot(snapshot_path, data)
+
+        baseline = _run_loader(_BASELINE_LOADER, json_path)["rss_kb"]
+        results = {
+            "JSON": (os.path.getsize(json_path), _run_loader(_JSON_LOADER, json_path)),
+            "Snapshot": (os.path.getsize(snapshot_path), _run_loader(_SNAPSHOT_LOADER, snapshot_path)),
+        }
+
+    print(f"{'Format':<10}{'Size (MB)':>12}{'Open (ms)':>12}{'Sample (ms)':>14}{'Extra RSS (MB)':>17}")
+    for name, (size, stats) in results.items():
+        print(f"{name:<10}{size / 2 ** 20:>12.1f}{stats['open'] * 1000:>12.2f}"
+              f"{stats['sample'] * 1000:>14.2f}{(stats['rss_kb'] - baseline) / 1024:>17.1f}")
+
+
+def load_sample_data(num_trips):
+    """
+    Replace the live data in `main` with a generated dataset.
+    :param num_trips: Number of trips to generate.
+    :return: The `main` module.
+    """
+    import main as app  # Imported here so the snapshot benchmark does not load the application
+    data = generate_sample_data(num_trips)
+    for name, records in data.items():
+        collection = getattr(app, name)
+        collection.clear()
+        collection.extend(records)
+    return app
+
+
+def benchmark_itineraries(num_trips):
+    """
+    Time exporting text and HTML itineraries for every trip.
+    :param num_trips: Number of trips in the generated dataset.
+    """
+    app = load_sample_data(num_trips)
+    print(f"\n=== Itinerary Export Benchmark ({num_trips} trips, {len(app.trip_legs)} legs) ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in sorted({1, os.cpu_count() or 1}):
+            started = time.perf_counter()
+            count = app.export_itineraries(os.path.join(tmp, f"workers_{workers}"), workers=workers)
+            print(f"{workers} worker(s): {count} itineraries in {time.perf_counter() - started:.2f} seconds")
+
+
+def benchmark_columnar(num_trips, chunk_size=None):
+    """
+    Time the columnar export and reload, and measure the memory the export allocates on top of the data.
+    :param num_trips: Number of trips in the generated dataset.
+    :param chunk_size: Records converted at a time (default: `columnar.CHUNK_SIZE`).
+    """
+    import columnar  # Imported here so the other benchmarks do not need it
+    app = load_sample_data(num_trips)
+    print(f"\n=== Columnar Export Benchmark ({num_trips} trips, {len(app.trip_legs)} legs) ===")
+    chunk_size = chunk_size or columnar.CHUNK_SIZE
+    with tempfile.TemporaryDirectory() as tmp:
+        tracemalloc.start()  # Measured on a separate run, as tracing slows the export down
+        columnar.export_columnar(tmp, chunk_size=chunk_size)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        started = time.perf_counter()
+        columnar.export_columnar(tmp, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(tmp) for name in names)
+        print(f"Export: {elapsed:.2f} seconds, {size / 2 ** 20:.1f} MB written, "
+              f"peak extra memory {peak / 2 ** 20:.1f} MB")
+
+        started = time.perf_counter()
+        legs = columnar.load_columnar(tmp)["trip_legs"]
+        opened = time.perf_counter() - started
+        started = time.perf_counter()
+        total = int(legs["cost"].sum())
+        summed = time.perf_counter() - started
+        started = time.perf_counter()
+        expected = sum(leg['cost'] for leg in app.trip_legs)
+        looped = time.perf_counter() - started
+        assert total == expected
+        print(f"Reload (memory-mapped): {opened * 1000:.2f} ms; sum of costs: {summed * 1000:.2f} ms "
+              f"(looping over the dictionaries: {looped * 1000:.2f} ms)")
+
+
+def benchmark_roster(num_trips, repeats=5):
+    """
+    Time emergency contact rosters for a date and for a location, written to a file.
+    The first query builds the indexes, so it is reported separately.
+    :param num_trips: Number of trips in the generated dataset (four travelers each).
+    :param repeats: Number of timed queries of each kind.
+    """
+    app = load_sample_data(num_trips)
+    print(f"\n=== Emergency Roster Benchmark ({num_trips} trips, {len(app.travelers)} travelers, "
+          f"{len(app.trip_legs)} legs) ===")
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "roster.csv")
+        started = time.perf_counter()
+        app.emergency_roster(datetime.date(2024, 1, 1), LOCATIONS[0])
+        app.emergency_roster(location=LOCATIONS[0])
+        print(f"Index build (first queries): {time.perf_counter() - started:.2f} seconds")
+        gc.collect()  # Collect the garbage left by the build now rather than during a timed query
+        queries = {
+            "Date": [{"day": datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(3650))}
+                     for _ in range(repeats)],
+            "Location": [{"location": rng.choice(LOCATIONS)} for _ in range(repeats)],
+            "Date and location": [{"day": datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randrange(3650)),
+                                   "location": rng.choice(LOCATIONS)} for _ in range(repeats)],
+        }
+        for name, arguments in queries.items():
+            found, written, counts = [], [], []
+            for kwargs in arguments:
+                started = time.perf_counter()
+                roster = app.emergency_roster(**kwargs)
+                found.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                counts.append(app.write_roster(path, roster))
+                written.append(time.perf_counter() - started)
+            print(f"{name}: {statistics.median(counts):.0f} travelers, "
+                  f"found in {statistics.median(found) * 1000:.1f} ms (max {max(found) * 1000:.1f} ms), "
+                  f"written in {statistics.median(written) * 1000:.1f} ms")
+
+
+def main():
+    """Parse command line arguments and run the selected benchmark."""
+    parser = argparse.ArgumentParser(description="Travel management system benchmarks")
+    parser.add_argument("benchmark", choices=["snapshot", "itineraries", "columnar", "roster"], help="Benchmark to run")
+    parser.add_argument("--trips", type=int, default=100000, help="Number of trips to generate")
+    args = parser.parse_args()
+
+    if args.benchmark == "snapshot":
+        benchmark_snapshot(args.trips)
+    elif args.benchmark == "itineraries":
+        benchmark_itineraries(args.trips)
+    elif args.benchmark == "columnar":
+        benchmark_columnar(args.trips)
+    elif args.benchmark == "roster":
+        benchmark_roster(args.trips)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# Columnar export of the travel management data
+# Writes each collection as one NumPy array per field, for loading into NumPy or pandas without going through
+# the record dictionaries. Low-cardinality strings (modes, providers, roles, ...) are dictionary-encoded as
+# integer codes plus a table of values; other strings are fixed-width, dates are datetime64[D] and list fields
+# (a trip's travelers and legs) are flattened into items plus offsets.
+#
+# Layout of an export directory:
+#   manifest.json                      - number of rows and the kind of each field, per collection
+#   <collection>/<field>.npy           - one column (codes for dictionary-encoded fields, items for lists)
+#   <collection>/<field>.values.npy    - the values of a dictionary-encoded field
+#   <collection>/<field>.offsets.npy   - where each row's items start in a list field (one extra entry at the end)
+#   <collection>.npz                   - the same arrays bundled in one file per collection
+#   <collection>.csv                   - plain CSV fallback, with list items separated by ";"
+#
+# Columns are written in chunks through memory-mapped files, so exporting uses bounded memory beyond the data
+# itself, and `load_columnar` maps the .npy files back without copying them.
+
+import csv  # For the CSV fallback
+import datetime  # For converting dates to datetime64 days
+import json  # For the manifest
+import operator  # For fast field access
+import os  # For paths
+
+import numpy as np  # For the column files
+
+
+CHUNK_SIZE = 100000  # Records converted at a time
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+# Field kinds:
+#   "category" - dictionary-encoded string: int32 codes plus a table of values
+#   "text"     - fixed-width unicode string
+#   "int"      - 64-bit integer
+#   "date"     - datetime64[D] (NaT for missing dates)
+#   "datetime" - datetime64[s] (NaT for missing times)
+#   "list"     - list of strings: fixed-width items plus int64 offsets
+# Passwords are never exported.
+SCHEMAS = {
+    "trips": (
+        ("id", "text"), ("name", "text"), ("start_date", "date"), ("duration", "int"),
+        ("coordinator", "category"), ("contact", "text"), ("travelers", "list"), ("legs", "list"),
+    ),
+    "travelers": (
+        ("id", "text"), ("name", "text"), ("address", "text"), ("dob", "date"),
+        ("emergency_contact", "text"), ("gov_id_type", "category"), ("gov_id_number", "text"),
+    ),
+    "trip_legs": (
+        ("id", "text"), ("trip_id", "text"), ("start_location", "category"), ("destination", "category"),
+        ("transport_provider", "category"), ("transport_mode", "category"), ("leg_type", "category"),
+        ("cost", "int"), ("currency", "category"), ("departure", "datetime"), ("arrival", "datetime"),
+    ),
+    "users": (
+        ("id", "text"), ("username", "text"), ("role", "category"),
+    ),
+}
+COLLECTIONS = ("trips", "travelers", "trip_legs", "users")
+
+_NAT = np.iinfo(np.int64).min  # Integer value of NaT
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()  # Day 0 of datetime64[D]
+_EPOCH = datetime.datetime(1970, 1, 1)  # Second 0 of datetime64[s]
+
+
+def _text(value):
+    """Text stored for a string field (missing values become empty strings)."""
+    return "" if value is None else str(value)
+
+
+def _date_days(value):
+    """Days since 1970-01-01 for a date, or the NaT value for anything else."""
+    return value.toordinal() - _EPOCH_ORDINAL if hasattr(value, "toordinal") else _NAT
+
+
+def _datetime_seconds(value):
+    """Seconds since 1970-01-01 00:00 for a datetime, or the NaT value for anything else."""
+    return (value - _EPOCH) // datetime.timedelta(seconds=1) if isinstance(value, datetime.datetime) else _NAT
+
+
+def _int(value):
+    """Integer stored for an int field (missing or invalid values become 0)."""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _chunks(records, chunk_size):
+    """Split a sequence of records into consecutive slices."""
+    for start in range(0, len(records), chunk_size):
+        yield start, records[start:start + chunk_size]
+
+
+def _open_column(path, dtype, length):
+    """Create a .npy file of the given type and length, mapped into memory for writing."""
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(length,))
+
+
+def _write_collection(directory, name, records, chunk_size):
+    """
+    Write the column files of one collection.
+    A first pass finds the width of text fields and the number of list items; a second pass fills
+    the memory-mapped columns one chunk at a time.
+    :return: The manifest entry of the collection.
+    """
+    schema = SCHEMAS[name]
+    folder = os.path.join(directory, name)
+    os.makedirs(folder, exist_ok=True)
+    count = len(records)
+
+    # First pass: sizes of text and list fields (None counts as "None", which only makes a column wider)
+    widths, item_counts = {}, {}
+    for field, kind in schema:
+        if kind == "text":
+            widths[field] = max(map(len, map(str, map(operator.methodcaller("get", field), records))), default=0)
+        elif kind == "list":
+            widths[field] = max((len(_text(item)) for record in records for item in record.get(field) or ()),
+                                default=0)
+            item_counts[field] = sum(len(record.get(field) or ()) for record in records)
+
+    # Second pass: fill the columns chunk by chunk
+    columns, dictionaries = {}, {}
+    for field, kind in schema:
+        path = os.path.join(folder, f"{field}.npy")
+        if kind == "category":
+            columns[field] = _open_column(path, np.int32, count)
+            dictionaries[field] = {}
+        elif kind == "text":
+            columns[field] = _open_column(path, f"<U{max(widths[field], 1)}", count)
+        elif kind == "int":
+            columns[field] = _open_column(path, np.int64, count)
+        elif kind == "date":
+            columns[field] = _open_column(path, "datetime64[D]", count)
+        elif kind == "datetime":
+            columns[field] = _open_column(path, "datetime64[s]", count)
+        else:
+            columns[field] = _open_column(path, f"<U{max(widths[field], 1)}", item_counts[field])
+            columns[field + ".offsets"] = _open_column(os.path.join(folder, f"{field}.offsets.npy"), np.int64,
+                                                       count + 1)
+            columns[field + ".offsets"][0] = 0
+
+    item_positions = {field: 0 for field in item_counts}
+    for start, chunk in _chunks(records, chunk_size):
+        end = start + len(chunk)
+        for field, kind in schema:
+            column = columns[field]
+            values = list(map(operator.methodcaller("get", field), chunk))
+            if kind == "category":
+                codes = dictionaries[field]  # Maps each value to its code, in order of first appearance
+                for value in set(values) - codes.keys():
+                    codes[value] = len(codes)
+                column[start:end] = np.fromiter(map(codes.__getitem__, values), dtype=np.int32, count=len(values))
+            elif kind == "text":
+                column[start:end] = ["" if value is None else value for value in values]
+            elif kind == "int":
+                column[start:end] = np.fromiter(map(_int, values), dtype=np.int64, count=len(values))
+            elif kind == "date":
+                days = np.fromiter(map(_date_days, values), dtype=np.int64, count=len(values))
+                column[start:end] = days.view("datetime64[D]")
+            elif kind == "datetime":
+                seconds = np.fromiter(map(_datetime_seconds, values), dtype=np.int64, count=len(values))
+                column[start:end] = seconds.view("datetime64[s]")
+            else:
+                lists = [value or () for value in values]
+                items = [_text(item) for value in lists for item in value]
+                position = item_positions[field]
+                column[position:position + len(items)] = items
+                lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+                columns[field + ".offsets"][start + 1:end + 1] = position + np.cumsum(lengths)
+                item_positions[field] = position + len(items)
+
+    for column in columns.values():
+        column.flush()
+    del columns  # Unmap the files
+
+    fields = {}
+    for field, kind in schema:
+        fields[field] = kind
+        if kind == "category":
+            values = [_text(value) for value in dictionaries[field]]
+            width = max(map(len, values), default=1)
+            np.save(os.path.join(folder, f"{field}.values.npy"), np.array(values, dtype=f"<U{max(width, 1)}"))
+    return {"rows": count, "fields": fields}
+
+
+def _write_npz(directory, name):
+    """Bundle the column files of a collection into one .npz file (arrays are streamed from the mapped files)."""
+    folder = os.path.join(directory, name)
+    arrays = {}
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.endswith(".npy"):
+            arrays[file_name[:-4]] = np.load(os.path.join(folder, file_name), mmap_mode="r")
+    np.savez(os.path.join(directory, f"{name}.npz"), **arrays)
+
+
+class ColumnarCollection:
+    """
+    One exported collection, loaded as arrays.
+    `columns[field]` holds the column (codes for dictionary-encoded fields, items for list fields),
+    `values[field]` the values of a dictionary-encoded field and `offsets[field]` the offsets of a list field.
+    """
+
+    def __init__(self, name, rows, fields, arrays):
+        """
+        :param name: Name of the collection.
+        :param rows: Number of records.
+        :param fields: Dictionary mapping field names to kinds.
+        :param arrays: Dictionary mapping array names (as in the export files, without ".npy") to arrays.
+        """
+        self.name = name
+        self.rows = rows
+        self.fields = fields
+        self.columns = {field: arrays[field] for field in fields}
+        self.values = {field: arrays[f"{field}.values"] for field, kind in fields.items() if kind == "category"}
+        self.offsets = {field: arrays[f"{field}.offsets"] for field, kind in fields.items() if kind == "list"}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def decode(self, field):
+        """Get the values of a dictionary-encoded field, one per row (this builds a new array)."""
+        return self.values[field][self.columns[field]]
+
+    def items(self, field, row):
+        """Get the list items of one row of a list field."""
+        offsets = self.offsets[field]
+        return self.columns[field][offsets[row]:offsets[row + 1]]
+
+    def to_pandas(self):
+        """
+        Build a pandas DataFrame (requires pandas). Dictionary-encoded fields become categoricals
+        that share the exported codes; list fields are left out.
+        """
+        import pandas as pd  # Optional; only needed for this method
+        data = {}
+        for field, kind in self.fields.items():
+            if kind == "category":
+                data[field] = pd.Categorical.from_codes(self.columns[field], self.values[field])
+            elif kind != "list":
+                data[field] = self.columns[field]
+        return pd.DataFrame(data)
+
+
+def _load_collection(directory, name, entry, mmap_mode):
+    """Load one collection of an export, preferring the memory-mappable .npy files over the .npz bundle."""
+    folder = os.path.join(directory, name)
+    if os.path.isdir(folder):
+        arrays = {file_name[:-4]: np.load(os.path.join(folder, file_name), mmap_mode=mmap_mode)
+                  for file_name in os.listdir(folder) if file_name.endswith(".npy")}
+    else:
+        arrays = np.load(os.path.join(directory, f"{name}.npz"))
+    return ColumnarCollection(name, entry["rows"], entry["fields"], arrays)
+
+
+def _write_csv(directory, collection, chunk_size):
+    """
+    Write a collection as CSV, one chunk of rows at a time.
+    Rows are built from the exported columns, so each chunk is converted with array operations.
+    """
+    with open(os.path.join(directory, f"{collection.name}.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(collection.fields))
+        for start in range(0, len(collection), chunk_size):
+            end = min(start + chunk_size, len(collection))
+            columns = []
+            for field, kind in collection.fields.items():
+                column = collection.columns[field]
+                if kind == "category":
+                    columns.append(collection.values[field][column[start:end]].tolist())
+                elif kind in ("date", "datetime"):
+                    times = column[start:end]
+                    columns.append(np.where(np.isnat(times), "", np.datetime_as_string(times)).tolist())
+                elif kind == "list":
+                    offsets = collection.offsets[field][start:end + 1] - collection.offsets[field][start]
+                    items = column[collection.offsets[field][start]:collection.offsets[field][end]].tolist()
+                    columns.append([";".join(items[a:b]) for a, b in zip(offsets[:-1], offsets[1:])])
+                else:
+                    columns.append(column[start:end].tolist())
+            writer.writerows(zip(*columns))
+
+
+def export_columnar(directory, collections=None, chunk_size=CHUNK_SIZE, npz=True, csv_fallback=True):
+    """
+    Export the collections as columnar files.
+    :param directory: Output directory (created if needed).
+    :param collections: Dictionary mapping collection names to sequences of records.
+                        Defaults to a consistent snapshot of the live data in `main`.
+    :param chunk_size: Number of records converted at a time.
+    :param npz: Also bundle each collection into a .npz file.
+    :param csv_fallback: Also write each collection as CSV.
+    :return: The manifest, with the number of rows and field kinds per collection.
+    """
+    os.makedirs(directory, exist_ok=True)
+    snap = None
+    if collections is None:
+        import main  # Imported here so loading an export does not load the whole application
+        snap = main.read_snapshot()
+        collections = {name: getattr(snap, name) for name in COLLECTIONS}
+
+    try:
+        manifest = {"version": FORMAT_VERSION, "collections": {}}
+        for name in COLLECTIONS:
+            records = collections.get(name, ())
+            entry = _write_collection(directory, name, records, chunk_size)
+            if npz:
+                _write_npz(directory, name)
+            if csv_fallback:
+                _write_csv(directory, _load_collection(directory, name, entry, "r"), chunk_size)
+            manifest["collections"][name] = entry
+    finally:
+        if snap is not None:
+            snap.close()
+
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def load_columnar(directory, mmap_mode="r"):
+    """
+    Load an export made by `export_columnar`.
+    The .npy files are memory-mapped, so loading does not copy or read the columns; if they are missing,
+    the .npz bundles are read into memory instead.
+    :param directory: The export directory.
+    :param mmap_mode: Mode for `numpy.load` ("r" for read-only; None to read the files into memory).
+    :return: A dictionary mapping collection names to `ColumnarCollection`s.
+    """
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported columnar export version {manifest.get('version')}.")
+
+    return {name: _load_collection(directory, name, entry, mmap_mode)
+            for name, entry in manifest["collections"].items()}
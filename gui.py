@@ -0,0 +1,519 @@
+# Graphical front-end for the travel management system
+# A tkinter window over the same trip, traveler and trip leg operations as the console menus.
+# Tables only create widgets for the rows on screen and format records a page at a time,
+# so opening very large lists is instant. Reports run in a background thread.
+# Run with `python gui.py`.
+
+import contextvars  # For running reports on the window's store
+import datetime  # For parsing dates
+import io  # For capturing report output
+import queue  # For passing results from worker threads to the window
+import threading  # For running reports off the UI thread
+import uuid  # For generating unique IDs
+from collections import OrderedDict  # For the page cache
+
+import matplotlib
+matplotlib.use("Agg")  # Reports save charts from a worker thread, so use a non-interactive backend
+
+import tkinter as tk
+from tkinter import messagebox, ttk
+
+import main
+
+
+PAGE_SIZE = 200  # Number of records formatted at a time
+MAX_PAGES = 8  # Number of formatted pages kept in memory per table
+REFRESH_INTERVAL_MS = 1000  # How often tables check for changes
+
+
+def parse_date(text):
+    """Parse a DD/MM/YYYY date, raising `ValueError` if it is invalid."""
+    day, month, year = map(int, text.split('/'))
+    return datetime.date(year, month, day)
+
+
+def parse_datetime(text):
+    """Parse a DD/MM/YYYY HH:MM date and time, raising `ValueError` if it is invalid."""
+    return datetime.datetime.strptime(text, main.DATETIME_FORMAT)
+
+
+def format_date(value):
+    """Format a date or date and time for display (other values are shown as they are, None as blank)."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(main.DATETIME_FORMAT)
+    if isinstance(value, datetime.date):
+        return value.strftime('%d/%m/%Y')
+    return "" if value is None else str(value)
+
+
+# Columns shown for each collection: (heading, width, function returning the cell text)
+COLUMNS = {
+    "trips": [
+        ("ID", 90, lambda r: r['id']),
+        ("Name", 200, lambda r: r['name']),
+        ("Start Date", 100, lambda r: format_date(r['start_date'])),
+        ("Duration", 80, lambda r: r['duration']),
+        ("Coordinator", 140, lambda r: r['coordinator']),
+        ("Travelers", 80, lambda r: len(r['travelers'])),
+        ("Legs", 60, lambda r: len(r['legs'])),
+    ],
+    "travelers": [
+        ("ID", 90, lambda r: r['id']),
+        ("Name", 200, lambda r: r['name']),
+        ("Date of Birth", 100, lambda r: format_date(r['dob'])),
+        ("ID Type", 120, lambda r: r['gov_id_type']),
+        ("ID Number", 120, lambda r: r['gov_id_number']),
+        ("Emergency Contact", 140, lambda r: r['emergency_contact']),
+    ],
+    "trip_legs": [
+        ("ID", 90, lambda r: r['id']),
+        ("Trip ID", 90, lambda r: r['trip_id']),
+        ("From", 130, lambda r: r['start_location']),
+        ("To", 130, lambda r: r['destination']),
+        ("Mode", 90, lambda r: r['transport_mode']),
+        ("Provider", 120, lambda r: r['transport_provider']),
+        ("Type", 100, lambda r: r['leg_type']),
+        ("Cost", 90, main.format_leg_cost),
+        ("Departs", 120, lambda r: format_date(r.get('departure'))),
+    ],
+}
+
+# Fields edited in the forms: (key, label, parser)
+FIELDS = {
+    "trips": [
+        ("name", "Trip Name", str),
+        ("start_date", "Start Date (DD/MM/YYYY)", parse_date),
+        ("duration", "Duration (days)", int),
+        ("coordinator", "Trip Coordinator", str),
+        ("contact", "Contact Information", str),
+    ],
+    "travelers": [
+        ("name", "Full Name", str),
+        ("address", "Address", str),
+        ("dob", "Date of Birth (DD/MM/YYYY)", parse_date),
+        ("emergency_contact", "Emergency Contact", str),
+        ("gov_id_type", "Government ID Type", str),
+        ("gov_id_number", "Government ID Number", str),
+    ],
+    "trip_legs": [
+        ("trip_id", "Trip ID", str),
+        ("start_location", "Starting Location", str),
+        ("destination", "Destination", str),
+        ("transport_provider", "Transport Provider", str),
+        ("transport_mode", "Mode of Transport", str),
+        ("leg_type", "Leg Type (accommodation/poi/transfer)", str),
+        ("cost", "Cost", int),
+        ("currency", f"Currency (e.g. {main.DEFAULT_CURRENCY})", main.normalize_currency),
+        ("departure", "Departure (DD/MM/YYYY HH:MM, optional)", parse_datetime),
+        ("arrival", "Arrival (DD/MM/YYYY HH:MM, optional)", parse_datetime),
+    ],
+}
+OPTIONAL_FIELDS = {"departure", "arrival"}  # Left empty to store None
+
+
+class PageCache:
+    """
+    Formats the rows of a record list a page at a time, keeping only the most recently used pages.
+    """
+
+    def __init__(self, records, columns, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+        self.records = records
+        self.columns = columns
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pages = OrderedDict()  # Maps page numbers to lists of row tuples
+
+    def __len__(self):
+        return len(self.records)
+
+    def row(self, index):
+        """Get the formatted cells of one record."""
+        number, offset = divmod(index, self.page_size)
+        page = self.pages.get(number)
+        if page is None:
+            start = number * self.page_size
+            page = [tuple(cell(record) for _, _, cell in self.columns)
+                    for record in self.records[start:start + self.page_size]]
+            self.pages[number] = page
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)  # Drop the least recently used page
+        else:
+            self.pages.move_to_end(number)
+        return page[offset]
+
+
+class VirtualTable(ttk.Frame):
+    """
+    A table that only creates widgets for the visible rows.
+    Scrolling changes which records those rows show instead of adding more rows.
+    """
+
+    def __init__(self, master, collection, visible_rows=25):
+        super().__init__(master)
+        self.collection = collection
+        self.columns = COLUMNS[collection]
+        self.visible_rows = visible_rows
+        self.offset = 0  # Index of the first visible record
+        self.token = None  # `collection_token` of the data being shown
+        self.cache = PageCache((), self.columns)
+
+        self.tree = ttk.Treeview(self, columns=[heading for heading, _, _ in self.columns], show="headings",
+                                 height=visible_rows, selectmode="browse")
+        for heading, width, _ in self.columns:
+            self.tree.heading(heading, text=heading)
+            self.tree.column(heading, width=width, stretch=True)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.status = ttk.Label(self)
+        self.status.grid(row=1, column=0, columnspan=2, sticky="w")
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        # Scrolling with the mouse wheel (Windows/macOS and Linux) and the keyboard
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1, "units"))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.tree.bind("<Next>", lambda e: self.scroll(1, "pages"))
+
+        self.refresh()
+        self.after(REFRESH_INTERVAL_MS, self._poll_changes)
+
+    def refresh(self):
+        """Reload the records from a snapshot and redraw the visible rows."""
+        with main.read_snapshot() as snap:
+            records = getattr(snap, self.collection)
+            self.token = snap.token(self.collection)
+        self.cache = PageCache(records, self.columns)
+        self.offset = min(self.offset, max(0, len(records) - self.visible_rows))
+        self.render()
+
+    def _poll_changes(self):
+        # Reload when the collection changed, e.g. after an edit or in another window
+        if main.collection_token(self.collection) != self.token:
+            self.refresh()
+        self.after(REFRESH_INTERVAL_MS, self._poll_changes)
+
+    def render(self):
+        """Show the records starting at `offset` in the visible rows."""
+        total = len(self.cache)
+        count = max(0, min(self.visible_rows, total - self.offset))
+        items = self.tree.get_children()
+
+        # Reuse the existing row widgets; only add or remove rows when the number of visible rows changes
+        for i in range(count):
+            values = self.cache.row(self.offset + i)
+            if i < len(items):
+                self.tree.item(items[i], values=values)
+            else:
+                self.tree.insert("", "end", iid=f"row{i}", values=values)
+        for item in items[count:]:
+            self.tree.delete(item)
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + count) / total)
+            self.status.config(text=f"Showing {self.offset + 1}-{self.offset + count} of {total}")
+        else:
+            self.scrollbar.set(0, 1)
+            self.status.config(text="No records found.")
+
+    def scroll(self, amount, unit):
+        """Move the view by a number of rows ("units") or screens ("pages")."""
+        step = self.visible_rows if unit == "pages" else 1
+        self._move_to(self.offset + amount * step)
+        return "break"
+
+    def _on_scrollbar(self, command, *args):
+        if command == "moveto":
+            self._move_to(int(float(args[0]) * len(self.cache)))
+        elif command == "scroll":
+            self.scroll(int(args[0]), args[1])
+
+    def _move_to(self, offset):
+        offset = max(0, min(offset, len(self.cache) - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def selected_record(self):
+        """Get the record in the selected row, or None."""
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        index = self.offset + self.tree.index(selection[0])
+        return self.cache.records[index] if index < len(self.cache) else None
+
+
+class RecordForm(tk.Toplevel):
+    """A dialog for entering the fields of a record."""
+
+    def __init__(self, master, title, fields, record, on_save):
+        """
+        :param fields: List of (key, label, parser) tuples.
+        :param record: Existing record to edit, or None for a new record.
+        :param on_save: Called with the dictionary of parsed values; returns an error message or None.
+        """
+        super().__init__(master)
+        self.title(title)
+        self.fields = fields
+        self.on_save = on_save
+        self.entries = {}
+        for row, (key, label, _) in enumerate(fields):
+            ttk.Label(self, text=label).grid(row=row, column=0, sticky="w", padx=5, pady=2)
+            entry = ttk.Entry(self, width=40)
+            if record is not None:
+                entry.insert(0, format_date(record.get(key, "")))
+            entry.grid(row=row, column=1, padx=5, pady=2)
+            self.entries[key] = entry
+        buttons = ttk.Frame(self)
+        buttons.grid(row=len(fields), column=0, columnspan=2, pady=5)
+        ttk.Button(buttons, text="Save", command=self._save).pack(side="left", padx=5)
+        ttk.Button(buttons, text="Cancel", command=self.destroy).pack(side="left", padx=5)
+        self.transient(master)
+        self.grab_set()
+
+    def _save(self):
+        values = {}
+        for key, label, parser in self.fields:
+            text = self.entries[key].get().strip()
+            if not text and key in OPTIONAL_FIELDS:
+                values[key] = None
+                continue
+            if not text:
+                messagebox.showerror("Invalid input", f"{label} cannot be empty.", parent=self)
+                return
+            try:
+                values[key] = parser(text)
+            except ValueError:
+                messagebox.showerror("Invalid input", f"{label} is not valid.", parent=self)
+                return
+        departure, arrival = values.get("departure"), values.get("arrival")
+        if departure is not None and arrival is not None and arrival < departure:  # Same rule as the console
+            messagebox.showerror("Invalid input", "The arrival cannot be before the departure.", parent=self)
+            return
+        error = self.on_save(values)
+        if error:
+            messagebox.showerror("Could not save", error, parent=self)
+        else:
+            self.destroy()
+
+
+class CollectionTab(ttk.Frame):
+    """A tab with a table of records and buttons to add, edit and delete them."""
+
+    def __init__(self, master, collection):
+        super().__init__(master)
+        self.collection = collection
+        toolbar = ttk.Frame(self)
+        toolbar.pack(fill="x")
+        ttk.Button(toolbar, text="Add", command=self.add).pack(side="left", padx=2, pady=2)
+        ttk.Button(toolbar, text="Edit", command=self.edit).pack(side="left", padx=2, pady=2)
+        ttk.Button(toolbar, text="Delete", command=self.delete).pack(side="left", padx=2, pady=2)
+        ttk.Button(toolbar, text="Refresh", command=lambda: self.table.refresh()).pack(side="left", padx=2, pady=2)
+        self.table = VirtualTable(self, collection)
+        self.table.pack(fill="both", expand=True)
+
+    def add(self):
+        """Open a form to create a record."""
+        RecordForm(self, "Add", FIELDS[self.collection], None, self._create)
+
+    def _create(self, values):
+        record = {"id": str(uuid.uuid4())[:8], **values}
+        if self.collection == "trips":
+            record['coordinator'] = self._link_coordinator(record['coordinator'])
+            main.insert_record("trips", {**record, "travelers": [], "legs": []})
+        elif self.collection == "travelers":
+            error = main.check_gov_id(record)
+            if error:
+                return error
+            main.insert_record("travelers", record)
+        else:
+            if not any(trip['id'] == record['trip_id'] for trip in main.trips):
+                return f"Trip with ID {record['trip_id']} not found."
+            warnings = main.check_leg_cost(record) + main.check_leg_schedule(record)
+            main.add_trip_leg(record)
+            self._warn(warnings)
+        self.table.refresh()
+
+    def _link_coordinator(self, value):
+        """Store a coordinator by user ID, as the console does, and tell the user when no user matches."""
+        note = io.StringIO()
+        with main.capture_output(note):
+            coordinator = main.link_coordinator(value)
+        if note.getvalue():
+            messagebox.showwarning("Coordinator", note.getvalue().strip(), parent=self)
+        return coordinator
+
+    def _warn(self, warnings):
+        """Show cost and schedule warnings for a leg that was just saved, so a typo can be fixed with Edit."""
+        if warnings:
+            messagebox.showwarning("Check this leg", "\n".join(warnings), parent=self)
+
+    def edit(self):
+        """Open a form to edit the selected record."""
+        record = self.table.selected_record()
+        if record is None:
+            messagebox.showinfo("Edit", "Select a record first.", parent=self)
+            return
+        fields = [field for field in FIELDS[self.collection] if field[0] != "trip_id"]
+        RecordForm(self, "Edit", fields, record, lambda values: self._update(record, values))
+
+    def _update(self, record, values):
+        warnings = []
+        if self.collection == "trip_legs":
+            main.encode_leg_categories(values)
+            warnings = main.check_leg_cost({**record, **values}, record) + main.check_leg_schedule({**record, **values})
+        elif self.collection == "travelers":
+            error = main.check_gov_id({**record, **values}, record['id'])
+            if error:
+                return error
+        elif values['coordinator'] != record['coordinator']:  # Trips; an unchanged coordinator is kept as it is
+            values['coordinator'] = self._link_coordinator(values['coordinator'])
+        if main.update_record(self.collection, record, values) is None:
+            return "The record no longer exists."
+        self._warn(warnings)
+        self.table.refresh()
+
+    def delete(self):
+        """Delete the selected record after confirmation."""
+        record = self.table.selected_record()
+        if record is None:
+            messagebox.showinfo("Delete", "Select a record first.", parent=self)
+            return
+        if not messagebox.askyesno("Delete", f"Delete {record['id']}?", parent=self):
+            return
+        if self.collection == "trip_legs":
+            main.remove_trip_leg(record)
+        else:
+            main.remove_record(self.collection, record)
+        self.table.refresh()
+
+
+class ReportsTab(ttk.Frame):
+    """A tab that runs reports in a background thread and shows their output."""
+
+    REPORTS = [
+        ("Financial Report", main.generate_financial_report),
+        ("Traveler Statistics", main.generate_traveler_report),
+        ("Trip Performance Report", main.generate_trip_performance_report),
+    ]
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.results = queue.Queue()  # Output of finished reports, read on the UI thread
+        self.report_lock = threading.Lock()  # pyplot has one current figure per process, so draw one chart at a time
+        toolbar = ttk.Frame(self)
+        toolbar.pack(fill="x")
+        self.buttons = []
+        for title, report in self.REPORTS:
+            button = ttk.Button(toolbar, text=title, command=lambda t=title, r=report: self.run(t, r))
+            button.pack(side="left", padx=2, pady=2)
+            self.buttons.append(button)
+        self.output = tk.Text(self, wrap="none", state="disabled")
+        self.output.pack(fill="both", expand=True)
+        self.after(100, self._poll_results)
+
+    def run(self, title, report):
+        """Start a report in a worker thread."""
+        self._show(f"Running {title}...\n")
+        context = contextvars.copy_context()  # The worker uses the same store as the window
+        threading.Thread(target=context.run, args=(self._worker, report), daemon=True).start()
+
+    def _worker(self, report):
+        output = io.StringIO()
+        with self.report_lock:
+            try:
+                with main.capture_output(output):  # Only this thread's output
+                    report()
+            except Exception as e:
+                output.write(f"\nReport failed: {e}\n")
+        self.results.put(output.getvalue())
+
+    def _poll_results(self):
+        # Tk widgets may only be updated from the UI thread
+        try:
+            while True:
+                self._show(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        self.after(100, self._poll_results)
+
+    def _show(self, text):
+        self.output.config(state="normal")
+        self.output.delete("1.0", "end")
+        self.output.insert("end", text)
+        self.output.config(state="disabled")
+
+
+class LoginFrame(ttk.Frame):
+    """Asks for a username and password before the rest of the window is shown."""
+
+    def __init__(self, master, on_login):
+        super().__init__(master, padding=20)
+        self.on_login = on_login
+        ttk.Label(self, text="=== Login ===").grid(row=0, column=0, columnspan=2, pady=5)
+        ttk.Label(self, text="Username").grid(row=1, column=0, sticky="w")
+        self.username = ttk.Entry(self)
+        self.username.grid(row=1, column=1, pady=2)
+        ttk.Label(self, text="Password").grid(row=2, column=0, sticky="w")
+        self.password = ttk.Entry(self, show="*")
+        self.password.grid(row=2, column=1, pady=2)
+        self.button = ttk.Button(self, text="Login", command=self._login)
+        self.button.grid(row=3, column=0, columnspan=2, pady=5)
+        self.password.bind("<Return>", lambda e: self._login())
+        self.username.focus_set()
+        self.results = queue.Queue()  # Result of the login check, read on the UI thread
+
+    def _login(self):
+        """Check the credentials in a worker thread; hashing the password takes long enough to freeze the window."""
+        if str(self.button["state"]) == "disabled":  # A check is already running
+            return
+        self.button.config(state="disabled")
+        context = contextvars.copy_context()  # The worker checks the window's store
+        threading.Thread(target=context.run, args=(self._worker, self.username.get(), self.password.get()),
+                         daemon=True).start()
+        self.after(50, self._poll_result)
+
+    def _worker(self, username, password):
+        self.results.put(main.check_credentials(username, password))
+
+    def _poll_result(self):
+        # Tk widgets may only be updated from the UI thread
+        try:
+            user = self.results.get_nowait()
+        except queue.Empty:
+            self.after(50, self._poll_result)
+            return
+        self.button.config(state="normal")
+        if user is None:
+            messagebox.showerror("Login", "Invalid username or password.", parent=self)
+        else:
+            self.on_login(user)
+
+
+class TravelManagementApp(tk.Tk):
+    """The main window."""
+
+    def __init__(self):
+        super().__init__()
+        self.title("Simple Travel Management System")
+        self.geometry("1000x650")
+        self.login = LoginFrame(self, self._show_main)
+        self.login.pack(expand=True)
+
+    def _show_main(self, user):
+        """Replace the login form with tabs for the user's role."""
+        self.login.destroy()
+        self.title(f"Simple Travel Management System - {user['username']}")
+        notebook = ttk.Notebook(self)
+        notebook.pack(fill="both", expand=True)
+        notebook.add(CollectionTab(notebook, "trips"), text="Trips")
+        notebook.add(CollectionTab(notebook, "travelers"), text="Travelers")
+        notebook.add(CollectionTab(notebook, "trip_legs"), text="Trip Legs")
+        if user['role'] in ["manager", "administrator"]:  # Same rule as the console reporting menu
+            notebook.add(ReportsTab(notebook), text="Reports")
+
+
+if __name__ == "__main__":
+    TravelManagementApp().mainloop()
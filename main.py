@@ -2,32 +2,2289 @@
 # A basic console application for managing trips and travelers
 
 import datetime  # For handling dates
+import io  # For capturing report output
+import contextlib  # For redirecting report output
+import contextvars  # For the store each thread or task is working on
+import functools  # For wrapping cached reports
+import html  # For escaping text in HTML itineraries
+import time  # For timing exports
+import concurrent.futures  # For exporting itineraries in parallel
+import json  # For writing the change feed
+import threading  # For flushing the change feed in the background
+import atexit  # For flushing the change feed when the program exits
+import weakref  # For tracking stores without keeping them alive
+import bisect  # For looking up versions in the change history
+import array  # For the compact category code columns of trip legs
+import csv  # For writing the emergency contact roster
+import difflib  # For comparing traveler names
+import math  # For the log scale of cost statistics
+import gzip  # For compressing archived trips
+import hashlib  # For hashing passwords
+import hmac  # For comparing password hashes in constant time
+import secrets  # For salts and session tokens
+import itertools  # For flattening trip memberships
+import operator  # For fast field access in vectorized reports
 import uuid  # For generating unique IDs
 import os  # For clearing the console screen
+import sys  # For interning repeated strings
 import matplotlib.pyplot as plt  # For creating visualizations
+import numpy as np  # For fast counting over encoded columns
 from collections import Counter  # For counting occurrences of items (e.g., transport modes)
+from collections import deque  # For the bounded undo stack
 import tkinter as tk
 from tkinter import messagebox
 
 
+# Stores
+# All data lives in a `Store`: the four collections and everything kept in step with them (versions, indexes,
+# the lock, history, caches and sessions). Module-level names such as `trips` or `legs_by_trip` are `StoreLocal`s
+# that refer to the current store's own object, so every function works on whichever store is current:
+# `default_store` unless the caller switches with `use_store(store)` or `store.run(function, ...)`. The current
+# store is a context variable, so threads and tasks can work on different stores at the same time.
+# Category dictionaries and exchange rates are shared, as they only map values to codes and rates.
+class StoreLocal:
+    """
+    A module-level name for an object that each store has its own copy of.
+    The copy is made by `factory` the first time the name is used with a store; attribute access, item access,
+    iteration and `with` are passed on to the current store's copy.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "factory", factory)
+
+    def resolve(self):
+        """Get the current store's copy."""
+        store = _current_store.get(default_store)
+        value = store.locals.get(self)  # Inlined `Store.local`, as every use of the name goes through here
+        return value if value is not None else store.local(self)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __bool__(self):
+        return bool(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __reversed__(self):
+        return reversed(self.resolve())
+
+    def __contains__(self, item):
+        return item in self.resolve()
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __setitem__(self, key, value):
+        self.resolve()[key] = value
+
+    def __delitem__(self, key):
+        del self.resolve()[key]
+
+    def __enter__(self):
+        return self.resolve().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.resolve().__exit__(exc_type, exc_value, traceback)
+
+    def __eq__(self, other):
+        return self.resolve() == (other.resolve() if isinstance(other, StoreLocal) else other)
+
+    __hash__ = object.__hash__  # Each name is one key of `Store.locals`
+
+    def __repr__(self):
+        return repr(self.resolve())
+
+
+class Store:
+    """
+    The data of one agency, such as one tenant or one test.
+    Stores share nothing, so work on one store never sees or blocks on another.
+    """
+    instances = weakref.WeakSet()  # Every store, for closing their change feeds on exit
+
+    def __init__(self, data=None):
+        """
+        :param data: Dictionary mapping collection names to lists of records to start with (optional).
+                     A store starts with the default admin user (`DEFAULT_ADMIN`) unless `data` has its own users.
+        """
+        self.locals = {}  # Maps each `StoreLocal` to this store's copy
+        self.change_feed = None  # The active `ChangeFeed`, if change capture is enabled
+        self._creating = threading.RLock()  # Held while copies are made, so each is made once
+        Store.instances.add(self)
+        if data:
+            with use_store(self):
+                for name, records in data.items():
+                    if name == "users":
+                        collections_by_name[name].clear()  # The store's own users replace the default admin
+                    collections_by_name[name].extend(records)
+
+    def local(self, name):
+        """Get this store's copy of a `StoreLocal`, making it on first use."""
+        value = self.locals.get(name)
+        if value is None:
+            with self._creating:
+                value = self.locals.get(name)
+                if value is None:
+                    with use_store(self):  # The factory may use other names, which must be this store's too
+                        value = name.factory()
+                    self.locals[name] = value
+        return value
+
+    def run(self, function, *args, **kwargs):
+        """
+        Call a function with this store as the current store, e.g. `pool.submit(store.run, report)`.
+        :return: The function's result.
+        """
+        with use_store(self):
+            return function(*args, **kwargs)
+
+
+_current_store = contextvars.ContextVar("current_store")
+
+
+@contextlib.contextmanager
+def use_store(store):
+    """Make a store the current store inside a `with` block (in this thread or task only)."""
+    token = _current_store.set(store)
+    try:
+        yield store
+    finally:
+        _current_store.reset(token)
+
+
+def current_store():
+    """Get the store the current thread or task is working on."""
+    return _current_store.get(default_store)
+
+
+# The store used unless another one is selected
+default_store = Store()
+
 # Data storage (using simple lists instead of a database)
 # `trips` stores details of all trips
 # `travelers` stores details of all travelers
 # `trip_legs` stores details of individual trip legs
 # `users` stores user accounts (coordinators, managers, and administrators)
-trips = []
-travelers = []
-trip_legs = []
-users = []
+trips = StoreLocal(list)
+travelers = StoreLocal(list)
+trip_legs = StoreLocal(list)
+users = StoreLocal(lambda: [dict(DEFAULT_ADMIN)])  # Every store starts with the default admin user
 
 # Default admin user
 # Predefined administrator account for initial access
-users.append({
+# The password ("admin123") is stored hashed like any other; the hash is computed ahead so starting up stays fast.
+DEFAULT_ADMIN_PASSWORD = ("pbkdf2_sha256$600000$a8b56d805e2c172ec8a7474d607dfc61$"
+                          "d5ac83f6af6c3ef639bfe868d36c18748a23950e3ccf83bbfeb2e86270b18cb4")
+DEFAULT_ADMIN = {
     "id": "admin1",  # Unique ID for the admin
     "username": "admin",  # Admin username
-    "password": "admin123",  # Admin password
+    "password": DEFAULT_ADMIN_PASSWORD,  # Hash of the admin password
     "role": "administrator"  # Role of the user
-})
+}
+
+# Collection versions
+# Every function that changes a collection calls `record_change`, which bumps that collection's version.
+# Anything derived from a collection (such as a cached report) can compare versions to know if it is stale.
+collections_by_name = StoreLocal(lambda: {"trips": trips.resolve(), "travelers": travelers.resolve(),
+                                          "trip_legs": trip_legs.resolve(), "users": users.resolve()})
+collection_versions = StoreLocal(lambda: {name: 0 for name in collections_by_name})
+indexes_by_collection = StoreLocal(lambda: {name: [] for name in collections_by_name})  # Updated by `record_change`
+
+
+def record_change(collection, action, record, previous=None):
+    """
+    Register a change to a collection.
+    :param collection: Name of the changed collection ("trips", "travelers", "trip_legs" or "users").
+    :param action: What happened to the record ("create", "update" or "delete").
+    :param record: The record that was changed (the new version for updates).
+    :param previous: The version the update replaced (updates only).
+    """
+    record_changes(collection, action, [(record, previous)])
+
+
+def record_changes(collection, action, changes):
+    """
+    Register several changes of the same kind to a collection with a single version bump.
+    :param collection: Name of the changed collection.
+    :param action: What happened to the records ("create", "update" or "delete").
+    :param changes: List of (record, previous) pairs, as for `record_change`.
+    """
+    collection_versions[collection] += 1
+    _frozen_collections.pop(collection, None)  # Out of date; open snapshots keep their own reference
+    for index in indexes_by_collection[collection]:
+        for record, previous in changes:
+            index.apply(action, record, previous)
+    feed = current_store().change_feed
+    for record, previous in changes:
+        change_history.record(collection, action, record, previous)
+        if feed is not None:
+            feed.emit(collection, action, record)
+
+
+def list_signature(records):
+    """
+    Get a cheap fingerprint of a list: its length and the identity of its first and last records.
+    Used to notice lists that were edited directly instead of through `record_change`.
+    :param records: The list to fingerprint.
+    :return: A tuple of (length, id of first record, id of last record).
+    """
+    if isinstance(records, StoreLocal):
+        records = records.resolve()  # Look the list up once rather than for each step
+    if not records:
+        return 0, None, None
+    return len(records), id(records[0]), id(records[-1])
+
+
+class CollectionIndex:
+    """
+    Groups the records of a collection by a key, e.g. trip legs by trip ID.
+    Kept up to date by `record_change`. If the list was edited directly (its signature no longer
+    matches), the index is rebuilt on the next lookup.
+    """
+
+    def __init__(self, collection, key):
+        """
+        :param collection: Name of the indexed collection.
+        :param key: Function returning the key of a record.
+        """
+        self.collection = collection
+        self.key = key
+        self.groups = {}  # Maps each key to its records, in insertion order
+        self.keys = {}  # Maps record IDs to their current key, to move records when the key changes
+        self.signature = None  # `list_signature` of the indexed list (None until first built)
+        indexes_by_collection[collection].append(self)
+
+    def rebuild(self):
+        """Build the index from scratch."""
+        self.groups = {}
+        self.keys = {}
+        for record in collections_by_name[self.collection]:
+            self._add(record)
+        self.signature = list_signature(collections_by_name[self.collection])
+
+    def refresh(self):
+        """Build the index if it was never built or its list was edited directly."""
+        if self.signature != list_signature(collections_by_name[self.collection]):
+            self.rebuild()
+
+    def lookup(self, value):
+        """
+        Get the records with the given key.
+        :param value: The key to look up.
+        :return: A list of matching records (empty if there are none).
+        """
+        self.refresh()
+        return self.groups.get(value, [])
+
+    def all_groups(self):
+        """
+        Get every group of the index.
+        :return: A list of (key, records) pairs; the record lists are copies.
+        """
+        self.refresh()
+        return [(key, list(group)) for key, group in self.groups.items()]
+
+    def check(self):
+        """
+        Mark the index for a rebuild if its list was edited directly.
+        Called before each write, so a change is never applied on top of a stale index.
+        """
+        if self.signature != list_signature(collections_by_name[self.collection]):
+            self.signature = None
+
+    def apply(self, action, record, previous=None):
+        """Update the index after a record was created, updated or deleted."""
+        if self.signature is None:
+            return  # Not built yet; it will be built on first lookup
+        if action == "create":
+            self._add(record)
+        elif action == "delete":
+            self._remove(record)
+        else:  # Update: the new version replaces the previous one
+            self._remove(previous if previous is not None else record)
+            self._add(record)
+        self.signature = list_signature(collections_by_name[self.collection])
+
+    def _add(self, record):
+        key = self.key(record)
+        self.groups.setdefault(key, []).append(record)
+        self.keys[record['id']] = key
+
+    def _remove(self, record):
+        key = self.keys.pop(record['id'], None)
+        group = self.groups.get(key, [])
+        for i, other in enumerate(group):
+            if other is record:
+                del group[i]
+                break
+        if not group:
+            self.groups.pop(key, None)
+
+
+# Trip legs grouped by the trip they belong to
+legs_by_trip = StoreLocal(lambda: CollectionIndex("trip_legs", lambda leg: leg['trip_id']))
+
+
+def collection_token(collection):
+    """
+    Get a token that changes whenever a collection changes.
+    The list signature is included so that lists edited directly (without `record_change`) are still noticed.
+    :param collection: Name of the collection.
+    :return: A tuple of (version, list signature).
+    """
+    return collection_versions[collection], list_signature(collections_by_name[collection])
+
+
+# Copy-on-write updates and snapshots
+# Records are never changed in place once they are in a collection. An update builds an updated copy
+# and swaps it into the list in one step, so a reader holding the old record keeps a consistent view.
+# All changes to the lists happen while holding `store_lock`.
+store_lock = StoreLocal(threading.RLock)
+
+
+def _find_position(records, record, position=None):
+    """
+    Find where a record is stored in a list.
+    :param records: The list to search.
+    :param record: The record, matched by identity first and then by ID.
+    :param position: Where the record is expected to be (optional, checked first).
+    :return: The position, or None if the record is no longer in the list.
+    """
+    if position is not None and position < len(records) and records[position] is record:
+        return position
+    for i, other in enumerate(records):
+        if other is record:
+            return i
+    for i, other in enumerate(records):
+        if other['id'] == record['id']:
+            return i
+    return None
+
+
+def check_indexes(collection):
+    """Mark the indexes of a collection for a rebuild if the list was edited directly."""
+    for index in indexes_by_collection[collection]:
+        index.check()
+
+
+def insert_record(collection, record):
+    """
+    Add a new record to a collection.
+    :param collection: Name of the collection.
+    :param record: The new record.
+    :return: The record.
+    """
+    with store_lock:
+        check_indexes(collection)
+        collections_by_name[collection].append(record)
+        record_change(collection, "create", record)
+    return record
+
+
+def update_record(collection, record, changes, position=None):
+    """
+    Replace a record with a copy that has some fields changed.
+    :param collection: Name of the collection.
+    :param record: The current record.
+    :param changes: Dictionary of fields to change.
+    :param position: Where the record is expected to be in the list (optional).
+    :return: The updated record, or None if the record no longer exists.
+    """
+    with store_lock:
+        check_indexes(collection)
+        records = collections_by_name[collection]
+        position = _find_position(records, record, position)
+        if position is None:
+            return None
+        previous = records[position]
+        updated = {**previous, **changes}
+        records[position] = updated  # Readers see either the old or the new record, never a mix
+        record_change(collection, "update", updated, previous)
+    return updated
+
+
+def remove_record(collection, record, position=None):
+    """
+    Remove a record from a collection.
+    :param collection: Name of the collection.
+    :param record: The record to remove.
+    :param position: Where the record is expected to be in the list (optional).
+    :return: True if the record was removed.
+    """
+    with store_lock:
+        check_indexes(collection)
+        records = collections_by_name[collection]
+        position = _find_position(records, record, position)
+        if position is None:
+            return False
+        removed = records.pop(position)
+        record_change(collection, "delete", removed)
+    return True
+
+
+def remove_records(collection, ids):
+    """
+    Remove many records in one pass over the list, registered as one change.
+    :param collection: Name of the collection.
+    :param ids: IDs of the records to remove.
+    :return: The list of removed records.
+    """
+    ids = set(ids)
+    with store_lock:
+        check_indexes(collection)
+        records = collections_by_name[collection]
+        removed = [record for record in records if record['id'] in ids]
+        if removed:
+            records[:] = [record for record in records if record['id'] not in ids]
+            record_changes(collection, "delete", [(record, None) for record in removed])
+    return removed
+
+
+# Batch updates
+# Fields that `batch_update` may change, with the type each value must have
+BATCH_FIELDS = {
+    "trips": {"name": str, "start_date": datetime.date, "duration": int, "coordinator": str, "contact": str},
+    "travelers": {"name": str, "address": str, "dob": datetime.date, "emergency_contact": str,
+                  "gov_id_type": str, "gov_id_number": str},
+    "trip_legs": {"start_location": str, "destination": str, "transport_provider": str, "transport_mode": str,
+                  "leg_type": str, "cost": int, "currency": str, "departure": datetime.datetime,
+                  "arrival": datetime.datetime},
+}
+
+
+def _check_batch_value(field, value, expected):
+    """
+    Check one patched value.
+    :return: An error message, or None if the value is valid.
+    """
+    if value is None and expected is datetime.datetime:
+        return None  # Leg times are optional
+    if isinstance(value, bool) or not isinstance(value, expected):
+        return f"{field} must be {expected.__name__}, not {type(value).__name__}"
+    if expected is str and not value:
+        return f"{field} cannot be empty"
+    if field in ("duration", "cost") and value < 0:
+        return f"{field} cannot be negative"
+    return None
+
+
+def _apply_updates(collection, updates):
+    """
+    Swap updated records into a collection and register them as one change.
+    If anything fails, the previous records are put back before the error is raised.
+    :param collection: Name of the collection.
+    :param updates: List of (position, previous, updated) tuples.
+    """
+    records = collections_by_name[collection]
+    applied = 0
+    try:
+        for position, previous, updated in updates:
+            records[position] = updated
+            applied += 1
+        with change_group():
+            record_changes(collection, "update", [(updated, previous) for _, previous, updated in updates])
+    except BaseException:
+        for position, previous, _ in updates[:applied]:
+            records[position] = previous
+        check_indexes(collection)  # Indexes may hold some of the new records; rebuild them
+        collection_versions[collection] += 1
+        raise
+
+
+def batch_update(collection, patch, ids=None, predicate=None):
+    """
+    Apply the same changes to many records at once.
+    Every change is validated before anything is written, then all records are replaced together with a
+    single version bump, so readers and reports see either none or all of the batch. Undone as one action.
+    :param collection: "trips", "travelers" or "trip_legs".
+    :param patch: Dictionary of fields to change. A value may be a function that receives the current
+                  record and returns the new value, e.g. {"cost": lambda leg: round(leg["cost"] * 1.1)}.
+    :param ids: IDs of the records to change (optional).
+    :param predicate: Function returning True for the records to change (optional).
+                      With both `ids` and `predicate`, only listed records that match are changed.
+    :return: The list of updated records.
+    :raises ValueError: If the patch, the IDs or any new value is invalid. Nothing is changed in that case.
+    """
+    fields = BATCH_FIELDS.get(collection)
+    if fields is None:
+        raise ValueError(f"Batch updates are not supported for {collection}")
+    unknown = sorted(set(patch) - set(fields))
+    if unknown:
+        raise ValueError(f"Fields cannot be batch updated: {', '.join(unknown)}")
+    if ids is None and predicate is None:
+        raise ValueError("Give a list of IDs, a predicate, or both")
+
+    with store_lock:
+        check_indexes(collection)
+        records = collections_by_name[collection]
+
+        # Select the records
+        if ids is not None:
+            wanted = set(ids)
+            positions = [i for i, record in enumerate(records) if record['id'] in wanted]
+            missing = wanted - {records[i]['id'] for i in positions}
+            if missing:
+                raise ValueError(f"Records not found: {', '.join(sorted(missing))}")
+        else:
+            positions = range(len(records))
+        if predicate is not None:
+            positions = [i for i in positions if predicate(records[i])]
+
+        # Build and validate every new record before anything is written
+        updates, errors = [], []
+        for i in positions:
+            previous = records[i]
+            changes = {field: value(previous) if callable(value) else value for field, value in patch.items()}
+            for field, value in changes.items():
+                error = _check_batch_value(field, value, fields[field])
+                if error:
+                    errors.append(f"{previous['id']}: {error}")
+            if collection == "trip_legs":
+                encode_leg_categories(changes)  # Share one value per category
+            updates.append((i, previous, {**previous, **changes}))
+
+        if collection == "travelers" and {"gov_id_type", "gov_id_number"} & set(patch):
+            errors.extend(_check_batch_gov_ids(updates))
+        if errors:
+            shown = "; ".join(errors[:5]) + (f" (and {len(errors) - 5} more)" if len(errors) > 5 else "")
+            raise ValueError(f"Batch update rejected: {shown}")
+
+        if updates:
+            _apply_updates(collection, updates)
+    return [updated for _, _, updated in updates]
+
+
+def _check_batch_gov_ids(updates):
+    """
+    Check that patched travelers would not share a government ID with anyone else.
+    :param updates: List of (position, previous, updated) tuples.
+    :return: A list of error messages.
+    """
+    changing = {previous['id'] for _, previous, _ in updates}
+    errors, seen = [], {}
+    for _, _, updated in updates:
+        key = normalize_gov_id(updated['gov_id_type'], updated['gov_id_number'])
+        others = [other for other in travelers_by_gov_id.lookup(key) if other['id'] not in changing]
+        if others or key in seen:
+            errors.append(f"{updated['id']}: government ID already used by {others[0]['id'] if others else seen[key]}")
+        seen.setdefault(key, updated['id'])
+    return errors
+
+
+class FrozenCollection:
+    """
+    The records of one collection at one version, shared by every snapshot taken at that version.
+    Derived data (such as legs grouped by trip) is computed once and kept with it.
+    """
+
+    def __init__(self, token, records):
+        self.token = token
+        self.records = records  # A tuple of the records (the records themselves are not copied)
+        self.groups = {}  # Cached groupings, by name
+
+    def group_by(self, name, key):
+        """
+        Group the records by a key, computing the grouping only once per version.
+        :param name: Name under which the grouping is cached.
+        :param key: Function returning the key of a record.
+        :return: A dictionary mapping keys to lists of records.
+        """
+        grouping = self.groups.get(name)
+        if grouping is None:
+            grouping = {}
+            for record in self.records:
+                grouping.setdefault(key(record), []).append(record)
+            self.groups[name] = grouping
+        return grouping
+
+
+# The latest frozen copy of each collection. It is kept until the collection changes, so snapshots taken while
+# nothing has changed (such as reads for cached reports) copy nothing; older copies last only as long as their snapshots.
+_frozen_collections = StoreLocal(dict)
+
+
+class StoreSnapshot:
+    """
+    A consistent, read-only view of all collections at one point in time.
+    Taking a snapshot copies only the lists of references, and snapshots taken while nothing has changed
+    share the same copy. Use as a context manager so the memory is released when reading is finished.
+    """
+
+    def __init__(self, frozen):
+        self._frozen = frozen  # Maps collection names to `FrozenCollection`s
+
+    @property
+    def trips(self):
+        return self._frozen["trips"].records
+
+    @property
+    def travelers(self):
+        return self._frozen["travelers"].records
+
+    @property
+    def trip_legs(self):
+        return self._frozen["trip_legs"].records
+
+    @property
+    def users(self):
+        return self._frozen["users"].records
+
+    def token(self, collection):
+        """Get the `collection_token` the collection had when the snapshot was taken."""
+        return self._frozen[collection].token
+
+    def legs_by_trip(self):
+        """Get the snapshot's trip legs grouped by trip ID."""
+        return self._frozen["trip_legs"].group_by("trip_id", lambda leg: leg['trip_id'])
+
+    def close(self):
+        """Release the snapshot's references to the data."""
+        self._frozen = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_snapshot():
+    """
+    Take a consistent snapshot of all collections for reading.
+    Writes can continue while the snapshot is in use; they are not visible through it.
+    :return: A `StoreSnapshot`.
+    """
+    with store_lock:
+        frozen = {}
+        for name, records in collections_by_name.items():
+            token = collection_token(name)
+            shared = _frozen_collections.get(name)
+            if shared is None or shared.token != token:
+                shared = FrozenCollection(token, tuple(records))
+                _frozen_collections[name] = shared
+            frozen[name] = shared
+    return StoreSnapshot(frozen)
+
+
+# Change history, undo and redo
+# For every record, each field keeps a list of (time, value) versions. Updates add versions only for
+# the fields they change, and values are shared with the records rather than copied, so history
+# stays small. Looking up a record as of a time is a binary search per field.
+_EXISTS = "__exists__"  # Pseudo-field tracking when a record was created and deleted
+HISTORY_FIELDS_HIDDEN = {"password"}  # Fields never kept in the history, so old values cannot be read back
+UNDO_LIMIT = 1000  # Number of undoable actions kept
+UNDO_SKIPPED = {"users"}  # Collections edited only by administrators, so another role's undo never reverts them
+
+
+class RecordHistory:
+    """The versions of one record, stored field by field."""
+
+    def __init__(self, base=None):
+        """
+        :param base: The record as it was before history was kept, if it already existed then.
+                     Its values apply at all times until a field has a later version.
+        """
+        self.base = base
+        self.fields = {}  # Maps field names to ([times], [values]), sorted by time
+
+    def set(self, when, field, value):
+        """Add a version of a field."""
+        times, values = self.fields.setdefault(field, ([], []))
+        times.append(when)
+        values.append(value)
+
+    def as_of(self, when):
+        """
+        Rebuild the record as it was at a point in time.
+        :param when: A timestamp (seconds since the epoch).
+        :return: The record dictionary, or None if it did not exist at that time.
+        """
+        record = dict(self.base) if self.base is not None else {}
+        record[_EXISTS] = self.base is not None
+        for field, (times, values) in self.fields.items():
+            position = bisect.bisect_right(times, when)
+            if position:
+                record[field] = values[position - 1]
+        if not record.pop(_EXISTS):
+            return None
+        return record
+
+    def versions(self):
+        """Get the times at which the record changed, oldest first."""
+        return sorted({when for times, _ in self.fields.values() for when in times})
+
+
+def _visible_fields(record):
+    """Copy a record without the fields that are never kept in the history."""
+    return {field: value for field, value in record.items() if field not in HISTORY_FIELDS_HIDDEN}
+
+
+class ChangeHistory:
+    """History of all records plus the undo and redo stacks."""
+
+    def __init__(self):
+        self.records = {}  # Maps (collection, record ID) to `RecordHistory`
+        self.undo_stack = deque(maxlen=UNDO_LIMIT)  # Each entry is a list of changes
+        self.redo_stack = []
+        self.group = None  # Changes of the action in progress (see `change_group`)
+        self.replaying = False  # True while undoing or redoing
+
+    def record(self, collection, action, record, previous):
+        """Store a change in the history and on the undo stack."""
+        when = time.time()
+        key = (collection, record['id'])
+        history = self.records.get(key)
+
+        if action == "create":
+            history = self.records[key] = RecordHistory()
+            for field, value in record.items():
+                if field not in HISTORY_FIELDS_HIDDEN:
+                    history.set(when, field, value)
+            history.set(when, _EXISTS, True)
+            change = (collection, action, record, None)
+        elif action == "update":
+            previous = previous if previous is not None else {}
+            if history is None:  # Record existed before history was kept; its old values are the base
+                history = self.records[key] = RecordHistory(_visible_fields(previous))
+            before, after = {}, {}
+            for field, value in record.items():
+                if field in HISTORY_FIELDS_HIDDEN:
+                    continue
+                if field not in previous or previous[field] is not value and previous[field] != value:
+                    history.set(when, field, value)
+                    before[field] = previous.get(field)
+                    after[field] = value
+            if not after:
+                return  # Nothing actually changed
+            change = (collection, action, record['id'], (before, after))
+        else:  # Delete
+            if history is None:
+                history = self.records[key] = RecordHistory(_visible_fields(record))
+            history.set(when, _EXISTS, False)
+            change = (collection, action, record, None)
+
+        if self.replaying or collection in UNDO_SKIPPED:
+            return
+        if self.group is not None:
+            self.group.append(change)
+        else:
+            self.undo_stack.append([change])
+        self.redo_stack.clear()  # A new change makes the undone changes unreachable
+
+
+change_history = StoreLocal(ChangeHistory)
+
+
+@contextlib.contextmanager
+def change_group():
+    """Treat all changes made inside the `with` block as one action for undo and redo."""
+    if change_history.group is not None:  # Already inside a group
+        yield
+        return
+    change_history.group = []
+    try:
+        yield
+    finally:
+        group, change_history.group = change_history.group, None
+        if group:
+            change_history.undo_stack.append(group)
+
+
+@contextlib.contextmanager
+def without_undo():
+    """Keep the changes made inside the `with` block off the undo stack (field history is still kept)."""
+    replaying, change_history.replaying = change_history.replaying, True
+    try:
+        yield
+    finally:
+        change_history.replaying = replaying
+
+
+def _apply_change(change, reverse):
+    """
+    Apply a recorded change forwards (redo) or backwards (undo).
+    :return: True if the change could be applied.
+    """
+    collection, action, target, fields = change
+    records = collections_by_name[collection]
+    if action == "update":
+        record = next((r for r in records if r['id'] == target), None)
+        if record is None:
+            return False
+        return update_record(collection, record, fields[0] if reverse else fields[1]) is not None
+    if (action == "create") == reverse:  # Undo a create, or redo a delete
+        return remove_record(collection, target)
+    insert_record(collection, target)  # Undo a delete, or redo a create
+    return True
+
+
+def _replay_updates(group, reverse):
+    """Undo or redo a group of updates to one collection as a single batch."""
+    collection = group[0][0]
+    check_indexes(collection)
+    records = collections_by_name[collection]
+    positions = {record['id']: i for i, record in enumerate(records)}
+    updates = []
+    for _, _, target, fields in group:
+        position = positions.get(target)
+        if position is None:
+            print(f"Could not {'undo' if reverse else 'redo'} a change to {collection}: record not found.")
+            continue
+        previous = records[position]
+        updates.append((position, previous, {**previous, **(fields[0] if reverse else fields[1])}))
+    if updates:
+        _apply_updates(collection, updates)
+
+
+def _replay(source, destination, reverse):
+    """Move the most recent action from one stack to the other, applying it."""
+    if not source:
+        return False
+    group = source.pop()
+    change_history.replaying = True
+    try:
+        with store_lock:
+            if (len(group) > 1 and all(change[1] == "update" and change[0] == group[0][0] for change in group)
+                    and len({change[2] for change in group}) == len(group)):
+                _replay_updates(group, reverse)  # A batch update: find all records in one pass
+            else:
+                for change in (reversed(group) if reverse else group):
+                    if not _apply_change(change, reverse):
+                        print(f"Could not {'undo' if reverse else 'redo'} a change to {change[0]}: record not found.")
+    finally:
+        change_history.replaying = False
+    destination.append(group)
+    return True
+
+
+def undo():
+    """
+    Undo the most recent action.
+    :return: True if there was something to undo.
+    """
+    return _replay(change_history.undo_stack, change_history.redo_stack, True)
+
+
+def redo():
+    """
+    Redo the most recently undone action.
+    :return: True if there was something to redo.
+    """
+    return _replay(change_history.redo_stack, change_history.undo_stack, False)
+
+
+def record_as_of(collection, record_id, when):
+    """
+    Get a record as it was at a point in time.
+    :param collection: Name of the collection.
+    :param record_id: ID of the record.
+    :param when: A `datetime.datetime` or a timestamp.
+    :return: The record dictionary, or None if it did not exist at that time (or has no history).
+    """
+    if isinstance(when, datetime.datetime):
+        when = when.timestamp()
+    history = change_history.records.get((collection, record_id))
+    return history.as_of(when) if history else None
+
+
+def record_history_menu():
+    """Prompt for a record and a time, then show the record as it was at that time."""
+    collection = get_input("Record type (trips/travelers/trip_legs/users): ").strip().lower()
+    if collection not in collections_by_name:
+        print("Invalid record type.")
+        return
+    record_id = get_input("Record ID: ")
+    history = change_history.records.get((collection, record_id))
+    if history is None:
+        print(f"No history found for {record_id}.")
+        return
+
+    print("\nChanged at:")
+    for when in history.versions():
+        print(f"- {datetime.datetime.fromtimestamp(when).strftime('%d/%m/%Y %H:%M:%S')}")
+
+    when_str = get_input("Show record as of (DD/MM/YYYY HH:MM, blank for now): ", True)
+    when = datetime.datetime.now()
+    if when_str:
+        try:
+            when = datetime.datetime.strptime(when_str, "%d/%m/%Y %H:%M")
+        except ValueError:
+            print("Invalid date format. Please use DD/MM/YYYY HH:MM.")
+            return
+
+    record = record_as_of(collection, record_id, when)
+    if record is None:
+        print("The record did not exist at that time.")
+        return
+    for field, value in record.items():
+        if field not in HISTORY_FIELDS_HIDDEN:
+            print(f"{field}: {value}")
+
+
+# Change feed
+# Every recorded change is also appended to a JSON Lines file with a sequence number, so other
+# systems (billing, notifications) can follow changes without comparing whole datasets.
+# Events are buffered and written in batches to keep the cost of each change low.
+CHANGE_FEED_FIELDS_HIDDEN = {"password"}  # Fields never written to the feed
+
+
+def _json_value(value):
+    """Convert values that `json` cannot serialise (such as dates) to strings."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class ChangeFeed:
+    """
+    Append-only change feed.
+    Events are queued by `emit` and written when `batch_size` events are waiting,
+    after `flush_interval` seconds, or when `flush`/`close` is called.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        """
+        :param path: Path of the JSON Lines file (created if it does not exist).
+        :param batch_size: Number of queued events that triggers a write.
+        :param flush_interval: Maximum number of seconds an event waits before being written.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = []  # Serialised events waiting to be written
+        self.timer = None
+        _truncate_partial_line(path)  # Drop an event whose write was interrupted
+        self.sequence = last_change_sequence(path)  # Continue numbering after existing events
+
+    def emit(self, collection, action, record):
+        """
+        Queue an event describing a change.
+        :param collection: Name of the changed collection.
+        :param action: "create", "update" or "delete".
+        :param record: The changed record.
+        """
+        with self.lock:
+            self.sequence += 1
+            event = {
+                "seq": self.sequence,
+                "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "collection": collection,
+                "action": action,
+                "id": record.get('id'),
+                "record": {k: v for k, v in record.items() if k not in CHANGE_FEED_FIELDS_HIDDEN}
+            }
+            # Serialise now, so later edits to the record do not change the event
+            self.pending.append(json.dumps(event, default=_json_value) + "\n")
+
+            if len(self.pending) >= self.batch_size:
+                self._write_pending()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Write all queued events to the file."""
+        with self.lock:
+            self._write_pending()
+
+    def close(self):
+        """Write queued events and stop the flush timer."""
+        self.flush()
+
+    def _write_pending(self):
+        # Must be called with the lock held
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.pending:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(self.pending))
+            self.pending = []
+
+
+# Feed file used by `main`. Events include travelers' personal details, so the feed is only written when asked for.
+CHANGE_FEED_PATH = os.environ.get("TMS_CHANGE_FEED")
+
+
+def enable_change_feed(path, batch_size=100, flush_interval=1.0):
+    """
+    Start writing every change to the current store to a change feed file.
+    :param path: Path of the JSON Lines file.
+    :param batch_size: Number of queued events that triggers a write.
+    :param flush_interval: Maximum number of seconds an event waits before being written.
+    :return: The new `ChangeFeed`.
+    """
+    disable_change_feed()
+    store = current_store()
+    store.change_feed = ChangeFeed(path, batch_size, flush_interval)
+    return store.change_feed
+
+
+def disable_change_feed():
+    """Write any queued events and stop capturing changes to the current store."""
+    store = current_store()
+    if store.change_feed is not None:
+        store.change_feed.close()
+        store.change_feed = None
+
+
+@atexit.register
+def _close_change_feeds():
+    """Write queued events of every store before the program exits."""
+    for store in list(Store.instances):
+        store.run(disable_change_feed)
+
+
+def _read_line_at(f, offset):
+    """
+    Find the first complete line starting at or after a byte offset.
+    :return: A tuple of (line start offset, line bytes), with empty bytes at the end of the file.
+    """
+    if offset > 0:
+        f.seek(offset - 1)
+        if f.read(1) != b"\n":
+            f.readline()  # Skip the rest of a partial line
+    else:
+        f.seek(0)
+    start = f.tell()
+    return start, f.readline()
+
+
+def last_change_sequence(path):
+    """
+    Get the sequence number of the last complete event in a change feed file.
+    Only the end of the file is read, and a partial last line (from an interrupted write) is skipped.
+    :param path: Path of the feed.
+    :return: The last sequence number, or 0 if the feed is empty or missing.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        block = 4096
+        while True:
+            start = max(0, end - block)
+            f.seek(start)
+            lines = f.read(end - start).split(b"\n")[:-1]  # The last piece is empty or a partial line
+            if start > 0:
+                lines = lines[1:]  # The first piece may begin in the middle of a line
+            lines = [line for line in lines if line.strip()]
+            if lines or start == 0:
+                return json.loads(lines[-1])["seq"] if lines else 0
+            block *= 2
+
+
+def _truncate_partial_line(path):
+    """Remove a partial last line left by an interrupted write, so the next event starts on a line of its own."""
+    if not os.path.exists(path):
+        return
+    with open(path, "r+b") as f:
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+def find_change_offset(path, sequence):
+    """
+    Find the byte offset of the first event with a sequence number of at least `sequence`.
+    Uses a binary search over the file, so it reads only a few lines of a large feed.
+    :param path: Path of the feed.
+    :param sequence: The sequence number to start from.
+    :return: A byte offset to pass to `read_changes`.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        low, high = 0, os.path.getsize(path)
+        while low < high:
+            middle = (low + high) // 2
+            start, line = _read_line_at(f, middle)
+            if not line.endswith(b"\n"):
+                high = middle  # Nothing complete after this point
+            elif json.loads(line)["seq"] < sequence:
+                low = start + len(line)
+            else:
+                high = middle
+        return _read_line_at(f, low)[0]
+
+
+def read_changes(path, offset=0, limit=None):
+    """
+    Read events from a change feed, starting at a byte offset.
+    A line that is still being written is not returned, so readers can poll safely.
+    :param path: Path of the feed.
+    :param offset: Byte offset to start from (0, or a `next_offset` returned earlier).
+    :param limit: Maximum number of events to read (optional).
+    :return: A generator of (event, next_offset) pairs.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(offset)
+        count = 0
+        for line in f:
+            if not line.endswith(b"\n") or (limit is not None and count >= limit):
+                break
+            offset += len(line)
+            count += 1
+            yield json.loads(line), offset
+
+
+def follow_changes(path, offset=0, poll_interval=0.5):
+    """
+    Read events from a change feed forever, waiting for new events when the end is reached.
+    :param path: Path of the feed.
+    :param offset: Byte offset to start from.
+    :param poll_interval: Seconds to wait between checks for new events.
+    :return: A generator of (event, next_offset) pairs.
+    """
+    while True:
+        received = False
+        for event, offset in read_changes(path, offset):
+            received = True
+            yield event, offset
+        if not received:
+            time.sleep(poll_interval)
+
+
+# Dictionary encoding for repeated trip leg attributes
+# Fields such as the transport mode take a small set of values that repeat across many legs.
+# Each distinct value is stored once and given an integer code, so legs share one string object
+# per value and group-by operations can count integer codes instead of comparing strings.
+LEG_CATEGORY_FIELDS = ["start_location", "destination", "transport_provider", "transport_mode", "leg_type"]
+
+
+def normalize_category(value):
+    """
+    Build the matching key for a category value.
+    Case and repeated whitespace are ignored, so "Train", "train" and " TRAIN " are the same category.
+    :param value: The raw value entered by the user.
+    :return: The normalized key.
+    """
+    return " ".join(str(value).split()).casefold()
+
+
+class CategoryDictionary:
+    """
+    Interned categories for one leg field.
+    `values[code]` is the display value of a category; the first spelling entered is kept.
+    """
+
+    def __init__(self):
+        self.values = []  # Display value for each code
+        self.codes = {}  # Maps normalized keys to codes
+        self.exact = {}  # Maps already seen spellings to codes, to skip normalization
+        self.lock = threading.Lock()  # Several threads may work on one store, so new codes are added one at a time
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """
+        Get the code for a value, adding a new category if it has not been seen before.
+        :param value: The raw value.
+        :return: The integer code of the category.
+        """
+        code = self.exact.get(value)
+        if code is None:
+            key = normalize_category(value)
+            with self.lock:
+                code = self.codes.get(key)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(sys.intern(" ".join(str(value).split())))
+                    self.codes[key] = code
+                self.exact[value] = code
+        return code
+
+    def find(self, value):
+        """
+        Get the code for a value without adding a new category.
+        :return: The integer code, or None if no such category has been seen.
+        """
+        code = self.exact.get(value)
+        return code if code is not None else self.codes.get(normalize_category(value))
+
+    def decode(self, code):
+        """Get the display value of a category code."""
+        return self.values[code]
+
+    def canonical(self, value):
+        """Get the shared display value for a raw value."""
+        return self.values[self.encode(value)]
+
+
+# One dictionary per encoded leg field, kept per store so one store's spellings never change another's data
+leg_categories = StoreLocal(lambda: {field: CategoryDictionary() for field in LEG_CATEGORY_FIELDS})
+
+
+def encode_leg_categories(leg):
+    """
+    Replace the categorical fields of a leg with their shared display values.
+    :param leg: The trip leg dictionary to update in place.
+    """
+    for field in LEG_CATEGORY_FIELDS:
+        if field in leg:
+            leg[field] = leg_categories[field].canonical(leg[field])
+
+
+_NO_CATEGORY = -1  # Code column entry of a deleted leg, or of a leg without the field
+
+
+class CategoryColumns:
+    """
+    The category codes of every trip leg, one column per encoded field, in the order of `trip_legs`.
+    Maintained like an index: `record_change` passes every trip leg change to `apply`, so counting a field
+    is a `bincount` over its column instead of encoding every leg again. Deleted legs leave a gap in the
+    columns until more than half of the entries are gaps, when the columns are rebuilt.
+    """
+
+    def __init__(self):
+        self.columns = {field: array.array("q") for field in LEG_CATEGORY_FIELDS}
+        self.positions = {}  # Maps leg IDs to their position in the columns
+        self.gaps = 0  # Number of positions left by deleted legs
+        self.signature = None  # `list_signature` of `trip_legs` (None until first built)
+        indexes_by_collection["trip_legs"].append(self)
+
+    def refresh(self):
+        """Build the columns if they were never built or `trip_legs` was edited directly."""
+        if self.signature != list_signature(trip_legs):
+            self.columns = {field: array.array("q") for field in LEG_CATEGORY_FIELDS}
+            self.positions = {}
+            self.gaps = 0
+            for leg in trip_legs:
+                self._append(leg)
+            self.signature = list_signature(trip_legs)
+
+    def check(self):
+        """Mark the columns for a rebuild if `trip_legs` was edited directly."""
+        if self.signature != list_signature(trip_legs):
+            self.signature = None
+
+    def apply(self, action, record, previous=None):
+        """Update the columns after a trip leg was created, updated or deleted."""
+        if self.signature is None:
+            return  # Not built yet; they will be built on first use
+        if action == "create":
+            self._append(record)
+        else:
+            position = self.positions.pop((previous if previous is not None else record)['id'], None)
+            if position is None:
+                self.signature = None  # Leg IDs were not unique; rebuild on first use
+                return
+            if action == "delete":
+                self._set(position, None)
+                self.gaps += 1
+            else:
+                self._set(position, record)
+                self.positions[record['id']] = position
+        if self.gaps > len(self.positions):
+            self.signature = None  # Mostly gaps; rebuild on first use
+        else:
+            self.signature = list_signature(trip_legs)
+
+    def count(self, field):
+        """
+        Count the legs per category of an encoded field.
+        Must be called with `store_lock` held, after `refresh`.
+        :return: A `Counter` mapping display values to counts, in order of first appearance.
+        """
+        dictionary = leg_categories[field]
+        codes = np.frombuffer(self.columns[field], dtype=np.int64) + 1  # Shifted so gaps are code 0
+        return _count_codes(dictionary, codes, 1)
+
+    def _append(self, leg):
+        self.positions[leg['id']] = len(self.columns[LEG_CATEGORY_FIELDS[0]])
+        categories = leg_categories.resolve()  # Look the store's dictionaries up once per leg
+        for field, column in self.columns.items():
+            column.append(categories[field].encode(leg[field]) if field in leg else _NO_CATEGORY)
+
+    def _set(self, position, leg):
+        categories = leg_categories.resolve()
+        for field, column in self.columns.items():
+            column[position] = categories[field].encode(leg[field]) if leg and field in leg else _NO_CATEGORY
+
+
+# Category code columns of the current trip legs
+leg_category_columns = StoreLocal(CategoryColumns)
+
+
+def _count_codes(dictionary, codes, offset=0):
+    """
+    Turn an array of category codes into counts per display value, in order of first appearance.
+    :param offset: Amount added to every code; smaller codes are not counted.
+    """
+    counts = np.bincount(codes, minlength=len(dictionary) + offset)
+    first_seen = np.full(len(counts), len(codes))
+    np.minimum.at(first_seen, codes, np.arange(len(codes)))  # Position of the first leg of each category
+    present = np.flatnonzero(counts[offset:]) + offset
+    return Counter({dictionary.decode(code - offset): int(counts[code])
+                    for code in present[np.argsort(first_seen[present], kind="stable")]})
+
+
+def count_by_category(field, legs):
+    """
+    Count legs per category of an encoded field.
+    All current trip legs (the `trip_legs` list, or the frozen copy a snapshot of unchanged data reads)
+    are counted from the maintained code columns; any other list of legs is encoded first.
+    :param field: One of `LEG_CATEGORY_FIELDS`.
+    :param legs: The trip legs to count.
+    :return: A `Counter` mapping display values to counts, in order of first appearance.
+    """
+    with store_lock:
+        frozen = _frozen_collections.get("trip_legs")
+        if legs is trip_legs or legs is trip_legs.resolve() or (
+                frozen is not None and legs is frozen.records and frozen.token == collection_token("trip_legs")):
+            leg_category_columns.refresh()
+            return leg_category_columns.count(field)
+    dictionary = leg_categories[field]
+    codes = np.fromiter((dictionary.encode(leg[field]) for leg in legs), dtype=np.int64, count=len(legs))
+    return _count_codes(dictionary, codes)
+
+
+# Cost anomaly detection
+# Costs are typed in by hand, so typos such as an extra zero slip through. For each transport mode and each
+# provider, the running mean and variance of leg costs are kept with Welford's algorithm, updated in constant
+# time as legs change. Costs are compared on a log scale, where an extra zero is the same distance at any price,
+# and only with costs in the same currency.
+ANOMALY_FIELDS = ("transport_mode", "transport_provider")  # Legs are compared within each of these groups
+ANOMALY_MIN_LEGS = 20  # Groups with fewer legs are not checked
+ANOMALY_THRESHOLD = 3.0  # Standard deviations from the group mean at which a cost is flagged
+ANOMALY_MIN_SPREAD = 0.05  # Lower bound for the standard deviation (log10 units), for groups of near-equal costs
+
+
+def _log_cost(cost):
+    """Put a cost on the log scale used for anomaly detection, or return None if it is not a usable cost."""
+    if isinstance(cost, bool) or not isinstance(cost, (int, float)) or cost < 0:
+        return None
+    return math.log10(cost + 1)
+
+
+def _welford(group, value, sign):
+    """
+    Add a value to running statistics, or remove it, in place.
+    :param group: A [count, mean, sum of squared differences from the mean] list.
+    :param value: The value to add or remove.
+    :param sign: 1 to add, -1 to remove.
+    """
+    count = group[0] + sign
+    if count <= 0:
+        group[:] = [0, 0.0, 0.0]
+        return
+    delta = value - group[1]
+    mean = group[1] + sign * delta / count
+    group[:] = [count, mean, max(0.0, group[2] + sign * delta * (value - mean))]
+
+
+class CostStatistics:
+    """
+    Running cost statistics per transport mode and per provider.
+    Maintained like an index: `record_change` passes every trip leg change to `apply`.
+    """
+
+    def __init__(self):
+        self.groups = {}  # Maps (field, category code, currency code) to [count, mean, sum of squared differences]
+        self.signature = None  # `list_signature` of `trip_legs` (None until first built)
+        indexes_by_collection["trip_legs"].append(self)
+
+    def refresh(self):
+        """Build the statistics if they were never built or `trip_legs` was edited directly."""
+        if self.signature != list_signature(trip_legs):
+            self.groups = {}
+            for leg in trip_legs:
+                self._update(leg, 1)
+            self.signature = list_signature(trip_legs)
+
+    def check(self):
+        """Mark the statistics for a rebuild if `trip_legs` was edited directly."""
+        if self.signature != list_signature(trip_legs):
+            self.signature = None
+
+    def apply(self, action, record, previous=None):
+        """Update the statistics after a trip leg was created, updated or deleted."""
+        if self.signature is None:
+            return  # Not built yet; they will be built on first use
+        if action == "create":
+            self._update(record, 1)
+        elif action == "delete":
+            self._update(record, -1)
+        else:
+            self._update(previous if previous is not None else record, -1)
+            self._update(record, 1)
+        self.signature = list_signature(trip_legs)
+
+    def _update(self, leg, sign):
+        value = _log_cost(leg.get('cost'))
+        if value is None:
+            return
+        currency = currencies.encode(normalize_currency(leg.get('currency')))
+        for field in ANOMALY_FIELDS:
+            if field in leg:
+                key = (field, leg_categories[field].encode(leg[field]), currency)
+                _welford(self.groups.setdefault(key, [0, 0.0, 0.0]), value, sign)
+
+
+# Cost statistics of the current trip legs
+leg_cost_stats = StoreLocal(CostStatistics)
+
+
+def _cost_warnings(groups, leg, previous=None):
+    """
+    Compare a leg's cost with its groups.
+    :param groups: `CostStatistics.groups` (or a copy).
+    :param leg: The trip leg to check.
+    :param previous: A leg counted in the groups to leave out of the comparison (such as the leg itself).
+    :return: A list of warnings (empty if the cost looks normal).
+    """
+    value = _log_cost(leg.get('cost'))
+    if value is None:
+        return []
+    currency = normalize_currency(leg.get('currency'))
+    excluded = None  # Cost of `previous`, if it is counted in the same groups
+    if previous is not None and normalize_currency(previous.get('currency')) == currency:
+        excluded = _log_cost(previous.get('cost'))
+    warnings = []
+    for field in ANOMALY_FIELDS:
+        code = leg_categories[field].find(leg.get(field, ""))
+        group = list(groups.get((field, code, currencies.find(currency)), (0, 0.0, 0.0)))
+        if excluded is not None and code is not None and leg_categories[field].find(previous.get(field, "")) == code:
+            _welford(group, excluded, -1)
+        count, mean, m2 = group
+        if count < ANOMALY_MIN_LEGS:
+            continue
+        score = (value - mean) / max(math.sqrt(m2 / (count - 1)), ANOMALY_MIN_SPREAD)
+        if abs(score) >= ANOMALY_THRESHOLD:
+            warnings.append(f"Cost {format_money(leg['cost'], currency)} is unusually "
+                            f"{'high' if score > 0 else 'low'} for {field.replace('_', ' ')} '{leg.get(field)}' "
+                            f"(typical {format_money(round(10 ** mean - 1), currency)} over {count} legs)")
+    return warnings
+
+
+def check_leg_cost(leg, previous=None):
+    """
+    Check a new or updated leg's cost against other legs of the same transport mode and provider.
+    :param leg: The trip leg being entered.
+    :param previous: The version being replaced, when checking an update.
+    :return: A list of warnings (empty if the cost looks normal).
+    """
+    with store_lock:
+        leg_cost_stats.refresh()
+        return _cost_warnings(leg_cost_stats.groups, leg, previous)
+
+
+def audit_leg_costs():
+    """
+    Check the cost of every current trip leg in one pass, leaving each leg out of its own groups.
+    Legs are read through a snapshot, so they are not copied again when a snapshot of the unchanged legs
+    already exists, and results are generated as they are found. Apart from the snapshot, memory use grows
+    only with the number of groups, whose statistics are copied so they match the snapshot.
+    :return: A generator of (leg, warnings) pairs for the legs with unusual costs.
+    """
+    with store_lock:
+        leg_cost_stats.refresh()
+        groups = {key: list(group) for key, group in leg_cost_stats.groups.items()}
+        snap = read_snapshot()
+    with snap:
+        for leg in snap.trip_legs:
+            warnings = _cost_warnings(groups, leg, leg)
+            if warnings:
+                yield leg, warnings
+
+
+def confirm_leg_cost(leg, previous=None):
+    """
+    Warn about an unusual cost and let the user correct it before the leg is saved.
+    :param leg: The trip leg being entered.
+    :param previous: The version being replaced, when checking an update.
+    :return: The cost to save.
+    """
+    warnings = check_leg_cost(leg, previous)
+    if not warnings:
+        return leg['cost']
+    for warning in warnings:
+        print(f"Warning: {warning}")
+    answer = get_input("Press Enter to keep this cost, or enter the correct cost: ", True)
+    if not answer:
+        return leg['cost']
+    try:
+        return int(answer)
+    except ValueError:
+        print("Invalid number. Keeping the entered cost.")
+        return leg['cost']
+
+
+def audit_leg_costs_menu():
+    """Print the trip legs whose costs are unusual for their transport mode or provider."""
+    print("\n=== Leg Cost Audit ===")
+    flagged = 0
+    for leg, warnings in audit_leg_costs():
+        flagged += 1
+        print(f"Leg {leg['id']} (trip {leg['trip_id']}, {leg['start_location']} to {leg['destination']}):")
+        for warning in warnings:
+            print(f"  {warning}")
+    print(f"{flagged} leg(s) with unusual costs." if flagged else "No unusual costs found.")
+
+
+# Duplicate traveler detection
+DUPLICATE_NAME_PREFIX = 1  # Names must share this many leading characters to be compared
+DUPLICATE_NAME_SIMILARITY = 0.85  # Minimum name similarity for a possible duplicate
+
+
+def normalize_gov_id(gov_id_type, gov_id_number):
+    """
+    Build the matching key for a government ID.
+    The type ignores case and spacing; the number also ignores spaces and hyphens.
+    :return: A tuple of (type, number).
+    """
+    number = "".join(character for character in str(gov_id_number) if character not in " -").upper()
+    return normalize_category(gov_id_type), number
+
+
+def normalize_name(name):
+    """
+    Build the comparison form of a name: lower case letters and digits, single spaces between words.
+    :param name: The name as entered.
+    :return: The normalized name.
+    """
+    words = ("".join(character for character in word if character.isalnum()) for word in str(name).casefold().split())
+    return " ".join(word for word in words if word)
+
+
+# Travelers grouped by their normalized government ID
+travelers_by_gov_id = StoreLocal(lambda: CollectionIndex(
+    "travelers", lambda traveler: normalize_gov_id(traveler['gov_id_type'], traveler['gov_id_number'])))
+
+
+def find_traveler_by_gov_id(gov_id_type, gov_id_number, exclude=None):
+    """
+    Find an existing traveler with the same government ID.
+    :param exclude: ID of a traveler to ignore, such as the one being updated.
+    :return: The first matching traveler, or None.
+    """
+    for match in travelers_by_gov_id.lookup(normalize_gov_id(gov_id_type, gov_id_number)):
+        if match['id'] != exclude:
+            return match
+    return None
+
+
+def check_gov_id(traveler, traveler_id=None):
+    """
+    Check that no other traveler already has a traveler's government ID.
+    Used before every create and update of a traveler, from the console and the GUI.
+    :param traveler: The new or updated traveler.
+    :param traveler_id: ID of the traveler being updated, which may keep its own government ID.
+    :return: An error message, or None if the government ID is not in use.
+    """
+    existing = find_traveler_by_gov_id(traveler['gov_id_type'], traveler['gov_id_number'], traveler_id)
+    if existing is None:
+        return None
+    return f"A traveler with this government ID already exists: {existing['name']} (ID: {existing['id']})"
+
+
+def find_duplicate_travelers(threshold=DUPLICATE_NAME_SIMILARITY):
+    """
+    Find travelers that are probably the same person.
+    Travelers sharing a government ID are always reported. Names are only compared within blocks of
+    travelers with the same date of birth and name prefix, so the audit avoids comparing every pair.
+    :param threshold: Minimum name similarity (0 to 1) for a fuzzy match.
+    :return: A list of (traveler, duplicate, reason) tuples; the traveler created first is kept.
+    """
+    with store_lock:
+        records = list(travelers)
+        gov_id_groups = travelers_by_gov_id.all_groups()
+    order = {traveler['id']: i for i, traveler in enumerate(records)}
+    matches = {}
+
+    # Exact matches on government ID
+    for _, group in gov_id_groups:
+        for duplicate in group[1:]:
+            matches[(group[0]['id'], duplicate['id'])] = (group[0], duplicate, "same government ID")
+
+    # Fuzzy matches on name, within blocks of the same date of birth and name prefix
+    blocks = {}
+    for traveler in records:
+        name = normalize_name(traveler['name'])
+        blocks.setdefault((traveler['dob'], name[:DUPLICATE_NAME_PREFIX]), []).append((name, traveler))
+    for block in blocks.values():
+        for i, (name, traveler) in enumerate(block):
+            for other_name, other in block[i + 1:]:
+                pair = (traveler['id'], other['id'])
+                if pair in matches:
+                    continue
+                matcher = difflib.SequenceMatcher(None, name, other_name)
+                if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+                    continue  # Cheap upper bounds rule the pair out
+                similarity = matcher.ratio()
+                if similarity >= threshold:
+                    matches[pair] = (traveler, other, f"similar name ({similarity:.0%}), same date of birth")
+
+    return sorted(matches.values(), key=lambda match: (order.get(match[0]['id'], 0), order.get(match[1]['id'], 0)))
+
+
+def merge_travelers(keep, duplicate):
+    """
+    Merge a duplicate traveler into another: trips listing the duplicate list the kept traveler instead,
+    then the duplicate is deleted. Undone as a single action.
+    :param keep: The traveler to keep.
+    :param duplicate: The traveler to remove.
+    :return: The number of trips that were updated.
+    """
+    updated = 0
+    with store_lock, change_group():
+        for trip in list(trips):
+            if duplicate['id'] not in trip['travelers']:
+                continue
+            members = []
+            for traveler_id in trip['travelers']:
+                traveler_id = keep['id'] if traveler_id == duplicate['id'] else traveler_id
+                if traveler_id not in members:  # The kept traveler may already be on the trip
+                    members.append(traveler_id)
+            update_record("trips", trip, {"travelers": members})
+            updated += 1
+        remove_record("travelers", duplicate)
+    return updated
+
+# Archive of completed trips
+# Trips that have ended are moved out of the working lists, together with their legs, into gzip-compressed
+# JSON Lines files with one file per month in which the trips ended. Each line holds one trip (including its
+# traveler list) and its legs. Reports can stream the archive back in one trip at a time.
+ARCHIVE_DIR = os.environ.get("TMS_ARCHIVE_DIR", "archive")  # Archive directory used by `main`
+ARCHIVE_DATE_FIELDS = {  # Fields stored as ISO dates and times in archive files, with their parsers
+    "start_date": datetime.date.fromisoformat,
+    "departure": datetime.datetime.fromisoformat,
+    "arrival": datetime.datetime.fromisoformat,
+}
+ARCHIVE_COMPRESSION = 6  # gzip level; the default of 9 is several times slower for little gain
+
+
+def trip_end_date(trip):
+    """
+    Get the day after a trip's last day.
+    :return: A `datetime.date`, or None if the trip has no valid start date.
+    """
+    if not isinstance(trip['start_date'], datetime.date):
+        return None
+    return trip['start_date'] + datetime.timedelta(days=trip['duration'])
+
+
+def _archive_path(archive_dir, period):
+    """Get the archive file of a period ("YYYY-MM")."""
+    return os.path.join(archive_dir, f"trips-{period}.jsonl.gz")
+
+
+def _restore_dates(record):
+    """Turn ISO date strings read from the archive back into `datetime.date` and `datetime.datetime` objects."""
+    for field in ARCHIVE_DATE_FIELDS.keys() & record.keys():
+        if record[field]:
+            try:
+                record[field] = ARCHIVE_DATE_FIELDS[field](record[field])
+            except ValueError:
+                pass  # Not a date when it was archived either
+    return record
+
+
+def _write_archive(path, completed):
+    """
+    Add trips and their legs to an archive file.
+    The file is rewritten through a temporary file, dropping earlier copies of the same trips, so a run that is
+    interrupted before the trips are removed leaves no duplicates when they are archived again.
+    :param path: The archive file.
+    :param completed: The trips to add.
+    """
+    ids = {trip['id'] for trip in completed}
+    temp_path = path + ".tmp"
+    try:
+        with gzip.open(temp_path, "wt", compresslevel=ARCHIVE_COMPRESSION, encoding="utf-8") as f:
+            if os.path.exists(path):
+                with gzip.open(path, "rt", encoding="utf-8") as existing:
+                    for line in existing:
+                        if json.loads(line)["trip"]["id"] not in ids:
+                            f.write(line)
+            for trip in completed:
+                entry = {"trip": trip, "legs": list(legs_by_trip.lookup(trip['id']))}
+                f.write(json.dumps(entry, default=_json_value) + "\n")
+        os.replace(temp_path, path)  # Readers see either the old file or the new one, never a partial one
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def archive_completed_trips(today=None, archive_dir=ARCHIVE_DIR):
+    """
+    Move trips that ended before today, and their legs, to the archive.
+    Files are written before the records are removed, and archiving cannot be undone.
+    :param today: The current date (defaults to today).
+    :param archive_dir: Directory of the archive files.
+    :return: A dictionary mapping each period ("YYYY-MM") to the number of trips archived into it.
+    """
+    today = today or datetime.date.today()
+    with store_lock:
+        by_period = {}
+        for trip in trips:
+            end = trip_end_date(trip)
+            if end is not None and end <= today:
+                by_period.setdefault(end.strftime("%Y-%m"), []).append(trip)
+        if not by_period:
+            return {}
+
+        os.makedirs(archive_dir, exist_ok=True)
+        for period, completed in sorted(by_period.items()):
+            _write_archive(_archive_path(archive_dir, period), completed)
+
+        archived = [trip for completed in by_period.values() for trip in completed]
+        with without_undo():
+            remove_records("trip_legs", [leg['id'] for trip in archived for leg in legs_by_trip.lookup(trip['id'])])
+            remove_records("trips", [trip['id'] for trip in archived])
+    return {period: len(completed) for period, completed in sorted(by_period.items())}
+
+
+def archive_periods(archive_dir=ARCHIVE_DIR):
+    """
+    List the periods that have archive files.
+    :return: A sorted list of "YYYY-MM" strings.
+    """
+    if not os.path.isdir(archive_dir):
+        return []
+    return sorted(name[len("trips-"):-len(".jsonl.gz")] for name in os.listdir(archive_dir)
+                  if name.startswith("trips-") and name.endswith(".jsonl.gz"))
+
+
+def archive_token(archive_dir=ARCHIVE_DIR):
+    """Get a token that changes whenever an archive file is added or written to."""
+    token = []
+    for period in archive_periods(archive_dir):
+        stat = os.stat(_archive_path(archive_dir, period))
+        token.append((period, stat.st_size, stat.st_mtime_ns))
+    return tuple(token)
+
+
+def read_archive(archive_dir=ARCHIVE_DIR, periods=None):
+    """
+    Stream archived trips, one at a time, oldest period first.
+    :param archive_dir: Directory of the archive files.
+    :param periods: Periods to read (defaults to all).
+    :return: A generator of (trip, legs) tuples.
+    """
+    for period in periods if periods is not None else archive_periods(archive_dir):
+        with gzip.open(_archive_path(archive_dir, period), "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                yield _restore_dates(entry["trip"]), [_restore_dates(leg) for leg in entry["legs"]]
+
+
+def trips_with_legs(snap, include_archive=False):
+    """
+    Iterate over the trips of a snapshot with their legs, optionally followed by the archived trips.
+    :param snap: The `StoreSnapshot` to read.
+    :param include_archive: Whether to stream in archived trips as well.
+    :return: A generator of (trip, legs) tuples.
+    """
+    legs_by_trip_id = snap.legs_by_trip()
+    for trip in snap.trips:
+        yield trip, legs_by_trip_id.get(trip['id'], [])
+    if include_archive:
+        active = {trip['id'] for trip in snap.trips}  # A trip archived during an interrupted run is still active
+        for trip, legs in read_archive(ARCHIVE_DIR):
+            if trip['id'] not in active:
+                yield trip, legs
+
+
+def archive_trips_menu():
+    """Archive completed trips and report how many were moved"""
+    print("\n=== Archive Completed Trips ===")
+    archived = archive_completed_trips(archive_dir=ARCHIVE_DIR)
+    if not archived:
+        print("No completed trips to archive.")
+        return
+    for period, count in archived.items():
+        print(f"{period}: {count} trip(s) archived")
+    print(f"Archive folder: {ARCHIVE_DIR}")
+
+
+# Leg timeline
+# Legs have optional departure and arrival times. Each trip's legs are kept sorted by departure, updated on every
+# change like an index, so a trip's itinerary is read in order without scanning or sorting all legs, and the legs
+# around a given time are found by binary search. Legs without a departure time come last, in the order added.
+DATETIME_FORMAT = "%d/%m/%Y %H:%M"
+TIMELINE_MAX_GAP = datetime.timedelta(hours=12)  # Idle time between consecutive legs reported as a gap
+
+
+def is_scheduled(leg):
+    """Check whether a leg has a departure time."""
+    return isinstance(leg.get('departure'), datetime.datetime)
+
+
+def leg_end(leg):
+    """Get the time a scheduled leg ends: its arrival, or its departure if the arrival is not known."""
+    arrival = leg.get('arrival')
+    return arrival if isinstance(arrival, datetime.datetime) else leg['departure']
+
+
+def leg_time_key(leg, sequence=0):
+    """
+    Get the position of a leg within its trip's timeline.
+    :param leg: The trip leg.
+    :param sequence: Order in which the leg was added, for legs without a departure time.
+    :return: A sort key, unique per leg.
+    """
+    if is_scheduled(leg):
+        return 0, leg['departure'], leg['id']
+    return 1, sequence, leg['id']
+
+
+def chronological(legs):
+    """Sort legs by departure; legs without a departure time keep their order at the end."""
+    return sorted(legs, key=lambda leg: (0, leg['departure']) if is_scheduled(leg) else (1,))
+
+
+class LegTimeline:
+    """
+    The legs of each trip in chronological order.
+    Maintained like an index: `record_change` passes every trip leg change to `apply`.
+    """
+
+    def __init__(self):
+        self.keys = {}  # Maps trip IDs to the sorted `leg_time_key`s of their legs
+        self.legs = {}  # Maps trip IDs to their legs, in the same order as `keys`
+        self.key_of = {}  # Maps leg IDs to (trip ID, key), to find a leg when it changes
+        self.sequence = 0  # Number of legs added, for ordering legs without a departure time
+        self.signature = None  # `list_signature` of `trip_legs` (None until first built)
+        indexes_by_collection["trip_legs"].append(self)
+
+    def refresh(self):
+        """Build the timeline if it was never built or `trip_legs` was edited directly."""
+        if self.signature != list_signature(trip_legs):
+            self.keys, self.legs, self.key_of = {}, {}, {}
+            for leg in trip_legs:
+                self._add(leg)
+            self.signature = list_signature(trip_legs)
+
+    def check(self):
+        """Mark the timeline for a rebuild if `trip_legs` was edited directly."""
+        if self.signature != list_signature(trip_legs):
+            self.signature = None
+
+    def apply(self, action, record, previous=None):
+        """Update the timeline after a trip leg was created, updated or deleted."""
+        if self.signature is None:
+            return  # Not built yet; it will be built on first lookup
+        if action == "create":
+            self._add(record)
+        elif action == "delete":
+            self._remove(record)
+        else:  # An unscheduled leg keeps its place among the unscheduled legs
+            old = self.key_of.get(record['id'])
+            self._remove(previous if previous is not None else record)
+            self._add(record, old[1][1] if old and old[1][0] == 1 else None)
+        self.signature = list_signature(trip_legs)
+
+    def _add(self, leg, sequence=None):
+        if sequence is None:
+            self.sequence += 1
+            sequence = self.sequence
+        key = leg_time_key(leg, sequence)
+        keys = self.keys.setdefault(leg['trip_id'], [])
+        position = bisect.bisect_right(keys, key)
+        keys.insert(position, key)
+        self.legs.setdefault(leg['trip_id'], []).insert(position, leg)
+        self.key_of[leg['id']] = (leg['trip_id'], key)
+
+    def _remove(self, leg):
+        entry = self.key_of.pop(leg['id'], None)
+        if entry is None:
+            return
+        trip_id, key = entry
+        keys = self.keys[trip_id]
+        position = bisect.bisect_left(keys, key)
+        del keys[position]
+        del self.legs[trip_id][position]
+        if not keys:
+            del self.keys[trip_id]
+            del self.legs[trip_id]
+
+    def lookup(self, trip_id):
+        """
+        Get the legs of a trip in chronological order.
+        :return: The timeline's own list; copy it before releasing `store_lock`.
+        """
+        self.refresh()
+        return self.legs.get(trip_id, [])
+
+    def neighbours(self, leg):
+        """
+        Find the scheduled legs of the same trip just before and just after a leg's departure.
+        The leg itself (if it is already stored) is skipped.
+        :return: A tuple of (previous leg or None, next leg or None).
+        """
+        self.refresh()
+        keys, legs = self.keys.get(leg['trip_id'], []), self.legs.get(leg['trip_id'], [])
+        position = bisect.bisect_left(keys, leg_time_key(leg))
+        before, after = position - 1, position
+        while before >= 0 and legs[before]['id'] == leg['id']:
+            before -= 1
+        while after < len(legs) and legs[after]['id'] == leg['id']:
+            after += 1
+        return (legs[before] if before >= 0 else None,
+                legs[after] if after < len(legs) and keys[after][0] == 0 else None)
+
+
+# Chronological legs of every trip
+leg_timeline = StoreLocal(LegTimeline)
+
+
+def timeline_issues(legs, max_gap=TIMELINE_MAX_GAP):
+    """
+    Find overlaps and long gaps between consecutive scheduled legs.
+    :param legs: The legs of one trip in chronological order.
+    :param max_gap: Idle time above which a gap is reported.
+    :return: A list of (kind, earlier leg, later leg, time) tuples; kind is "overlap" or "gap"
+             and time is the overlapping or idle time.
+    """
+    issues = []
+    for earlier, later in zip(legs, legs[1:]):
+        if not is_scheduled(later):
+            break  # Unscheduled legs come last
+        idle = later['departure'] - leg_end(earlier)
+        if idle < datetime.timedelta(0):
+            issues.append(("overlap", earlier, later, -idle))
+        elif idle > max_gap:
+            issues.append(("gap", earlier, later, idle))
+    return issues
+
+
+def describe_timeline_issue(issue):
+    """Describe an issue found by `timeline_issues` in one line."""
+    kind, earlier, later, time = issue
+    route = f"{earlier['start_location']} to {earlier['destination']}"
+    following = f"{later['start_location']} to {later['destination']}"
+    if kind == "overlap":
+        return f"{route} overlaps {following} by {time}"
+    return f"{time} gap between {route} and {following}"
+
+
+def check_leg_schedule(leg):
+    """
+    Check a new or updated leg's times against its neighbours in the trip's timeline.
+    :param leg: The trip leg being entered.
+    :return: A list of warnings (empty if the times fit).
+    """
+    if not is_scheduled(leg):
+        return []
+    with store_lock:
+        before, after = leg_timeline.neighbours(leg)
+    timeline = [other for other in (before, leg, after) if other is not None]
+    return [describe_timeline_issue(issue) for issue in timeline_issues(timeline) if issue[0] == "overlap"]
+
+
+def get_leg_times(departure=None, arrival=None):
+    """
+    Ask for a leg's departure and arrival times.
+    Empty input keeps the current value and "-" removes it; the arrival cannot be before the departure.
+    :param departure: Current departure time (optional).
+    :param arrival: Current arrival time (optional).
+    :return: A tuple of (departure, arrival); either may be None.
+    """
+    departure = get_datetime_input("Departure", departure)
+    while True:
+        arrival = get_datetime_input("Arrival", arrival)
+        if arrival is None or departure is None or arrival >= departure:
+            return departure, arrival
+        print("The arrival cannot be before the departure.")
+        arrival = None
+
+
+def get_datetime_input(label, current=None):
+    """
+    Ask for an optional date and time.
+    :param label: Name of the value.
+    :param current: Value kept when the input is empty.
+    :return: A `datetime.datetime`, or None.
+    """
+    shown = current.strftime(DATETIME_FORMAT) if current else "none"
+    while True:
+        text = get_input(f"{label} [{shown}] (DD/MM/YYYY HH:MM, - for none): ", True).strip()
+        if not text:
+            return current
+        if text == "-":
+            return None
+        try:
+            return datetime.datetime.strptime(text, DATETIME_FORMAT)
+        except ValueError:
+            print("Invalid date and time. Please use DD/MM/YYYY HH:MM.")
+
+
+# Currencies and exchange rates
+# Each trip leg has a currency; legs without one are in `DEFAULT_CURRENCY`. Exchange rates are read from a local
+# CSV file with one "currency,rate" row per currency, the rate being the value of one unit in a common base
+# currency. Reports convert costs to `REPORTING_CURRENCY` by summing costs per currency first and converting
+# each sum once, so the work per leg is an addition rather than a rate lookup. The file is re-read when it
+# changes, and conversion results are cached per version of the rate table.
+DEFAULT_CURRENCY = "USD"
+REPORTING_CURRENCY = os.environ.get("TMS_REPORTING_CURRENCY", DEFAULT_CURRENCY)
+# Rate table used by `main`, found next to this file so it does not depend on the working directory
+RATES_PATH = os.environ.get("TMS_RATES") or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "exchange_rates.csv")
+CURRENCY_SYMBOLS = {"USD": "$", "EUR": "\u20ac", "GBP": "\u00a3", "JPY": "\u00a5"}
+CONVERSION_CHUNK = 1000  # Archived trips converted together while streaming
+
+
+def normalize_currency(value):
+    """Turn a currency as entered into its code, e.g. " eur " into "EUR". Empty means the default currency."""
+    return str(value or "").strip().upper() or DEFAULT_CURRENCY
+
+
+def format_money(amount, currency=DEFAULT_CURRENCY, places=None):
+    """
+    Format an amount of money, e.g. "$500", "€12.50" or "CHF 80".
+    :param places: Number of decimals (default: none for whole amounts, otherwise 2).
+    """
+    if places is None:
+        places = 0 if float(amount).is_integer() else 2
+    text = f"{amount:.{places}f}"
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    return f"{symbol}{text}" if symbol else f"{currency} {text}"
+
+
+def read_rates(path):
+    """
+    Read a rate table file.
+    :param path: CSV file with "currency,rate" rows (blank lines, a header and "#" comments are skipped).
+    :return: A dictionary mapping currency codes to rates.
+    """
+    rates = {}
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#") or line.lower().startswith("currency,"):
+                continue
+            try:
+                currency, rate = line.split(",")
+                rate = float(rate)
+            except ValueError:
+                rate = 0
+            if not rate > 0:
+                raise ValueError(f"{path}, line {number}: expected 'currency,rate' with a positive rate")
+            rates[normalize_currency(currency)] = rate
+    return rates
+
+
+class RateTable:
+    """Exchange rates read from the rate file. `version` changes whenever the rates change."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rates = {DEFAULT_CURRENCY: 1.0}  # Used while there is no rate file
+        self.version = 0
+        self.stamp = None  # (modification time, size) of the file when it was read, or () if it was missing
+
+    def refresh(self):
+        """Re-read the rates if the file changed since it was read."""
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = ()
+        if stamp == self.stamp:
+            return
+        self.stamp = stamp
+        if not stamp:
+            print(f"Warning: exchange rate file '{self.path}' not found; "
+                  f"only {DEFAULT_CURRENCY} costs can be converted.")
+        try:
+            rates = read_rates(self.path) if stamp else {DEFAULT_CURRENCY: 1.0}
+        except (OSError, ValueError) as e:
+            print(f"Warning: {e}. Keeping the previous exchange rates.")
+            return
+        if rates != self.rates:
+            self.rates = rates
+            self.version += 1
+
+    def factor(self, currency, target=None):
+        """
+        Get the factor converting amounts in one currency to another.
+        :param currency: Currency of the amounts.
+        :param target: Currency to convert to (default: `REPORTING_CURRENCY`).
+        :return: The factor, or None if either rate is missing.
+        """
+        source = self.rates.get(normalize_currency(currency))
+        target = self.rates.get(target or REPORTING_CURRENCY)
+        return source / target if source and target else None
+
+
+# Exchange rates used by `main`, and the integer codes of the currencies seen on legs
+rate_table = RateTable(RATES_PATH)
+currencies = StoreLocal(CategoryDictionary)
+_factor_cache = StoreLocal(dict)  # Maps (rate table version, reporting currency, number of currencies) to conversion factors
+_trip_total_cache = StoreLocal(dict)  # Maps (trip legs token, rate table version, reporting currency) to trip totals
+
+
+def conversion_factors():
+    """
+    Get the factors converting each currency code of `currencies` into the reporting currency.
+    :return: A NumPy array indexed by currency code (NaN where a rate is missing).
+    """
+    rate_table.refresh()
+    key = (rate_table.version, REPORTING_CURRENCY, len(currencies))
+    factors = _factor_cache.get(key)
+    if factors is None:
+        factors = np.array([rate_table.factor(code) or np.nan for code in currencies.values], dtype=np.float64)
+        _factor_cache.clear()  # Only the current rates are needed
+        _factor_cache[key] = factors
+    return factors
+
+
+def convert_group_totals(groups):
+    """
+    Total the costs of groups of legs (such as the legs of each trip) in the reporting currency.
+    Costs are summed per group and currency, then each currency column is converted with one multiplication.
+    :param groups: A list of lists of trip legs.
+    :return: A tuple of (NumPy array with one total per group, set of currencies without an exchange rate).
+                Costs in currencies without a rate are left out of the totals.
+    """
+    legs = list(itertools.chain.from_iterable(groups))
+    names = [leg.get('currency') or DEFAULT_CURRENCY for leg in legs]
+    lookup = {name: currencies.encode(name) for name in set(names)}  # One dictionary lookup per distinct spelling
+    codes = np.fromiter(map(lookup.__getitem__, names), dtype=np.int64, count=len(legs))
+    costs = np.fromiter(map(operator.itemgetter('cost'), legs), dtype=np.float64, count=len(legs))
+    owners = np.repeat(np.arange(len(groups)), np.fromiter(map(len, groups), dtype=np.int64, count=len(groups)))
+    factors = conversion_factors()  # After encoding, so every code has a factor
+    width = len(factors)
+    sums = np.bincount(owners * width + codes, weights=costs, minlength=len(groups) * width)
+    missing = np.isnan(factors) & (np.bincount(codes, minlength=width) > 0)
+    totals = sums.reshape(len(groups), width) @ np.nan_to_num(factors)
+    return totals, {currencies.decode(code) for code in np.flatnonzero(missing)}
+
+
+def convert_leg_costs(legs):
+    """
+    Convert the cost of each leg to the reporting currency.
+    :param legs: A list of trip legs.
+    :return: A tuple of (NumPy array with one cost per leg, set of currencies without an exchange rate).
+             Costs in currencies without a rate are 0.
+    """
+    names = [leg.get('currency') or DEFAULT_CURRENCY for leg in legs]
+    lookup = {name: currencies.encode(name) for name in set(names)}
+    codes = np.fromiter(map(lookup.__getitem__, names), dtype=np.int64, count=len(legs))
+    costs = np.fromiter(map(operator.itemgetter('cost'), legs), dtype=np.float64, count=len(legs))
+    factors = conversion_factors()
+    missing = np.isnan(factors) & (np.bincount(codes, minlength=len(factors)) > 0)
+    return costs * np.nan_to_num(factors)[codes], {currencies.decode(code) for code in np.flatnonzero(missing)}
+
+
+def trip_cost_totals(snap):
+    """
+    Get the cost of every trip of a snapshot in the reporting currency, cached per rate table version.
+    :param snap: The `StoreSnapshot` to read.
+    :return: A tuple of (dictionary mapping trip IDs to totals, set of currencies without an exchange rate).
+    """
+    rate_table.refresh()
+    key = (snap.token("trip_legs"), rate_table.version, REPORTING_CURRENCY)
+    result = _trip_total_cache.get(key)
+    if result is None:
+        grouped = snap.legs_by_trip()
+        totals, missing = convert_group_totals(list(grouped.values()))
+        result = (dict(zip(grouped, totals.tolist())), missing)
+        _trip_total_cache.clear()  # Only the latest version is kept
+        _trip_total_cache[key] = result
+    return result
+
+
+def trips_with_costs(snap, include_archive=False, missing=None):
+    """
+    Iterate over trips with their legs and their cost in the reporting currency.
+    Archived trips are converted in chunks as they stream in.
+    :param snap: The `StoreSnapshot` to read.
+    :param include_archive: Whether to include archived trips.
+    :param missing: A set to which currencies without an exchange rate are added (optional).
+    :return: A generator of (trip, legs, total cost) tuples.
+    """
+    missing = missing if missing is not None else set()
+    totals, active_missing = trip_cost_totals(snap)
+    missing.update(active_missing)
+    chunk = []
+    for position, (trip, legs) in enumerate(trips_with_legs(snap, include_archive)):
+        if position < len(snap.trips):
+            yield trip, legs, totals.get(trip['id'], 0.0)
+            continue
+        chunk.append((trip, legs))
+        if len(chunk) == CONVERSION_CHUNK:
+            yield from _convert_chunk(chunk, missing)
+            chunk = []
+    yield from _convert_chunk(chunk, missing)
+
+
+def _convert_chunk(chunk, missing):
+    """Convert the costs of a chunk of (trip, legs) pairs, yielding (trip, legs, total cost) tuples."""
+    if not chunk:
+        return
+    totals, chunk_missing = convert_group_totals([legs for _, legs in chunk])
+    missing.update(chunk_missing)
+    for (trip, legs), total in zip(chunk, totals.tolist()):
+        yield trip, legs, total
+
+
+def itinerary_total(legs):
+    """
+    Total the costs of one trip's legs in the reporting currency.
+    :param legs: The trip legs.
+    :return: A tuple of (total, whether any leg is in another currency, set of currencies without a rate).
+    """
+    sums = {}
+    for leg in legs:
+        currency = normalize_currency(leg.get('currency'))
+        sums[currency] = sums.get(currency, 0) + leg['cost']
+    rate_table.refresh()
+    total, missing = 0, set()
+    for currency, amount in sums.items():
+        factor = 1 if currency == REPORTING_CURRENCY else rate_table.factor(currency)
+        if factor is None:
+            missing.add(currency)
+        else:
+            total += amount * factor
+    return total, any(currency != REPORTING_CURRENCY for currency in sums), missing
+
+
+def get_currency_input(prompt, default=DEFAULT_CURRENCY):
+    """
+    Ask for a currency code, warning if the rate table has no rate for it.
+    :param prompt: The message to display to the user.
+    :param default: Currency used when the answer is empty.
+    :return: The currency code.
+    """
+    currency = normalize_currency(get_input(prompt, True) or default)
+    rate_table.refresh()
+    if currency not in rate_table.rates:
+        print(f"Warning: no exchange rate for {currency}; reports leave it out until one is added to "
+              f"'{rate_table.path}'.")
+    return currency
+
+
+def warn_missing_rates(missing):
+    """Print a warning listing currencies whose costs could not be converted."""
+    if missing:
+        print(f"\nWarning: no exchange rate for {', '.join(sorted(missing))}; those costs are not included until "
+              f"rates are added to '{rate_table.path}'.")
+
 
 # Helper functions
 def clear_screen():
@@ -81,6 +2338,38 @@ def get_int_input(prompt):
             print("Please enter a valid number.")
 
 
+def get_number_input(prompt, default=0.0):
+    """
+    Get an optional number from the user.
+    :param prompt: The message to display to the user.
+    :param default: Value used when the answer is empty.
+    :return: A float.
+    """
+    while True:
+        text = get_input(prompt, True).strip()
+        if not text:
+            return default
+        try:
+            return float(text)
+        except ValueError:
+            print("Please enter a valid number.")
+
+
+def get_optional_date_input(prompt):
+    """
+    Get an optional DD/MM/YYYY date from the user.
+    :return: A `datetime.date`, or None if the answer is empty.
+    """
+    while True:
+        text = get_input(prompt + " (DD/MM/YYYY, optional): ", True).strip()
+        if not text:
+            return None
+        try:
+            return datetime.datetime.strptime(text, "%d/%m/%Y").date()
+        except ValueError:
+            print("Invalid date format. Please use DD/MM/YYYY.")
+
+
 # Trip management functions
 def create_trip():
     """
@@ -94,13 +2383,13 @@ def create_trip():
         "name": get_input("Trip Name: "),  # Name of the trip
         "start_date": get_date_input("Start Date"),  # Start date of the trip
         "duration": get_int_input("Duration (days): "),  # Duration of the trip in days
-        "coordinator": get_input("Trip Coordinator: "),  # ID of the trip coordinator
+        "coordinator": link_coordinator(get_input("Trip Coordinator: ")),  # ID of the trip coordinator
         "contact": get_input("Contact Information: "),  # Contact details for the trip
         "travelers": [],  # List of traveler IDs associated with the trip
         "legs": []  # List of trip leg IDs associated with the trip
     }
 
-    trips.append(trip)  # Add the trip to the `trips` list
+    insert_record("trips", trip)  # Add the trip to the `trips` list
     print(f"Trip '{trip['name']}' created successfully with ID: {trip['id']}")
 
 
@@ -132,32 +2421,36 @@ def update_trip():
     """
     trip_id = get_input("\nEnter Trip ID to update: ")  # Get the trip ID from the user
 
-    for trip in trips:  # Search for the trip with the given ID
+    for i, trip in enumerate(trips):  # Search for the trip with the given ID
         if trip['id'] == trip_id:
             print(f"Updating Trip: {trip['name']}")
 
-            # Update each field, allowing the user to leave it unchanged
-            trip['name'] = get_input(f"Trip Name [{trip['name']}]: ", True) or trip['name']
+            # Collect each field, allowing the user to leave it unchanged.
+            # Changes are applied together at the end, so nobody sees a half-updated trip.
+            changes = {}
+            changes['name'] = get_input(f"Trip Name [{trip['name']}]: ", True) or trip['name']
 
             date_str = get_input(f"Start Date [{trip['start_date'].strftime('%d/%m/%Y')}] (DD/MM/YYYY): ", True)
             if date_str:
                 try:
                     day, month, year = map(int, date_str.split('/'))
-                    trip['start_date'] = datetime.date(year, month, day)
+                    changes['start_date'] = datetime.date(year, month, day)
                 except:
                     print("Invalid date format. Start date not updated.")
 
             duration_str = get_input(f"Duration [{trip['duration']}] days: ", True)
             if duration_str:
                 try:
-                    trip['duration'] = int(duration_str)
+                    changes['duration'] = int(duration_str)
                 except:
                     print("Invalid number. Duration not updated.")
 
-            trip['coordinator'] = get_input(f"Trip Coordinator ID [{trip['coordinator']}]: ", True) or trip['coordinator']
-            trip['contact'] = get_input(f"Contact Information [{trip['contact']}]: ", True) or trip['contact']
+            coordinator = get_input(f"Trip Coordinator ID [{trip['coordinator']}]: ", True)
+            changes['coordinator'] = link_coordinator(coordinator) if coordinator else trip['coordinator']
+            changes['contact'] = get_input(f"Contact Information [{trip['contact']}]: ", True) or trip['contact']
+            update_record("trips", trip, changes, i)
 
-            print(f"Trip '{trip['name']}' updated successfully")
+            print(f"Trip '{changes['name']}' updated successfully")
             return
 
     print(f"Trip with ID {trip_id} not found.")  # If no trip matches the given ID
@@ -172,7 +2465,7 @@ def delete_trip():
     for i, trip in enumerate(trips):  # Search for the trip with the given ID
         if trip['id'] == trip_id:
             trip_name = trip['name']
-            del trips[i]  # Remove the trip from the list
+            remove_record("trips", trip, i)  # Remove the trip from the list
             print(f"Trip '{trip_name}' deleted successfully")
             return
 
@@ -194,7 +2487,12 @@ def create_traveler():
         "gov_id_number": get_input("Government ID Number: ")
     }
 
-    travelers.append(traveler)
+    error = check_gov_id(traveler)
+    if error:
+        print(error)
+        return
+
+    insert_record("travelers", traveler)
     print(f"Traveler '{traveler['name']}' created successfully with ID: {traveler['id']}")
 
 
@@ -219,34 +2517,60 @@ def update_traveler():
     """Update an existing traveler"""
     traveler_id = get_input("\nEnter Traveler ID to update: ")
 
-    for traveler in travelers:
+    for i, traveler in enumerate(travelers):
         if traveler['id'] == traveler_id:
             print(f"Updating Traveler: {traveler['name']}")
 
-            traveler['name'] = get_input(f"Full Name [{traveler['name']}]: ", True) or traveler['name']
-            traveler['address'] = get_input(f"Address [{traveler['address']}]: ", True) or traveler['address']
+            changes = {}  # Applied together once all fields are entered
+            changes['name'] = get_input(f"Full Name [{traveler['name']}]: ", True) or traveler['name']
+            changes['address'] = get_input(f"Address [{traveler['address']}]: ", True) or traveler['address']
 
             date_str = get_input(f"Date of Birth [{traveler['dob'].strftime('%d/%m/%Y')}] (DD/MM/YYYY): ", True)
             if date_str:
                 try:
                     day, month, year = map(int, date_str.split('/'))
-                    traveler['dob'] = datetime.date(year, month, day)
+                    changes['dob'] = datetime.date(year, month, day)
                 except:
                     print("Invalid date format. Date of birth not updated.")
 
-            traveler['emergency_contact'] = get_input(f"Emergency Contact [{traveler['emergency_contact']}]: ", True) or \
-                                            traveler['emergency_contact']
-            traveler['gov_id_type'] = get_input(f"Government ID Type [{traveler['gov_id_type']}]: ", True) or traveler[
+            changes['emergency_contact'] = get_input(f"Emergency Contact [{traveler['emergency_contact']}]: ", True) or \
+                                           traveler['emergency_contact']
+            changes['gov_id_type'] = get_input(f"Government ID Type [{traveler['gov_id_type']}]: ", True) or traveler[
                 'gov_id_type']
-            traveler['gov_id_number'] = get_input(f"Government ID Number [{traveler['gov_id_number']}]: ", True) or \
-                                        traveler['gov_id_number']
-
-            print(f"Traveler '{traveler['name']}' updated successfully")
+            changes['gov_id_number'] = get_input(f"Government ID Number [{traveler['gov_id_number']}]: ", True) or \
+                                       traveler['gov_id_number']
+            error = check_gov_id(changes, traveler['id'])
+            if error:
+                print(error)
+                return
+            update_record("travelers", traveler, changes, i)
+
+            print(f"Traveler '{changes['name']}' updated successfully")
             return
 
     print(f"Traveler with ID {traveler_id} not found.")
 
 
+def review_duplicate_travelers():
+    """Audit travelers for likely duplicates and offer to merge each pair"""
+    print("\n=== Duplicate Travelers ===")
+
+    matches = find_duplicate_travelers()
+    if not matches:
+        print("No duplicate travelers found.")
+        return
+
+    merged = set()  # IDs of travelers already merged away during this review
+    for traveler, duplicate, reason in matches:
+        if traveler['id'] in merged or duplicate['id'] in merged:
+            continue
+        print(f"\n{traveler['name']} (ID: {traveler['id']}) and {duplicate['name']} (ID: {duplicate['id']}): {reason}")
+        if get_input(f"Merge {duplicate['id']} into {traveler['id']}? (y/n): ").lower() == "y":
+            count = merge_travelers(traveler, duplicate)
+            merged.add(duplicate['id'])
+            print(f"Traveler '{duplicate['name']}' merged; {count} trip(s) updated")
+
+
 def delete_traveler():
     """Delete a traveler"""
     traveler_id = get_input("\nEnter Traveler ID to delete: ")
@@ -254,7 +2578,7 @@ def delete_traveler():
     for i, traveler in enumerate(travelers):
         if traveler['id'] == traveler_id:
             traveler_name = traveler['name']
-            del travelers[i]
+            remove_record("travelers", traveler, i)
             print(f"Traveler '{traveler_name}' deleted successfully")
             return
 
@@ -287,17 +2611,31 @@ def create_trip_leg():
         "transport_provider": get_input("Transport Provider: "),
         "transport_mode": get_input("Mode of Transport: "),
         "leg_type": get_input("Leg Type (accommodation/poi/transfer): "),
-        "cost": get_int_input("Cost: ")
+        "cost": get_int_input("Cost: "),
+        "currency": get_currency_input(f"Currency [{DEFAULT_CURRENCY}]: ")
     }
+    leg['departure'], leg['arrival'] = get_leg_times()
+    leg['cost'] = confirm_leg_cost(leg)  # Catch typos such as an extra zero
+    for warning in check_leg_schedule(leg):
+        print(f"Warning: {warning}")
+    add_trip_leg(leg)
+    print(f"Trip leg created successfully with ID: {leg['id']}")
 
-    trip_legs.append(leg)
 
-    # Add leg reference to trip
-    for trip in trips:
-        if trip['id'] == trip_id:
-            trip['legs'].append(leg['id'])
+def add_trip_leg(leg):
+    """
+    Add a trip leg and reference it from its trip.
+    :param leg: The new trip leg dictionary.
+    """
+    encode_leg_categories(leg)  # Share one value per category (e.g. "train" becomes "Train")
 
-    print(f"Trip leg created successfully with ID: {leg['id']}")
+    with change_group():  # Undo removes the leg and its reference together
+        insert_record("trip_legs", leg)
+
+        # Add leg reference to trip
+        for i, trip in enumerate(trips):
+            if trip['id'] == leg['trip_id']:
+                update_record("trips", trip, {"legs": trip['legs'] + [leg['id']]}, i)
 
 
 def view_trip_legs():
@@ -312,9 +2650,11 @@ def view_trip_legs():
         print(f"ID: {leg['id']}")
         print(f"Trip ID: {leg['trip_id']}")
         print(f"Route: {leg['start_location']} to {leg['destination']}")
+        if is_scheduled(leg):
+            print(f"Times: {format_leg_times(leg)}")
         print(f"Transport: {leg['transport_mode']} by {leg['transport_provider']}")
         print(f"Type: {leg['leg_type']}")
-        print(f"Cost: ${leg['cost']}")
+        print(f"Cost: {format_leg_cost(leg)}")
         print("-" * 30)
 
 
@@ -322,26 +2662,35 @@ def update_trip_leg():
     """Update an existing trip leg"""
     leg_id = get_input("\nEnter Trip Leg ID to update: ")
 
-    for leg in trip_legs:
+    for i, leg in enumerate(trip_legs):
         if leg['id'] == leg_id:
             print(f"Updating Trip Leg: {leg['start_location']} to {leg['destination']}")
 
-            leg['start_location'] = get_input(f"Starting Location [{leg['start_location']}]: ", True) or leg[
+            changes = {}  # Applied together once all fields are entered
+            changes['start_location'] = get_input(f"Starting Location [{leg['start_location']}]: ", True) or leg[
                 'start_location']
-            leg['destination'] = get_input(f"Destination [{leg['destination']}]: ", True) or leg['destination']
-            leg['transport_provider'] = get_input(f"Transport Provider [{leg['transport_provider']}]: ", True) or leg[
+            changes['destination'] = get_input(f"Destination [{leg['destination']}]: ", True) or leg['destination']
+            changes['transport_provider'] = get_input(f"Transport Provider [{leg['transport_provider']}]: ", True) or leg[
                 'transport_provider']
-            leg['transport_mode'] = get_input(f"Mode of Transport [{leg['transport_mode']}]: ", True) or leg[
+            changes['transport_mode'] = get_input(f"Mode of Transport [{leg['transport_mode']}]: ", True) or leg[
                 'transport_mode']
-            leg['leg_type'] = get_input(f"Leg Type [{leg['leg_type']}]: ", True) or leg['leg_type']
+            changes['leg_type'] = get_input(f"Leg Type [{leg['leg_type']}]: ", True) or leg['leg_type']
 
-            cost_str = get_input(f"Cost [${leg['cost']}]: ", True)
+            cost_str = get_input(f"Cost [{format_leg_cost(leg)}]: ", True)
             if cost_str:
                 try:
-                    leg['cost'] = int(cost_str)
+                    changes['cost'] = int(cost_str)
                 except:
                     print("Invalid number. Cost not updated.")
-
+            current = normalize_currency(leg.get('currency'))
+            changes['currency'] = get_currency_input(f"Currency [{current}]: ", current)
+            changes['departure'], changes['arrival'] = get_leg_times(leg.get('departure'), leg.get('arrival'))
+
+            changes['cost'] = confirm_leg_cost({**leg, **changes}, leg)
+            for warning in check_leg_schedule({**leg, **changes}):
+                print(f"Warning: {warning}")
+            encode_leg_categories(changes)  # Share one value per category
+            update_record("trip_legs", leg, changes, i)
             print("Trip leg updated successfully")
             return
 
@@ -354,17 +2703,28 @@ def delete_trip_leg():
 
     for i, leg in enumerate(trip_legs):
         if leg['id'] == leg_id:
-            # Remove leg reference from trip
-            for trip in trips:
-                if trip['id'] == leg['trip_id'] and leg['id'] in trip['legs']:
-                    trip['legs'].remove(leg['id'])
-
-            del trip_legs[i]
+            remove_trip_leg(leg, i)
             print(f"Trip leg deleted successfully")
             return
 
     print(f"Trip leg with ID {leg_id} not found.")
 
+
+def remove_trip_leg(leg, position=None):
+    """
+    Remove a trip leg and its reference from its trip.
+    :param leg: The trip leg dictionary.
+    :param position: Where the leg is expected to be in `trip_legs` (optional).
+    """
+    with change_group():  # Undo restores the leg and its reference together
+        # Remove leg reference from trip
+        for j, trip in enumerate(trips):
+            if trip['id'] == leg['trip_id'] and leg['id'] in trip['legs']:
+                remaining = [other_id for other_id in trip['legs'] if other_id != leg['id']]
+                update_record("trips", trip, {"legs": remaining}, j)
+
+        remove_record("trip_legs", leg, position)
+
 # User management functions
 
 def create_user():
@@ -377,14 +2737,19 @@ def create_user():
         if role not in ["coordinator", "manager", "administrator"]:
             print("Invalid role. Please enter coordinator, manager, or administrator.")
 
+    username = get_input("Username: ")
+    if users_by_username.lookup(username):
+        print(f"Username '{username}' is already taken.")
+        return
+
     user = {
         "id": str(uuid.uuid4())[:8],  # Generate a short unique ID
-        "username": get_input("Username: "),
-        "password": get_input("Password: "),
+        "username": username,
+        "password": hash_password(get_input("Password: ")),  # Only the salted hash is stored
         "role": role
     }
 
-    users.append(user)
+    insert_record("users", user)
     print(f"{role.capitalize()} '{user['username']}' created successfully with ID: {user['id']}")
 
 
@@ -415,12 +2780,290 @@ def delete_user():
     for i, user in enumerate(users):
         if user['id'] == user_id:
             username = user['username']
-            del users[i]
+            remove_record("users", user, i)
             print(f"User '{username}' deleted successfully")
             return
 
     print(f"User with ID {user_id} not found.")
 
+# Coordinator workload
+# Trips store their coordinator as entered, ideally the coordinator's user ID. Trips are indexed by that value,
+# so a coordinator's trips are found with a lookup instead of scanning every trip for every user.
+
+# Users by ID, and trips by their coordinator field
+users_by_id = StoreLocal(lambda: CollectionIndex("users", lambda user: user['id']))
+trips_by_coordinator = StoreLocal(lambda: CollectionIndex("trips", lambda trip: trip['coordinator']))
+
+
+def resolve_coordinator(value):
+    """
+    Find the user a trip's coordinator field refers to, by user ID or (for older trips) by username.
+    :return: The user, or None if no user matches.
+    """
+    matches = users_by_id.lookup(value) or users_by_username.lookup(value)
+    return matches[0] if matches else None
+
+
+def link_coordinator(value):
+    """
+    Turn a coordinator entered by ID or username into the user ID stored on the trip.
+    Values that match no user are kept as entered.
+    """
+    user = resolve_coordinator(value)
+    if user is None:
+        print(f"Note: no user matches coordinator '{value}'.")
+        return value
+    return user['id']
+
+
+def trips_for_coordinator(user):
+    """
+    Get the trips a coordinator owns, whether they refer to the user by ID or by username.
+    :param user: The coordinator's user record.
+    :return: A list of trips.
+    """
+    with store_lock:
+        found = trips_by_coordinator.lookup(user['id'])
+        if user['username'] != user['id']:
+            found = found + trips_by_coordinator.lookup(user['username'])
+        return list(found)
+
+
+def compute_coordinator_workload():
+    """
+    Total the trips, travelers, legs and cost of each coordinator from the trip and leg indexes.
+    Every coordinator user is included, plus coordinator values on trips that match no user.
+    :return: A tuple of (workload, set of currencies without an exchange rate). The workload maps user IDs
+             (or unmatched coordinator values) to dictionaries with the "coordinator" name and the "trips",
+             "travelers", "legs" and "cost" totals; costs are in the reporting currency.
+    """
+    def new_entry(name):
+        return {"coordinator": name, "trips": 0, "travelers": 0, "legs": 0, "cost": 0}
+
+    with store_lock:
+        workload = {user['id']: new_entry(user['username']) for user in users if user['role'] == 'coordinator'}
+        legs_by_entry = {key: [] for key in workload}  # Legs of each coordinator, converted together below
+        for value, group in trips_by_coordinator.all_groups():
+            user = resolve_coordinator(value)
+            key = user['id'] if user else value
+            if key not in workload:
+                workload[key] = new_entry(user['username'] if user else value)
+                legs_by_entry[key] = []
+            entry = workload[key]
+            for trip in group:
+                legs = legs_by_trip.lookup(trip['id'])
+                entry["trips"] += 1
+                entry["travelers"] += len(trip['travelers'])
+                entry["legs"] += len(legs)
+                legs_by_entry[key].extend(legs)
+    totals, missing = convert_group_totals(list(legs_by_entry.values()))
+    for entry, total in zip(workload.values(), totals.tolist()):
+        entry["cost"] = total
+    return workload, missing
+
+
+def view_coordinator_workload():
+    """Display each coordinator with the size of their workload"""
+    print("\n=== Trip Coordinators ===")
+    workload, missing = compute_coordinator_workload()
+    if not workload:
+        print("No trip coordinators found.")  # Handle no coordinators
+        return
+
+    for key, entry in sorted(workload.items(), key=lambda item: item[1]["trips"], reverse=True):
+        user = users_by_id.lookup(key)
+        if user:
+            print(f"ID: {key}")
+            print(f"Username: {entry['coordinator']}")
+        else:
+            print(f"Coordinator: {entry['coordinator']} (no matching user)")
+        print(f"Trips: {entry['trips']}, Travelers: {entry['travelers']}, Legs: {entry['legs']}, "
+              f"Total Cost: {format_money(entry['cost'], REPORTING_CURRENCY)}")
+        print("-" * 30)
+    warn_missing_rates(missing)
+
+
+# Emergency contact roster
+# In an incident, the emergency contacts of everyone on trips active on a date, or on trips with a leg starting or
+# ending at a location, are needed at once. Trips active on a date come from `TripCalendar`; trips at a location
+# come from the legs indexed by location code; travelers are then found by ID. Each traveler is listed once.
+ROSTER_FILE = "emergency_roster.csv"  # Suggested file name; the roster holds personal data, so the user picks the path
+
+
+class TripCalendar:
+    """
+    Trips grouped by duration, each group sorted by start date, so the trips active on a day are found with one
+    binary search per distinct duration. Maintained like an index: `record_change` passes every trip change to `apply`.
+    """
+
+    def __init__(self):
+        self.keys = {}  # Maps durations to sorted (start date ordinal, trip ID) keys
+        self.trips = {}  # Maps durations to trips, in the same order as `keys`
+        self.key_of = {}  # Maps trip IDs to (duration, key), to find a trip when it changes
+        self.signature = None  # `list_signature` of `trips` (None until first built)
+        indexes_by_collection["trips"].append(self)
+
+    def refresh(self):
+        """Build the calendar if it was never built or `trips` was edited directly."""
+        if self.signature != list_signature(trips):
+            self.keys, self.trips, self.key_of = {}, {}, {}
+            for trip in trips:
+                self._add(trip)
+            self.signature = list_signature(trips)
+
+    def check(self):
+        """Mark the calendar for a rebuild if `trips` was edited directly."""
+        if self.signature != list_signature(trips):
+            self.signature = None
+
+    def apply(self, action, record, previous=None):
+        """Update the calendar after a trip was created, updated or deleted."""
+        if self.signature is None:
+            return  # Not built yet; it will be built on first lookup
+        if action != "create":
+            self._remove(record)
+        if action != "delete":
+            self._add(record)
+        self.signature = list_signature(trips)
+
+    def _add(self, trip):
+        if not isinstance(trip.get('start_date'), datetime.date):
+            return  # Undated trips are never active
+        duration = max(trip['duration'], 1) if isinstance(trip.get('duration'), int) else 1  # At least one day
+        key = (trip['start_date'].toordinal(), trip['id'])
+        keys = self.keys.setdefault(duration, [])
+        position = bisect.bisect_right(keys, key)
+        keys.insert(position, key)
+        self.trips.setdefault(duration, []).insert(position, trip)
+        self.key_of[trip['id']] = (duration, key)
+
+    def _remove(self, trip):
+        entry = self.key_of.pop(trip['id'], None)
+        if entry is None:
+            return
+        duration, key = entry
+        keys = self.keys[duration]
+        position = bisect.bisect_left(keys, key)
+        del keys[position]
+        del self.trips[duration][position]
+        if not keys:
+            del self.keys[duration]
+            del self.trips[duration]
+
+    def active_on(self, day):
+        """
+        Get the trips under way on a day (from the start date up to the day before `trip_end_date`).
+        :param day: A `datetime.date`.
+        :return: A list of trips.
+        """
+        self.refresh()
+        ordinal = day.toordinal()
+        found = []
+        for duration, keys in self.keys.items():  # Active if it started within the last `duration` days
+            start = bisect.bisect_left(keys, (ordinal - duration + 1,))
+            end = bisect.bisect_left(keys, (ordinal + 1,))
+            found.extend(self.trips[duration][start:end])
+        return found
+
+
+# Trips and travelers by ID, trips by active day, and trip legs by the code of their start location and destination
+trips_by_id = StoreLocal(lambda: CollectionIndex("trips", lambda trip: trip['id']))
+travelers_by_id = StoreLocal(lambda: CollectionIndex("travelers", lambda traveler: traveler['id']))
+trip_calendar = StoreLocal(TripCalendar)
+legs_by_location = StoreLocal(lambda: {
+    field: CollectionIndex("trip_legs", lambda leg, field=field: leg_categories[field].encode(leg.get(field, "")))
+    for field in ("start_location", "destination")
+})
+
+
+def legs_at_location(location):
+    """
+    Get the trip legs starting or ending at a location (matched like other leg categories, ignoring case).
+    :return: A list of trip legs.
+    """
+    found = []
+    for field, index in legs_by_location.items():
+        index.refresh()  # Encodes every location seen on a leg
+        code = leg_categories[field].find(location)
+        if code is not None:
+            found.extend(index.lookup(code))
+    return found
+
+
+def touches_location(legs, location):
+    """Check whether any of the legs starts or ends at a location."""
+    codes = {field: leg_categories[field].find(location) for field in legs_by_location}
+    return any(leg_categories[field].encode(leg.get(field, "")) == code
+               for leg in legs for field, code in codes.items() if code is not None)
+
+
+def emergency_roster(day=None, location=None):
+    """
+    Find the travelers on trips active on a day, or on trips with a leg starting or ending at a location.
+    When both are given, only trips matching both are included.
+    :param day: A `datetime.date` (optional).
+    :param location: A location name (optional).
+    :return: A list of (traveler, list of trip IDs) tuples, one per traveler.
+    """
+    if day is None and location is None:
+        raise ValueError("A date or a location is required.")
+    with store_lock:
+        if day is None:
+            trip_ids = dict.fromkeys(leg['trip_id'] for leg in legs_at_location(location))
+        else:  # Few trips are active on one day, so their own legs are checked for the location
+            trip_ids = dict.fromkeys(trip['id'] for trip in trip_calendar.active_on(day)
+                                     if location is None or touches_location(legs_by_trip.lookup(trip['id']), location))
+
+        # Group the trips by traveler, then look each traveler up once
+        trips_by_id.refresh()
+        travelers_by_id.refresh()
+        trip_groups, traveler_groups = trips_by_id.groups, travelers_by_id.groups
+        roster = {}  # Maps traveler IDs to their trip IDs
+        for trip_id in trip_ids:
+            for trip in trip_groups.get(trip_id, ()):
+                for traveler_id in trip['travelers']:
+                    roster.setdefault(traveler_id, []).append(trip_id)
+        return [(traveler_groups[traveler_id][0], trip_list) for traveler_id, trip_list in roster.items()
+                if traveler_id in traveler_groups]  # Deleted travelers are left out
+
+
+def write_roster(path, roster):
+    """
+    Write an emergency contact roster to a CSV file, one row per traveler.
+    :param path: Destination file path.
+    :param roster: The list returned by `emergency_roster`.
+    :return: The number of travelers written.
+    """
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["traveler_id", "name", "emergency_contact", "trips"])
+        writer.writerows((traveler['id'], traveler['name'], traveler['emergency_contact'], ";".join(trip_ids))
+                         for traveler, trip_ids in roster)
+    return len(roster)
+
+
+def emergency_roster_menu():
+    """Prompt for a date and/or location, then write the emergency contacts of the travelers concerned."""
+    print("\n=== Emergency Contact Roster ===")
+    day = get_optional_date_input("Trips active on")
+    location = get_input("Legs starting or ending at (optional): ", True).strip() or None
+    if day is None and location is None:
+        print("Enter a date, a location or both.")
+        return
+    path = get_input(f"Output file [{ROSTER_FILE}]: ", True) or ROSTER_FILE
+    if os.path.exists(path) and get_input(f"'{path}' already exists. Overwrite it? (y/n): ").lower() != "y":
+        print("Roster not written.")
+        return
+    started = time.perf_counter()
+    roster = emergency_roster(day, location)
+    count = write_roster(path, roster)
+    print(f"{count} traveler(s) written to '{path}' in {(time.perf_counter() - started) * 1000:.1f} ms")
+    for traveler, trip_ids in roster[:10]:
+        print(f"{traveler['name']}: {traveler['emergency_contact']} (trip {', '.join(trip_ids)})")
+    if count > 10:
+        print(f"... and {count - 10} more in '{path}'")
+
+
 # Trip coordinator functions
 def manage_trip_travelers():
     """
@@ -468,14 +3111,17 @@ def manage_trip_travelers():
             if traveler_id in trip['travelers']:  # Check if the traveler is already on the trip
                 print("Traveler already on this trip.")
             else:
-                trip['travelers'].append(traveler_id)  # Add the traveler to the trip
+                # Add the traveler to the trip
+                trip = update_record("trips", trip, {"travelers": trip['travelers'] + [traveler_id]}) or trip
                 print("Traveler added to trip successfully.")
 
         elif choice == "2":  # Remove a traveler from the trip
             traveler_id = get_input("Enter Traveler ID to remove: ")  # Prompt for Traveler ID
 
             if traveler_id in trip['travelers']:  # Check if the traveler is on the trip
-                trip['travelers'].remove(traveler_id)  # Remove the traveler from the trip
+                # Remove the traveler from the trip
+                remaining = [other_id for other_id in trip['travelers'] if other_id != traveler_id]
+                trip = update_record("trips", trip, {"travelers": remaining}) or trip
                 print("Traveler removed from trip successfully.")
             else:
                 print("Traveler not found on this trip.")  # Display an error if the traveler is not on the trip
@@ -499,6 +3145,62 @@ def manage_trip_travelers():
         else:  # Handle invalid input
             print("Invalid choice. Please try again.")
 
+def format_itinerary(trip, legs):
+    """
+    Build the lines of a trip itinerary.
+    :param trip: The trip dictionary.
+    :param legs: The legs of the trip in chronological order (see `LegTimeline` and `chronological`).
+    :return: A list of lines (without newlines).
+    """
+    lines = [
+        f"=== Itinerary for {trip['name']} ===",
+        f"Start Date: {trip['start_date'].strftime('%d/%m/%Y')}",
+        f"Duration: {trip['duration']} days",
+        f"Contact: {trip['contact']}",
+    ]
+
+    if not legs:
+        lines += ["", "No trip legs defined for this trip."]
+    else:
+        lines += ["", "Trip Legs:"]
+        for leg in legs:
+            lines.append(f"- {leg['start_location']} to {leg['destination']} ({leg['transport_mode']})")
+            if is_scheduled(leg):
+                lines.append(f"  {format_leg_times(leg)}")
+            lines.append(f"  Type: {leg['leg_type']}, Cost: {format_leg_cost(leg)}")
+
+        issues = timeline_issues(legs)
+        if issues:
+            lines += ["", "Schedule Warnings:"] + [f"- {describe_timeline_issue(issue)}" for issue in issues]
+
+    lines += ["", f"Total Trip Cost: {format_itinerary_total(legs)}"]
+    return lines
+
+
+def format_leg_times(leg):
+    """Format the departure and arrival of a scheduled leg."""
+    text = f"Departs {leg['departure'].strftime(DATETIME_FORMAT)}"
+    if isinstance(leg.get('arrival'), datetime.datetime):
+        text += f", arrives {leg['arrival'].strftime(DATETIME_FORMAT)}"
+    return text
+
+
+def format_leg_cost(leg):
+    """Format a leg's cost in its own currency."""
+    return format_money(leg['cost'], normalize_currency(leg.get('currency')))
+
+
+def format_itinerary_total(legs):
+    """Format the total cost of a trip's legs in the reporting currency."""
+    total, converted, missing = itinerary_total(legs)
+    text = format_money(total, REPORTING_CURRENCY)
+    if converted:
+        text += f" (converted to {REPORTING_CURRENCY})"
+    if missing:
+        text += f", excluding costs in {', '.join(sorted(missing))} (no exchange rate)"
+    return text
+
+
 def generate_itinerary():
     """Generate an itinerary for a trip"""
     trip_id = get_input("\nEnter Trip ID: ")
@@ -514,77 +3216,388 @@ def generate_itinerary():
         print(f"Trip with ID {trip_id} not found.")
         return
 
-    print(f"\n=== Itinerary for {trip['name']} ===")
-    print(f"Start Date: {trip['start_date'].strftime('%d/%m/%Y')}")
-    print(f"Duration: {trip['duration']} days")
-    print(f"Contact: {trip['contact']}")
+    # Get the trip's legs in chronological order from the timeline and print the itinerary
+    with store_lock:
+        legs = list(leg_timeline.lookup(trip_id))
+    print()
+    print("\n".join(format_itinerary(trip, legs)))
+
+
+def format_itinerary_html(trip, legs):
+    """
+    Build an HTML page for a trip itinerary.
+    :param trip: The trip dictionary.
+    :param legs: The legs of the trip.
+    :return: The HTML document as a string.
+    """
+    title = html.escape(f"Itinerary for {trip['name']}")
+    rows = "".join(
+        f"<tr><td>{html.escape(str(leg['start_location']))}</td><td>{html.escape(str(leg['destination']))}</td>"
+        f"<td>{html.escape(format_leg_times(leg)) if is_scheduled(leg) else ''}</td>"
+        f"<td>{html.escape(str(leg['transport_mode']))}</td><td>{html.escape(str(leg['leg_type']))}</td>"
+        f"<td>{html.escape(format_leg_cost(leg))}</td></tr>\n"
+        for leg in legs
+    )
+    return (
+        f"<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>{title}</title></head>\n<body>\n"
+        f"<h1>{title}</h1>\n"
+        f"<p>Start Date: {trip['start_date'].strftime('%d/%m/%Y')}<br>\n"
+        f"Duration: {trip['duration']} days<br>\n"
+        f"Contact: {html.escape(str(trip['contact']))}</p>\n"
+        f"<table>\n<tr><th>From</th><th>To</th><th>When</th><th>Mode</th><th>Type</th><th>Cost</th></tr>\n"
+        f"{rows}</table>\n"
+        f"<p>Total Trip Cost: {html.escape(format_itinerary_total(legs))}</p>\n</body>\n</html>\n"
+    )
+
+
+ITINERARY_BUFFER_SIZE = 64 * 1024  # Write buffer for itinerary files
+
+
+def _write_itinerary_files(batch, output_dir):
+    """
+    Write the text and HTML itineraries for a batch of trips.
+    Runs in a worker process, so it only uses the data it is given.
+    :param batch: List of (trip, legs) pairs.
+    :param output_dir: Directory to write the files to.
+    :return: The number of trips written.
+    """
+    for trip, legs in batch:
+        base = os.path.join(output_dir, f"itinerary_{trip['id']}")
+        # Each file is built in memory and written in one call through a large buffer
+        with open(base + ".txt", "w", encoding="utf-8", buffering=ITINERARY_BUFFER_SIZE) as f:
+            f.write("\n".join(format_itinerary(trip, legs)) + "\n")
+        with open(base + ".html", "w", encoding="utf-8", buffering=ITINERARY_BUFFER_SIZE) as f:
+            f.write(format_itinerary_html(trip, legs))
+    return len(batch)
+
+
+def export_itineraries(output_dir, start=None, end=None, workers=None, batch_size=500):
+    """
+    Write a text and an HTML itinerary file for every trip, optionally limited to a date range.
+    Trips are split into batches that are written by a pool of worker processes.
+    :param output_dir: Directory to write the files to (created if needed).
+    :param start: Only include trips starting on or after this date (optional).
+    :param end: Only include trips starting on or before this date (optional).
+    :param workers: Number of worker processes (defaults to the number of CPUs).
+    :param batch_size: Number of trips sent to a worker at a time.
+    :return: The number of trips exported.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    selected = []
+    with read_snapshot() as snap:  # Export a consistent view while edits continue
+        legs_by_trip_id = snap.legs_by_trip()
+        for trip in snap.trips:
+            if start or end:
+                if not isinstance(trip['start_date'], datetime.date):
+                    continue
+                if (start and trip['start_date'] < start) or (end and trip['start_date'] > end):
+                    continue
+            selected.append((trip, chronological(legs_by_trip_id.get(trip['id'], []))))  # Lookup, not a scan
+
+    batches = [selected[i:i + batch_size] for i in range(0, len(selected), batch_size)]
+    workers = workers or os.cpu_count() or 1
+
+    # Small exports are faster without the cost of starting worker processes
+    if workers == 1 or len(batches) <= 1:
+        return sum(_write_itinerary_files(batch, output_dir) for batch in batches)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+        return sum(pool.map(_write_itinerary_files, batches, [output_dir] * len(batches)))
+
+
+def export_itineraries_menu():
+    """Prompt for an output directory and date range, then export itineraries for the matching trips."""
+    output_dir = get_input("Output directory [itineraries]: ", True) or "itineraries"
+
+    dates = []
+    for label in ("From date", "To date"):
+        while True:
+            date_str = get_input(f"{label} (DD/MM/YYYY, blank for no limit): ", True)
+            if not date_str:
+                dates.append(None)
+                break
+            try:
+                day, month, year = map(int, date_str.split('/'))
+                dates.append(datetime.date(year, month, day))
+                break
+            except:
+                print("Invalid date format. Please use DD/MM/YYYY.")
+
+    started = time.perf_counter()
+    count = export_itineraries(output_dir, dates[0], dates[1])
+    print(f"Exported {count} itineraries to '{output_dir}' in {time.perf_counter() - started:.2f} seconds")
+
+def export_columnar_menu():
+    """Prompt for an output directory, then export every collection as columnar files."""
+    import columnar  # Imported here so the application starts without it
+    output_dir = get_input("Output directory [analytics]: ", True) or "analytics"
+    started = time.perf_counter()
+    manifest = columnar.export_columnar(output_dir)
+    counts = ", ".join(f"{entry['rows']} {name}" for name, entry in manifest["collections"].items())
+    print(f"Exported {counts} to '{output_dir}' in {time.perf_counter() - started:.2f} seconds")
+
+
+# Report cache
+# Reports are cached together with the versions of the collections they read.
+# Opening a report again returns the cached text and chart until one of those collections changes.
+# Report text is captured per thread or task (see `capture_output`), so reports of different stores running at the
+# same time never see each other's output.
+_captured_output = contextvars.ContextVar("captured_output", default=None)
+_stdout_lock = threading.Lock()
+
+
+class _ContextOutput:
+    """Stand-in for `sys.stdout` that sends text to the capturing stream of the current thread or task, if any."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback  # Where text goes when nothing is being captured
+
+    def write(self, text):
+        return (_captured_output.get() or self.fallback).write(text)
+
+    def flush(self):
+        (_captured_output.get() or self.fallback).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+@contextlib.contextmanager
+def capture_output(stream):
+    """
+    Send what the current thread or task prints to a stream inside a `with` block.
+    Unlike `contextlib.redirect_stdout`, other threads keep printing where they did.
+    """
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ContextOutput):
+            sys.stdout = _ContextOutput(sys.stdout)
+    token = _captured_output.set(stream)
+    try:
+        yield stream
+    finally:
+        _captured_output.reset(token)
+
 
-    # Get trip legs for this trip
-    trip_legs_for_trip = [leg for leg in trip_legs if leg['trip_id'] == trip_id]
+report_cache = StoreLocal(dict)  # Maps (report name, arguments) to (collection tokens, printed text, chart)
+report_cache_stats = StoreLocal(lambda: {"hits": 0, "misses": 0})
 
-    if not trip_legs_for_trip:
-        print("\nNo trip legs defined for this trip.")
+
+def cached_report(*inputs):
+    """
+    Decorator that runs a report against a snapshot and caches its printed output and chart data.
+    The report function receives the `StoreSnapshot` as its first argument, prints its text
+    and returns its chart (or None). Callers do not pass the snapshot.
+    :param inputs: Names of the collections the report reads.
+    """
+    def decorator(report):
+        @functools.wraps(report)
+        def wrapper(*args, **kwargs):
+            with read_snapshot() as snap:
+                return _run_cached_report(report, inputs, snap, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def _run_cached_report(report, inputs, snap, args, kwargs):
+    """Return a report from the cache, or run it against the snapshot and cache the result."""
+    key = (report.__name__, args, tuple(sorted(kwargs.items())))
+    tokens = tuple(snap.token(name) for name in inputs)
+    if "trip_legs" in inputs:  # Costs are converted with the current exchange rates
+        rate_table.refresh()
+        tokens += (rate_table.version, REPORTING_CURRENCY)
+    if kwargs.get("include_archive"):
+        tokens += (archive_token(ARCHIVE_DIR),)
+
+    entry = report_cache.get(key)
+    if entry and entry[0] == tokens:
+        report_cache_stats["hits"] += 1
+        print(entry[1], end="")
+        chart = entry[2]
+        if chart and not os.path.exists(chart['file']):
+            draw_chart(chart)  # Chart file was removed; redraw it from the cached data
+        if chart and chart.get('csv') and not os.path.exists(chart['csv']):
+            write_chart_csv(chart)
+        return chart
+
+    report_cache_stats["misses"] += 1
+    output = io.StringIO()
+    with capture_output(output):
+        chart = report(snap, *args, **kwargs)
+    report_cache[key] = (tokens, output.getvalue(), chart)
+    print(output.getvalue(), end="")
+    return chart
+
+
+def clear_report_cache():
+    """Remove all cached reports and reset the hit and miss counters."""
+    report_cache.clear()
+    report_cache_stats["hits"] = 0
+    report_cache_stats["misses"] = 0
+
+
+def draw_chart(chart):
+    """
+    Draw a chart and save it to its file.
+    :param chart: Dictionary with the chart kind ("bar", "line" or "pie"), file, title, labels and values.
+    """
+    plt.figure(figsize=chart['figsize'])
+    if chart['kind'] == "pie":
+        plt.pie(chart['values'], labels=chart['labels'], autopct='%1.1f%%')
+    elif chart['kind'] == "line":
+        plt.plot(chart['labels'], chart['values'])
+        plt.xlabel(chart['xlabel'])
+        plt.ylabel(chart['ylabel'])
     else:
-        print("\nTrip Legs:")
-        for leg in trip_legs_for_trip:
-            print(f"- {leg['start_location']} to {leg['destination']} ({leg['transport_mode']})")
-            print(f"  Type: {leg['leg_type']}, Cost: ${leg['cost']}")
+        plt.bar(chart['labels'], chart['values'])
+        plt.xlabel(chart['xlabel'])
+        plt.ylabel(chart['ylabel'])
+        plt.xticks(rotation=45, ha='right')
+    plt.title(chart['title'])
+    plt.tight_layout()
+    plt.savefig(chart['file'])
+    plt.close()
+
+
+def write_chart_csv(chart):
+    """
+    Write the data of a chart to its CSV file, one row per label.
+    :param chart: Chart dictionary with a "csv" file name (see `draw_chart`).
+    """
+    with open(chart['csv'], "w", encoding="utf-8") as f:
+        f.write(f"{chart['xlabel'].lower()},{chart['ylabel'].lower()}\n")
+        f.writelines(f"{label},{value}\n" for label, value in zip(np.asarray(chart['labels']).astype(str).tolist(),
+                                                                  np.asarray(chart['values']).tolist()))
+
+
+def save_chart(chart):
+    """
+    Draw a chart, reporting success or failure to the user.
+    :param chart: Chart dictionary (see `draw_chart`).
+    """
+    try:
+        draw_chart(chart)
+        print(f"Chart saved as '{chart['file']}'")
+    except Exception as e:
+        print(f"Could not generate chart: {e}")
+        print("Make sure matplotlib is installed or use 'pip install matplotlib'")
+
+
+# Chart aggregation
+# Charts with one bar or slice per trip become unreadable and slow to draw with thousands of trips.
+# These helpers reduce the data before it reaches matplotlib, so drawing time does not depend on the number of trips.
+CHART_TOP_N = 10  # Trips shown individually in a top-N chart
+CHART_HISTOGRAM_BINS = 10  # Number of bars in a histogram chart
+CHART_MODES = ("auto", "top", "histogram", "all")  # "auto" shows every trip when there are few, otherwise the top N
+
+
+def top_n_series(labels, values, n=CHART_TOP_N):
+    """
+    Keep the largest values and add the rest together as "Other".
+    :param labels: Labels of the values.
+    :param values: Numeric values.
+    :param n: Number of values to keep.
+    :return: A tuple of (labels, values), largest first.
+    """
+    values = np.asarray(values)
+    if len(values) <= n:
+        return list(labels), values.tolist()
+    top = np.argpartition(-values, n - 1)[:n]  # The n largest, found without sorting everything
+    top = top[np.argsort(-values[top], kind="stable")]
+    labels = list(labels)
+    other = values.sum() - values[top].sum()
+    return [labels[i] for i in top] + [f"Other ({len(values) - n})"], values[top].tolist() + [other.item()]
+
+
+def histogram_series(values, bins=CHART_HISTOGRAM_BINS, unit=""):
+    """
+    Count how many values fall into each range.
+    Small whole-number ranges get one bar per value; anything else gets `bins` equal-width ranges.
+    :param values: Numeric values.
+    :param bins: Maximum number of ranges.
+    :param unit: Prefix for the range labels (e.g. "$").
+    :return: A tuple of (labels, counts).
+    """
+    values = np.asarray(values)
+    low, high = values.min(), values.max()
+    if np.issubdtype(values.dtype, np.integer) and high - low < bins:
+        counts = np.bincount(values - low, minlength=high - low + 1)
+        return [f"{unit}{value}" for value in range(low, high + 1)], counts.tolist()
+    counts, edges = np.histogram(values, bins=bins)
+    labels = [f"{unit}{start:,.0f}-{unit}{end:,.0f}" for start, end in zip(edges[:-1], edges[1:])]
+    return labels, counts.tolist()
+
+
+def aggregate_chart(chart, mode, measure, unit=""):
+    """
+    Reduce a per-trip chart according to a chart mode.
+    :param chart: Chart dictionary with one label and value per trip.
+    :param mode: One of `CHART_MODES`.
+    :param measure: Description of the values (e.g. "Cost ($)"), used as the histogram's x-axis label.
+    :param unit: Prefix for histogram range labels.
+    :return: The chart dictionary to draw.
+    """
+    if mode == "auto":
+        mode = "all" if len(chart['values']) <= CHART_TOP_N else "top"
+    if mode == "top":
+        labels, values = top_n_series(chart['labels'], chart['values'])
+        return {**chart, "title": f"{chart['title']} (Top {CHART_TOP_N})", "labels": labels, "values": values}
+    if mode == "histogram":
+        labels, counts = histogram_series(chart['values'], unit=unit)
+        return {**chart, "kind": "bar", "figsize": (10, 6), "title": f"{chart['title']} (Distribution)",
+                "xlabel": measure, "ylabel": "Trips", "labels": labels, "values": counts}
+    return chart
 
-    # Calculate total cost
-    total_cost = sum(leg['cost'] for leg in trip_legs_for_trip)
-    print(f"\nTotal Trip Cost: ${total_cost}")
 
 # Reporting and analytics functions
-def generate_financial_report():
+OCCUPANCY_CSV = "occupancy_timeline.csv"  # Output file of the occupancy timeline
+AGE_BANDS = (0, 18, 30, 45, 60, 75)  # Lower bound of each age band
+AGE_BAND_LABELS = ("0-17", "18-29", "30-44", "45-59", "60-74", "75+")
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()  # Day ordinal of the datetime64 epoch
+
+@cached_report("trips", "trip_legs")
+def generate_financial_report(snap, include_archive=False, chart_mode="auto"):
     """Generate a financial report showing costs by trip"""
     print("\n=== Financial Report ===")
 
-    if not trips:
-        print("No trips found.")
-        return
-
-    # Calculate costs for each trip
+    # Calculate costs for each trip, in the reporting currency
     trip_costs = {}
-    for trip in trips:
-        trip_id = trip['id']
-        trip_name = trip['name']
-
-        # Get legs for this trip
-        legs_for_trip = [leg for leg in trip_legs if leg['trip_id'] == trip_id]
-        total_cost = sum(leg['cost'] for leg in legs_for_trip)
+    missing = set()  # Currencies without an exchange rate
+    for trip, _, cost in trips_with_costs(snap, include_archive, missing):  # Consistent view, even while others edit
+        trip_costs[trip['name']] = cost
 
-        trip_costs[trip_name] = total_cost
+    if not trip_costs:
+        print("No trips found.")
+        return
 
     # Display financial report
-    print("\nTrip Costs:")
+    print(f"\nTrip Costs ({REPORTING_CURRENCY}):")
     for trip_name, cost in trip_costs.items():
-        print(f"{trip_name}: ${cost}")
+        print(f"{trip_name}: {format_money(cost, REPORTING_CURRENCY)}")
 
     # Calculate total revenue
     total_revenue = sum(trip_costs.values())
-    print(f"\nTotal Revenue: ${total_revenue}")
+    print(f"\nTotal Revenue: {format_money(total_revenue, REPORTING_CURRENCY)}")
+    warn_missing_rates(missing)
 
     # Create a simple bar chart
     if trip_costs:
-        try:
-            plt.figure(figsize=(10, 6))
-            plt.bar(trip_costs.keys(), trip_costs.values())
-            plt.title('Trip Costs')
-            plt.xlabel('Trip Name')
-            plt.ylabel('Cost ($)')
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            plt.savefig('trip_costs.png')
-            plt.close()
-            print("Chart saved as 'trip_costs.png'")
-        except Exception as e:
-            print(f"Could not generate chart: {e}")
-            print("Make sure matplotlib is installed or use 'pip install matplotlib'")
-
-
-def generate_traveler_report():
+        symbol = CURRENCY_SYMBOLS.get(REPORTING_CURRENCY, REPORTING_CURRENCY + " ")
+        chart = {
+            "kind": "bar", "file": "trip_costs.png", "figsize": (10, 6), "title": "Trip Costs",
+            "xlabel": "Trip Name", "ylabel": f"Cost ({REPORTING_CURRENCY})",
+            "labels": list(trip_costs.keys()), "values": list(trip_costs.values())
+        }
+        chart = aggregate_chart(chart, chart_mode, f"Cost ({REPORTING_CURRENCY})", unit=symbol)
+        save_chart(chart)
+        return chart
+
+
+@cached_report("trips", "travelers")
+def generate_traveler_report(snap, include_archive=False, chart_mode="auto"):
     """Generate a report showing traveler statistics"""
     print("\n=== Traveler Statistics ===")
+    travelers = snap.travelers  # Consistent view, even while others edit
 
     if not travelers:
         print("No travelers found.")
@@ -592,7 +3605,7 @@ def generate_traveler_report():
 
     # Count travelers by trip
     travelers_per_trip = {}
-    for trip in trips:
+    for trip, _ in trips_with_legs(snap, include_archive):
         travelers_per_trip[trip['name']] = len(trip['travelers'])
 
     # Display traveler statistics
@@ -605,37 +3618,155 @@ def generate_traveler_report():
 
     # Create a simple pie chart
     if travelers_per_trip:
-        try:
-            plt.figure(figsize=(8, 8))
-            plt.pie(travelers_per_trip.values(), labels=travelers_per_trip.keys(), autopct='%1.1f%%')
-            plt.title('Travelers by Trip')
-            plt.tight_layout()
-            plt.savefig('travelers_by_trip.png')
-            plt.close()
-            print("Chart saved as 'travelers_by_trip.png'")
-        except Exception as e:
-            print(f"Could not generate chart: {e}")
-            print("Make sure matplotlib is installed or use 'pip install matplotlib'")
-
-
-def generate_trip_performance_report():
+        chart = {
+            "kind": "pie", "file": "travelers_by_trip.png", "figsize": (8, 8), "title": "Travelers by Trip",
+            "labels": list(travelers_per_trip.keys()), "values": list(travelers_per_trip.values())
+        }
+        chart = aggregate_chart(chart, chart_mode, "Travelers per Trip")
+        save_chart(chart)
+        return chart
+
+
+def to_datetime64(values):
+    """
+    Convert dates to a NumPy `datetime64[D]` array in one pass.
+    Going through day ordinals is much faster than letting NumPy convert `datetime.date` objects.
+    :param values: Iterable of dates (anything that is not a `datetime.date` counts as missing).
+    :return: A tuple of (dates, valid), where `valid` is a boolean mask of the entries that were dates.
+    """
+    values = list(values)
+    try:
+        ordinals = np.fromiter(map(datetime.date.toordinal, values), dtype=np.int64, count=len(values))
+    except TypeError:  # Some values are missing or invalid
+        ordinals = np.fromiter((value.toordinal() if isinstance(value, datetime.date) else 0 for value in values),
+                               dtype=np.int64, count=len(values))
+    return (ordinals - _EPOCH_ORDINAL).astype('datetime64[D]'), ordinals > 0
+
+
+def ages_on(dobs, dates):
+    """
+    Calculate ages in whole years, element by element.
+    :param dobs: `datetime64[D]` array of dates of birth.
+    :param dates: `datetime64[D]` array (or single date) on which to measure the ages.
+    :return: An integer array of ages.
+    """
+    dob_months, date_months = dobs.astype('datetime64[M]'), np.asarray(dates).astype('datetime64[M]')
+    # Month and day as one sortable number, to check whether the birthday has been reached that year
+    dob_day = (dob_months.astype(np.int64) % 12) * 32 + (dobs - dob_months).astype(np.int64)
+    date_day = (date_months.astype(np.int64) % 12) * 32 + (dates - date_months).astype(np.int64)
+    years = dates.astype('datetime64[Y]').astype(np.int64) - dobs.astype('datetime64[Y]').astype(np.int64)
+    return years - (date_day < dob_day)
+
+
+def age_band_counts(ages, groups=None, num_groups=1):
+    """
+    Count ages per age band, optionally split into groups.
+    :param ages: Integer array of ages (negative ages are ignored).
+    :param groups: Optional integer array giving the group of each age.
+    :param num_groups: Number of groups.
+    :return: An array of shape (num_groups, number of bands).
+    """
+    num_bands = len(AGE_BANDS)
+    valid = ages >= 0
+    bands = np.searchsorted(AGE_BANDS, ages[valid], side='right') - 1
+    if groups is not None:
+        bands = groups[valid] * num_bands + bands
+    return np.bincount(bands, minlength=num_groups * num_bands).reshape(num_groups, num_bands)
+
+
+def compute_demographics(trips, travelers, today=None):
+    """
+    Build the age histograms of the demographics report.
+    Dates of birth and trip start dates are converted to `datetime64` arrays once and
+    every age is calculated with array arithmetic.
+    :param trips: The trips to include.
+    :param travelers: The travelers to include.
+    :param today: Date used for current ages (defaults to today).
+    :return: A dictionary with the current age band counts ("bands"), the age-at-departure band counts
+             ("departure_bands"), the per-trip departure counts ("trip_bands") and mean ages ("trip_mean_age").
+    """
+    dobs, has_dob = to_datetime64(map(operator.itemgetter('dob'), travelers))
+    today = np.datetime64(today or datetime.date.today(), 'D')
+    ages = np.where(has_dob, ages_on(dobs, today), -1)
+
+    # Flatten trip memberships into parallel (trip, traveler) position arrays
+    position = dict(zip(map(operator.itemgetter('id'), travelers), range(len(travelers))))
+    memberships = list(map(operator.itemgetter('travelers'), trips))
+    trip_of = np.repeat(np.arange(len(trips)), np.fromiter(map(len, memberships), dtype=np.int64, count=len(trips)))
+    traveler_of = np.fromiter(map(position.get, itertools.chain.from_iterable(memberships), itertools.repeat(-1)),
+                              dtype=np.int64, count=len(trip_of))
+    trip_of, traveler_of = trip_of[traveler_of >= 0], traveler_of[traveler_of >= 0]  # Skip unknown travelers
+
+    starts, has_start = to_datetime64(map(operator.itemgetter('start_date'), trips))
+    departure_ages = ages_on(dobs[traveler_of], starts[trip_of])
+    departure_ages[~(has_dob[traveler_of] & has_start[trip_of])] = -1
+
+    trip_bands = age_band_counts(departure_ages, trip_of, len(trips))
+    known = departure_ages >= 0
+    age_totals = np.bincount(trip_of[known], weights=departure_ages[known], minlength=len(trips))
+    counted = trip_bands.sum(axis=1)
+    return {
+        "bands": age_band_counts(ages)[0],
+        "departure_bands": trip_bands.sum(axis=0),
+        "trip_bands": trip_bands,
+        "trip_mean_age": np.divide(age_totals, counted, out=np.full(len(trips), np.nan), where=counted > 0),
+    }
+
+
+@cached_report("trips", "travelers")
+def generate_demographics_report(snap):
+    """Generate a report of traveler ages, overall and per trip"""
+    print("\n=== Traveler Demographics ===")
+    trips, travelers = snap.trips, snap.travelers
+
+    if not travelers:
+        print("No travelers found.")
+        return
+
+    demographics = compute_demographics(trips, travelers)
+    bands, departure_bands = demographics["bands"], demographics["departure_bands"]
+
+    print(f"\n{'Age Band':<10}{'Travelers':>10}{'At Departure':>14}")
+    for label, count, departing in zip(AGE_BAND_LABELS, bands.tolist(), departure_bands.tolist()):
+        print(f"{label:<10}{count:>10}{departing:>14}")
+    print(f"{'Total':<10}{int(bands.sum()):>10}{int(departure_bands.sum()):>14}")
+
+    print("\nAge at Departure per Trip:")
+    trip_bands, trip_mean_age = demographics["trip_bands"].tolist(), demographics["trip_mean_age"].tolist()
+    for trip, counts, mean_age in zip(trips, trip_bands, trip_mean_age):
+        if np.isnan(mean_age):
+            continue  # No travelers with known ages
+        breakdown = ", ".join(f"{label}: {count}" for label, count in zip(AGE_BAND_LABELS, counts) if count)
+        print(f"{trip['name']}: average age {mean_age:.1f} ({breakdown})")
+
+    chart = {
+        "kind": "bar", "file": "traveler_ages.png", "figsize": (10, 6), "title": "Age at Departure",
+        "xlabel": "Age Band", "ylabel": "Travelers", "labels": list(AGE_BAND_LABELS), "values": departure_bands.tolist()
+    }
+    save_chart(chart)
+    return chart
+
+
+@cached_report("trips", "trip_legs")
+def generate_trip_performance_report(snap, include_archive=False):
     """Generate a report showing trip performance metrics"""
     print("\n=== Trip Performance Report ===")
+    trips, trip_legs = snap.trips, snap.trip_legs
 
-    if not trips:
+    if not trips and not (include_archive and archive_periods(ARCHIVE_DIR)):
         print("No trips found.")
         return
 
     # Calculate metrics for each trip
-    for trip in trips:
-        trip_id = trip['id']
+    archived_modes = Counter()  # Transport modes of archived legs, counted as they stream past
+    missing = set()  # Currencies without an exchange rate
+    for position, (trip, legs_for_trip, total_cost) in enumerate(trips_with_costs(snap, include_archive, missing)):
         trip_name = trip['name']
+        if position >= len(trips):  # Archived trips come after the active ones
+            archived_modes.update(leg_categories['transport_mode'].canonical(leg['transport_mode'])
+                                  for leg in legs_for_trip)
 
-        # Get legs for this trip
-        legs_for_trip = [leg for leg in trip_legs if leg['trip_id'] == trip_id]
-
-        # Calculate metrics
-        total_cost = sum(leg['cost'] for leg in legs_for_trip)
+        # Calculate metrics (the total cost is in the reporting currency)
         num_travelers = len(trip['travelers'])
         num_legs = len(legs_for_trip)
 
@@ -643,35 +3774,290 @@ def generate_trip_performance_report():
         cost_per_traveler = total_cost / num_travelers if num_travelers > 0 else 0
 
         print(f"\nTrip: {trip_name}")
-        print(f"Total Cost: ${total_cost}")
+        print(f"Total Cost: {format_money(total_cost, REPORTING_CURRENCY)}")
         print(f"Number of Travelers: {num_travelers}")
         print(f"Number of Trip Legs: {num_legs}")
-        print(f"Cost per Traveler: ${cost_per_traveler:.2f}")
+        print(f"Cost per Traveler: {format_money(cost_per_traveler, REPORTING_CURRENCY, 2)}")
         print("-" * 30)
+    warn_missing_rates(missing)
 
     # Analyze transport modes
-    if trip_legs:
-        transport_modes = Counter([leg['transport_mode'] for leg in trip_legs])
+    if trip_legs or archived_modes:
+        transport_modes = count_by_category('transport_mode', trip_legs)  # Counts encoded modes
+        transport_modes.update(archived_modes)
 
         print("\nTransport Mode Usage:")
         for mode, count in transport_modes.items():
             print(f"{mode}: {count} times")
 
         # Create a simple bar chart for transport modes
-        try:
-            plt.figure(figsize=(8, 6))
-            plt.bar(transport_modes.keys(), transport_modes.values())
-            plt.title('Transport Mode Usage')
-            plt.xlabel('Transport Mode')
-            plt.ylabel('Count')
-            plt.xticks(rotation=45, ha='right')
-            plt.tight_layout()
-            plt.savefig('transport_modes.png')
-            plt.close()
-            print("Chart saved as 'transport_modes.png'")
-        except Exception as e:
-            print(f"Could not generate chart: {e}")
-            print("Make sure matplotlib is installed or use 'pip install matplotlib'")
+        chart = {
+            "kind": "bar", "file": "transport_modes.png", "figsize": (8, 6), "title": "Transport Mode Usage",
+            "xlabel": "Transport Mode", "ylabel": "Count",
+            "labels": list(transport_modes.keys()), "values": list(transport_modes.values())
+        }
+        save_chart(chart)
+        return chart
+
+
+def compute_occupancy(trips):
+    """
+    Count the travelers on the road on each day, using a difference array.
+    Each trip adds its travelers on its start date and removes them the day after it ends,
+    so one pass over the trips and one cumulative sum give every day's total.
+    :param trips: The trips to include (trips without a valid start date are skipped).
+    :return: A tuple of (dates, counts) as NumPy arrays, or (None, None) if there are no dated trips.
+    """
+    dated = [(trip['start_date'].toordinal(), trip['duration'], len(trip['travelers']))
+             for trip in trips if isinstance(trip['start_date'], datetime.date)]
+    if not dated:
+        return None, None
+
+    data = np.array(dated, dtype=np.int64)
+    starts, counts = data[:, 0], data[:, 2]
+    ends = starts + np.maximum(data[:, 1], 1)  # Day after the trip ends; every trip covers at least one day
+    first = starts.min()
+    num_days = ends.max() - first
+
+    # +travelers on the first day, -travelers on the day after the last day, then a running total
+    diff = np.bincount(starts - first, weights=counts, minlength=num_days + 1)
+    diff -= np.bincount(ends - first, weights=counts, minlength=num_days + 1)
+    occupancy = np.cumsum(diff[:num_days]).astype(np.int64)
+
+    first_date = np.datetime64(datetime.date.fromordinal(int(first)), 'D')
+    return first_date + np.arange(num_days), occupancy
+
+
+@cached_report("trips")
+def generate_occupancy_report(snap, include_archive=False):
+    """Generate a day-by-day timeline of how many travelers are on trips"""
+    print("\n=== Daily Occupancy Timeline ===")
+
+    dates, occupancy = compute_occupancy(trip for trip, _ in trips_with_legs(snap, include_archive))
+    if dates is None:
+        print("No trips found.")
+        return
+
+    peak = int(occupancy.argmax())
+    print(f"Period: {dates[0].item().strftime('%d/%m/%Y')} to {dates[-1].item().strftime('%d/%m/%Y')}")
+    print(f"Peak: {occupancy[peak]} travelers on {dates[peak].item().strftime('%d/%m/%Y')}")
+    print(f"Average: {occupancy.mean():.1f} travelers per day")
+    print(f"Days with no travelers: {int((occupancy == 0).sum())}")
+
+    chart = {
+        "kind": "line", "file": "occupancy_timeline.png", "csv": OCCUPANCY_CSV, "figsize": (12, 6),
+        "title": "Travelers on the Road", "xlabel": "Date", "ylabel": "Travelers", "labels": dates, "values": occupancy
+    }
+    write_chart_csv(chart)  # Full timeline, one row per day
+    print(f"Timeline saved as '{OCCUPANCY_CSV}'")
+    save_chart(chart)
+    return chart
+
+
+# Budget what-if scenarios
+# Answers questions such as "what if rail prices rise 8% and June trips gain 5 travelers?" without changing any
+# data. An adjustment selects legs by mode, provider or leg type and trips by start date, then scales the selected
+# costs, adds an amount per selected leg or adds travelers per selected trip. Each adjustment value may be an array
+# with one value per scenario. Legs are grouped into segments by the set of adjustments that select them, so a
+# scenario needs only one factor and one addition per segment and all scenarios are evaluated at once with
+# array operations, whatever the number of legs.
+WHAT_IF_FIELDS = {"transport_mode": "Mode of Transport", "transport_provider": "Transport Provider",
+                  "leg_type": "Leg Type"}
+WHAT_IF_SCENARIOS = 1000  # Scenarios simulated when a change is uncertain
+WHAT_IF_PERCENTILES = (5, 50, 95)
+_budget_model_cache = StoreLocal(dict)  # Maps the inputs of the latest `budget_model` to the model
+
+
+class BudgetModel:
+    """
+    The legs and travelers of a set of trips as arrays, for simulating budget scenarios.
+    Costs are converted to the reporting currency when the model is built.
+    """
+
+    def __init__(self, trips_and_legs):
+        """
+        :param trips_and_legs: An iterable of (trip, legs) pairs, such as `trips_with_legs`.
+        """
+        legs, owners, travelers, starts = [], [], [], []
+        for trip, trip_legs_for_trip in trips_and_legs:
+            owners.extend(itertools.repeat(len(travelers), len(trip_legs_for_trip)))
+            legs.extend(trip_legs_for_trip)
+            travelers.append(len(trip['travelers']))
+            start = trip.get('start_date')
+            starts.append(start.toordinal() if isinstance(start, datetime.date) else 0)
+        self.costs, self.missing = convert_leg_costs(legs)
+        self.owners = np.array(owners, dtype=np.int64)  # Trip position of each leg
+        self.travelers = np.array(travelers, dtype=np.int64)
+        self.starts = np.array(starts, dtype=np.int64)  # Start date ordinals (0 if unknown)
+        self.codes = {}  # Category codes of each leg, per field
+        for field in WHAT_IF_FIELDS:
+            dictionary = leg_categories[field]
+            values = [leg.get(field, "") for leg in legs]
+            lookup = {value: dictionary.encode(value) for value in set(values)}
+            self.codes[field] = np.fromiter(map(lookup.__getitem__, values), dtype=np.int64, count=len(legs))
+
+    def select(self, adjustment):
+        """
+        Find the legs and trips selected by an adjustment.
+        Trips are selected by start date; if the adjustment also filters legs, only trips with a selected leg count.
+        :param adjustment: Dictionary with optional field filters and "start"/"end" dates (inclusive).
+        :return: A tuple of (boolean array over legs, boolean array over trips).
+        """
+        trip_mask = np.ones(len(self.travelers), dtype=bool)
+        if adjustment.get('start') is not None:
+            trip_mask &= self.starts >= adjustment['start'].toordinal()
+        if adjustment.get('end') is not None:
+            trip_mask &= (self.starts <= adjustment['end'].toordinal()) & (self.starts > 0)
+        leg_mask = trip_mask[self.owners]
+        filters = [field for field in WHAT_IF_FIELDS if adjustment.get(field)]
+        for field in filters:
+            code = leg_categories[field].find(adjustment[field])
+            leg_mask &= self.codes[field] == (-1 if code is None else code)
+        if filters:
+            trip_mask = np.bincount(self.owners[leg_mask], minlength=len(self.travelers)) > 0
+        return leg_mask, trip_mask
+
+    def simulate(self, adjustments):
+        """
+        Evaluate budget scenarios.
+        Within a scenario, every selected leg cost is multiplied by the factors of its adjustments, then the
+        additions are added. Added travelers do not change costs, which are per leg.
+        :param adjustments: A list of adjustment dictionaries (see `select`) with optional "cost_factor",
+                            "cost_add" (reporting currency, per leg) and "travelers_add" (per trip) values.
+                            Each value is a number or an array with one value per scenario.
+        :return: A dictionary with arrays "total_cost", "travelers" and "cost_per_traveler" (one value per
+                 scenario), the baseline values, and the number of legs and trips each adjustment selects.
+        """
+        if len(adjustments) > 62:
+            raise ValueError("At most 62 adjustments can be simulated together.")
+        parameters = {name: [np.asarray(adjustment.get(name, default), dtype=np.float64)
+                             for adjustment in adjustments]
+                      for name, default in (("cost_factor", 1.0), ("cost_add", 0.0), ("travelers_add", 0.0))}
+        count = np.broadcast_shapes((1,), *(value.shape for values in parameters.values() for value in values))[0]
+        factors, additions, added_travelers = (
+            np.stack([np.broadcast_to(value, (count,)) for value in parameters[name]], axis=1)
+            if adjustments else np.zeros((count, 0))
+            for name in ("cost_factor", "cost_add", "travelers_add"))
+
+        # Group legs by the adjustments that select them
+        segments = np.zeros(len(self.costs), dtype=np.int64)
+        legs_selected, trips_selected = [], []
+        for bit, adjustment in enumerate(adjustments):
+            leg_mask, trip_mask = self.select(adjustment)
+            segments |= leg_mask.astype(np.int64) << bit
+            legs_selected.append(int(leg_mask.sum()))
+            trips_selected.append(int(trip_mask.sum()))
+        patterns, segments = np.unique(segments, return_inverse=True)
+        membership = (patterns[:, None] >> np.arange(len(adjustments))) & 1  # Segments x adjustments
+        segment_costs = np.bincount(segments, weights=self.costs, minlength=len(patterns))
+        segment_legs = np.bincount(segments, minlength=len(patterns))
+
+        scale = np.ones((count, len(patterns)))
+        for column in range(len(adjustments)):
+            scale *= np.where(membership[:, column] == 1, factors[:, column, None], 1.0)
+        total_cost = scale @ segment_costs + (additions @ membership.T) @ segment_legs
+        travelers = self.travelers.sum() + added_travelers @ np.array(trips_selected, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cost_per_traveler = np.where(travelers > 0, total_cost / travelers, np.nan)
+
+        baseline_cost = float(self.costs.sum())
+        baseline_travelers = int(self.travelers.sum())
+        return {
+            "total_cost": total_cost, "travelers": travelers, "cost_per_traveler": cost_per_traveler,
+            "baseline_cost": baseline_cost, "baseline_travelers": baseline_travelers,
+            "baseline_cost_per_traveler": baseline_cost / baseline_travelers if baseline_travelers else float("nan"),
+            "legs_selected": legs_selected, "trips_selected": trips_selected,
+        }
+
+
+def budget_model(snap, include_archive=False):
+    """
+    Get the `BudgetModel` of a snapshot, reusing the last one while the data and exchange rates are unchanged.
+    :param snap: The `StoreSnapshot` to read.
+    :param include_archive: Whether to include archived trips.
+    :return: A `BudgetModel`.
+    """
+    rate_table.refresh()
+    key = (snap.token("trips"), snap.token("trip_legs"), rate_table.version, REPORTING_CURRENCY,
+           archive_token(ARCHIVE_DIR) if include_archive else None)
+    model = _budget_model_cache.get(key)
+    if model is None:
+        model = BudgetModel(trips_with_legs(snap, include_archive))
+        _budget_model_cache.clear()  # Only the latest version is kept
+        _budget_model_cache[key] = model
+    return model
+
+
+def get_what_if_adjustment(rng, scenarios):
+    """
+    Ask for one adjustment of a what-if scenario.
+    A change with an uncertainty is drawn uniformly within that many percentage points, once per scenario.
+    :param rng: NumPy random generator for uncertain changes.
+    :param scenarios: Number of scenarios to draw.
+    :return: An adjustment dictionary for `BudgetModel.simulate`.
+    """
+    adjustment = {}
+    for field, label in WHAT_IF_FIELDS.items():
+        value = get_input(f"{label} (empty for any): ", True).strip()
+        if value:
+            adjustment[field] = value
+    adjustment['start'] = get_optional_date_input("Trips starting on or after")
+    adjustment['end'] = get_optional_date_input("Trips starting on or before")
+    change = get_number_input("Cost change in % [0]: ")
+    spread = abs(get_number_input("Uncertainty of the cost change in % points [0]: "))
+    adjustment['cost_factor'] = 1 + (rng.uniform(change - spread, change + spread, scenarios) if spread
+                                     else change) / 100
+    adjustment['cost_add'] = get_number_input(f"Added cost per leg in {REPORTING_CURRENCY} [0]: ")
+    adjustment['travelers_add'] = get_number_input("Added travelers per trip [0]: ")
+    return adjustment
+
+
+def print_distribution(label, values, baseline, places=None):
+    """Print the baseline and the percentiles of a simulated value."""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        print(f"{label}: no value (no travelers)")
+        return
+    print(f"{label}: baseline {format_money(baseline, REPORTING_CURRENCY, places)}")
+    for percentile, value in zip(WHAT_IF_PERCENTILES, np.percentile(values, WHAT_IF_PERCENTILES)):
+        change = f" ({(value - baseline) / baseline:+.1%})" if baseline else ""
+        print(f"  {percentile}th percentile: {format_money(value, REPORTING_CURRENCY, places)}{change}")
+
+
+def what_if_menu(include_archive=False):
+    """Ask for budget adjustments and show the distribution of the resulting costs."""
+    print("\n=== Budget What-If ===")
+    with read_snapshot() as snap:
+        model = budget_model(snap, include_archive)
+    if not len(model.travelers):
+        print("No trips found.")
+        return
+
+    rng = np.random.default_rng()
+    adjustments = []
+    while True:
+        print(f"\nAdjustment {len(adjustments) + 1}")
+        adjustments.append(get_what_if_adjustment(rng, WHAT_IF_SCENARIOS))
+        if get_input("Add another adjustment? (y/n): ", True).strip().lower() != "y":
+            break
+
+    start = time.perf_counter()
+    result = model.simulate(adjustments)
+    elapsed = time.perf_counter() - start
+    for number, (legs, trips_count) in enumerate(zip(result['legs_selected'], result['trips_selected']), 1):
+        print(f"Adjustment {number} selects {legs} leg(s) on {trips_count} trip(s)")
+    print(f"\n{len(result['total_cost'])} scenario(s) simulated in {elapsed * 1000:.1f} ms")
+    print_distribution("Total cost", result['total_cost'], result['baseline_cost'])
+    print_distribution("Cost per traveler", result['cost_per_traveler'], result['baseline_cost_per_traveler'], 2)
+    warn_missing_rates(model.missing)
+
+
+def show_report_cache_stats():
+    """Display how often reports were served from the cache."""
+    hits, misses = report_cache_stats["hits"], report_cache_stats["misses"]
+    total = hits + misses
+    hit_rate = hits / total * 100 if total else 0
+    print(f"Report cache: {hits} hits, {misses} misses ({hit_rate:.0f}% hit rate), {len(report_cache)} cached")
 
 # Menu functions
 def reporting_menu():
@@ -679,25 +4065,43 @@ def reporting_menu():
     Display the reporting and analytics menu.
     Allows the user to generate various reports or return to the main menu.
     """
+    include_archive = False  # Whether reports also stream in archived trips
+    chart_mode = CHART_MODES[0]  # How per-trip charts are aggregated
     while True:
         # Display menu options
         print("\n=== Reporting and Analytics ===")
+        show_report_cache_stats()  # Show how many reports were served from the cache
         print("1. Financial Report")  # Option to generate a financial report
         print("2. Traveler Statistics")  # Option to generate traveler statistics
         print("3. Trip Performance Report")  # Option to generate trip performance metrics
-        print("4. Back to Main Menu")  # Option to return to the main menu
+        print("4. Traveler Demographics")  # Option to generate the traveler age report
+        print("5. Daily Occupancy Timeline")  # Option to see how many travelers are away each day
+        print(f"6. Include Archived Trips [{'On' if include_archive else 'Off'}]")  # Option to toggle the archive
+        print(f"7. Chart Style [{chart_mode.title()}]")  # Option to switch between chart modes
+        print("8. Budget What-If")  # Option to simulate price and traveler changes
+        print("9. Back to Main Menu")  # Option to return to the main menu
 
         # Get user input
         choice = get_input("\nEnter your choice: ")
 
         # Handle user input
         if choice == "1":
-            generate_financial_report()  # Call function to generate financial report
+            generate_financial_report(include_archive=include_archive, chart_mode=chart_mode)  # Financial report
         elif choice == "2":
-            generate_traveler_report()  # Call function to generate traveler statistics
+            generate_traveler_report(include_archive=include_archive, chart_mode=chart_mode)  # Traveler statistics
         elif choice == "3":
-            generate_trip_performance_report()  # Call function to generate trip performance metrics
+            generate_trip_performance_report(include_archive=include_archive)  # Generate trip performance metrics
         elif choice == "4":
+            generate_demographics_report()  # Call function to generate the traveler age report
+        elif choice == "5":
+            generate_occupancy_report(include_archive=include_archive)  # Generate the occupancy timeline
+        elif choice == "6":
+            include_archive = not include_archive  # Toggle archived trips on or off
+        elif choice == "7":
+            chart_mode = CHART_MODES[(CHART_MODES.index(chart_mode) + 1) % len(CHART_MODES)]  # Next chart mode
+        elif choice == "8":
+            what_if_menu(include_archive)  # Simulate budget scenarios
+        elif choice == "9":
             break  # Exit the menu and return to the main menu
         else:
             print("Invalid choice. Please try again.")  # Handle invalid input
@@ -763,7 +4167,8 @@ def traveler_management_menu():
         print("2. View All Travelers")  # Option to view all travelers
         print("3. Update Traveler")  # Option to update an existing traveler
         print("4. Delete Traveler")  # Option to delete a traveler
-        print("5. Back to Main Menu")  # Option to return to the main menu
+        print("5. Find Duplicate Travelers")  # Option to audit and merge duplicate travelers
+        print("6. Back to Main Menu")  # Option to return to the main menu
 
         # Get user input
         choice = get_input("\nEnter your choice: ")
@@ -778,6 +4183,8 @@ def traveler_management_menu():
         elif choice == "4":
             delete_traveler()  # Call function to delete a traveler
         elif choice == "5":
+            review_duplicate_travelers()  # Call function to find and merge duplicate travelers
+        elif choice == "6":
             break  # Exit the menu and return to the main menu
         else:
             print("Invalid choice. Please try again.")  # Handle invalid input
@@ -795,7 +4202,8 @@ def trip_leg_management_menu():
         print("2. View All Trip Legs")  # Option to view all trip legs
         print("3. Update Trip Leg")  # Option to update an existing trip leg
         print("4. Delete Trip Leg")  # Option to delete a trip leg
-        print("5. Back to Main Menu")  # Option to return to the main menu
+        print("5. Audit Leg Costs")  # Option to list legs with unusual costs
+        print("6. Back to Main Menu")  # Option to return to the main menu
 
         # Get user input
         choice = get_input("\nEnter your choice: ")
@@ -810,6 +4218,8 @@ def trip_leg_management_menu():
         elif choice == "4":
             delete_trip_leg()  # Call function to delete a trip leg
         elif choice == "5":
+            audit_leg_costs_menu()  # Call function to list legs with unusual costs
+        elif choice == "6":
             break  # Exit the menu and return to the main menu
         else:
             print("Invalid choice. Please try again.")  # Handle invalid input
@@ -818,14 +4228,19 @@ def trip_leg_management_menu():
 def trip_coordinator_menu():
     """
     Display the trip coordinator menu.
-    Allows the user to manage trip travelers, generate itineraries, or return to the main menu.
+    Allows the user to manage trip travelers, generate or export itineraries, undo or redo changes,
+    view record history, or return to the main menu.
     """
     while True:
         # Display menu options
         print("\n=== Trip Coordinator Functions ===")
         print("1. Manage Trip Travelers")  # Option to manage travelers for a trip
         print("2. Generate Trip Itinerary")  # Option to generate a trip itinerary
-        print("3. Back to Main Menu")  # Option to return to the main menu
+        print("3. Export All Itineraries")  # Option to write itinerary files for many trips
+        print("4. Undo Last Change")  # Option to undo the most recent change
+        print("5. Redo Last Change")  # Option to redo the most recently undone change
+        print("6. View Record History")  # Option to see a record as it was at an earlier time
+        print("7. Back to Main Menu")  # Option to return to the main menu
 
         # Get user input
         choice = get_input("\nEnter your choice: ")
@@ -836,6 +4251,14 @@ def trip_coordinator_menu():
         elif choice == "2":
             generate_itinerary()  # Call function to generate a trip itinerary
         elif choice == "3":
+            export_itineraries_menu()  # Call function to export itineraries to files
+        elif choice == "4":
+            print("Last change undone." if undo() else "Nothing to undo.")
+        elif choice == "5":
+            print("Last change redone." if redo() else "Nothing to redo.")
+        elif choice == "6":
+            record_history_menu()  # Call function to show a record's history
+        elif choice == "7":
             break  # Exit the menu and return to the main menu
         else:
             print("Invalid choice. Please try again.")  # Handle invalid input
@@ -853,7 +4276,9 @@ def trip_manager_menu():
         print("2. View Trip Coordinators")  # Option to view all trip coordinators
         print("3. Delete Trip Coordinator")  # Option to delete a trip coordinator
         print("4. Access Trip Coordinator Functions")  # Option to access coordinator functions
-        print("5. Back to Main Menu")  # Option to return to the main menu
+        print("5. Archive Completed Trips")  # Option to move finished trips out of the working set
+        print("6. Emergency Contact Roster")  # Option to list who to call for travelers on a date or at a place
+        print("7. Back to Main Menu")  # Option to return to the main menu
 
         # Get user input
         choice = get_input("\nEnter your choice: ")
@@ -862,26 +4287,21 @@ def trip_manager_menu():
         if choice == "1":
             # Create a new trip coordinator
             print("\n=== Create New Trip Coordinator ===")
+            username = get_input("Username: ")  # Get username
+            if users_by_username.lookup(username):
+                print(f"Username '{username}' is already taken.")
+                continue
             user = {
                 "id": str(uuid.uuid4())[:8],  # Generate a short unique ID
-                "username": get_input("Username: "),  # Get username
-                "password": get_input("Password: "),  # Get password
+                "username": username,
+                "password": hash_password(get_input("Password: ")),  # Get password; only its hash is stored
                 "role": "coordinator"  # Assign role as coordinator
             }
-            users.append(user)  # Add the new user to the users list
+            insert_record("users", user)  # Add the new user to the users list
             print(f"Trip Coordinator '{user['username']}' created successfully with ID: {user['id']}")
 
         elif choice == "2":
-            # View all trip coordinators
-            print("\n=== Trip Coordinators ===")
-            coordinators = [user for user in users if user['role'] == 'coordinator']  # Filter coordinators
-            if not coordinators:
-                print("No trip coordinators found.")  # Handle no coordinators
-            else:
-                for user in coordinators:
-                    print(f"ID: {user['id']}")
-                    print(f"Username: {user['username']}")
-                    print("-" * 30)
+            view_coordinator_workload()  # View all trip coordinators and their workload
 
         elif choice == "3":
             # Delete a trip coordinator
@@ -889,7 +4309,7 @@ def trip_manager_menu():
             for i, user in enumerate(users):
                 if user['id'] == user_id and user['role'] == 'coordinator':
                     username = user['username']
-                    del users[i]  # Remove the user from the list
+                    remove_record("users", user, i)  # Remove the user from the list
                     print(f"Trip Coordinator '{username}' deleted successfully")
                     break
             else:
@@ -899,6 +4319,12 @@ def trip_manager_menu():
             trip_coordinator_menu()  # Access trip coordinator functions
 
         elif choice == "5":
+            archive_trips_menu()  # Move completed trips to the archive
+
+        elif choice == "6":
+            emergency_roster_menu()  # Write the emergency contacts for a date or location
+
+        elif choice == "7":
             break  # Exit the menu and return to the main menu
 
         else:
@@ -917,7 +4343,8 @@ def admin_menu():
         print("2. View All Users")  # Option to view all users
         print("3. Delete User")  # Option to delete a user
         print("4. Access Trip Manager Functions")  # Option to access trip manager functions
-        print("5. Back to Main Menu")  # Option to return to the main menu
+        print("5. Export Data for Analytics")  # Option to write columnar files for NumPy/pandas
+        print("6. Back to Main Menu")  # Option to return to the main menu
 
         # Get user input
         choice = get_input("\nEnter your choice: ")
@@ -932,12 +4359,58 @@ def admin_menu():
         elif choice == "4":
             trip_manager_menu()  # Access trip manager functions
         elif choice == "5":
+            export_columnar_menu()  # Call function to export columnar files
+        elif choice == "6":
             break  # Exit the menu and return to the main menu
         else:
             print("Invalid choice. Please try again.")  # Handle invalid input
 
 
 # Login system
+# Passwords are stored as salted PBKDF2 hashes. Accounts created before hashing was added still hold a
+# plain text password, which is replaced by a hash the first time the user logs in.
+# Hashing is deliberately slow, so scripts and other callers log in once with `authenticate` and then
+# pass the returned session token, which `validate_session_token` checks with a dictionary lookup.
+PASSWORD_SCHEME = "pbkdf2_sha256"
+PASSWORD_ITERATIONS = 600000  # Cost of one password check
+SESSION_TTL = 8 * 60 * 60  # Seconds a session token stays valid
+
+# Users by username, for logging in without scanning every user
+users_by_username = StoreLocal(lambda: CollectionIndex("users", lambda user: user['username']))
+sessions = StoreLocal(dict)  # Maps session tokens to (user ID, username, expiry time)
+_dummy_hash = []  # Hash checked for unknown usernames, so they take as long as wrong passwords
+
+
+def hash_password(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    """
+    Hash a password for storage.
+    :param password: The password in plain text.
+    :param salt: Salt bytes (a new random salt by default).
+    :param iterations: Number of PBKDF2 iterations.
+    :return: A string of the form "pbkdf2_sha256$iterations$salt$hash".
+    """
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{PASSWORD_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_password_hash(stored):
+    """Check whether a stored password is a hash (rather than legacy plain text)."""
+    return isinstance(stored, str) and stored.startswith(PASSWORD_SCHEME + "$")
+
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored hash (or a legacy plain text password).
+    :return: True if the password matches.
+    """
+    if not is_password_hash(stored):
+        return hmac.compare_digest(str(stored).encode("utf-8"), password.encode("utf-8"))
+    _, iterations, salt, digest = stored.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+
 def login():
     """
     User login function.
@@ -948,17 +4421,82 @@ def login():
     username = get_input("Username: ")  # Prompt the user to enter their username
     password = get_input("Password: ")  # Prompt the user to enter their password
 
-    # Iterate through the list of users to find a matching username and password
-    for user in users:
-        if user['username'] == username and user['password'] == password:
-            print(f"Welcome, {username}!")  # Display a welcome message for the authenticated user
-            return user  # Return the authenticated user object
+    user = check_credentials(username, password)
+    if user:
+        print(f"Welcome, {username}!")  # Display a welcome message for the authenticated user
+        return user  # Return the authenticated user object
 
     # If no match is found, display an error message
     print("Invalid username or password.")
     return None  # Return None to indicate failed login
 
 
+def check_credentials(username, password):
+    """
+    Check a username and password against the `users` list.
+    A legacy plain text password is replaced by its hash once it has been checked.
+    :return: The matching user, or None.
+    """
+    matches = users_by_username.lookup(username)  # Find the user without scanning the list
+    if not matches:
+        if not _dummy_hash:
+            _dummy_hash.append(hash_password(""))
+        verify_password(password, _dummy_hash[0])  # Take as long as a wrong password would
+        return None
+
+    for user in matches:
+        if verify_password(password, user['password']):
+            if not is_password_hash(user['password']):
+                with without_undo():  # Upgrading the storage is not a user action
+                    user = update_record("users", user, {"password": hash_password(password)}) or user
+            return user
+    return None
+
+
+def authenticate(username, password):
+    """
+    Log in once and get a session token for later calls.
+    :return: A session token, or None if the credentials are wrong.
+    """
+    user = check_credentials(username, password)
+    if user is None:
+        return None
+    now = time.time()
+    for token, (_, _, expires) in list(sessions.items()):  # Forget expired sessions
+        if expires <= now:
+            del sessions[token]
+    token = secrets.token_urlsafe(32)
+    sessions[token] = (user['id'], user['username'], now + SESSION_TTL)
+    return token
+
+
+def validate_session_token(token, roles=None):
+    """
+    Get the user a session token belongs to.
+    :param token: Token returned by `authenticate`.
+    :param roles: Roles that are allowed (optional).
+    :return: The user, or None if the token is unknown or expired, the user no longer exists,
+             or the user's role is not allowed.
+    """
+    session = sessions.get(token)
+    if session is None:
+        return None
+    user_id, username, expires = session
+    if time.time() >= expires:
+        sessions.pop(token, None)
+        return None
+    for user in users_by_username.lookup(username):
+        if user['id'] == user_id:
+            return user if roles is None or user['role'] in roles else None
+    sessions.pop(token, None)  # The user was deleted or renamed
+    return None
+
+
+def end_session(token):
+    """Log out a session token."""
+    sessions.pop(token, None)
+
+
 # Main function
 def main():
     """
@@ -966,6 +4504,8 @@ def main():
     Handles user authentication and provides access to various system menus based on the user's role.
     """
     print("Welcome to the Simple Travel Management System")  # Display a welcome message
+    if CHANGE_FEED_PATH:
+        enable_change_feed(CHANGE_FEED_PATH)  # Publish every change for other systems
 
     user = None
     # Loop until the user successfully logs in
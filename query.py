@@ -0,0 +1,355 @@
+# Ad-hoc queries over the travel management data
+# A query names a collection and chains filters, an optional join between trip legs and trips,
+# ordering, a limit and a projection, for example "rail legs over $500 on June trips of one coordinator":
+#
+#     Query("trip_legs").where("transport_mode", "==", "Train").where("cost", ">", 500).join("trips")
+#         .where("trip.start_date", "between", (date(2024, 6, 1), date(2024, 6, 30)))
+#         .where("trip.coordinator", "==", "c1").order_by("cost", descending=True).limit(10)
+#
+# A planner looks at the filters and picks the cheapest way to find candidate records: an index lookup
+# (record ID, legs by trip, trips by coordinator, users by username, dictionary-encoded leg categories,
+# or a date or cost range) or a full scan. `explain()` shows the chosen plan. Results are generated lazily.
+
+import bisect  # For range lookups
+import datetime  # For date range indexes
+import heapq  # For ordered queries with a limit
+import itertools  # For limits on unordered results
+import operator  # For comparison operators and field access
+
+import main
+
+
+# Comparison operators accepted by `Query.where`
+OPERATORS = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "in": lambda value, options: value in options,
+    "between": lambda value, bounds: bounds[0] <= value <= bounds[1],
+    "contains": lambda value, text: str(text).casefold() in str(value).casefold(),
+}
+
+# Supported joins: (collection, joined collection) -> (field, joined field, prefix of the joined fields)
+JOINS = {
+    ("trip_legs", "trips"): ("trip_id", "id", "trip."),
+    ("trips", "trip_legs"): ("id", "trip_id", "leg."),
+}
+
+
+class RangeIndex:
+    """
+    The records of a collection sorted by one field, for range lookups by binary search.
+    Rebuilt on first use after the collection changes.
+    """
+
+    def __init__(self, collection, field, kind):
+        """
+        :param collection: Name of the indexed collection.
+        :param field: The sorted field.
+        :param kind: Type of the field's values; records with other values are left out.
+        """
+        self.collection = collection
+        self.field = field
+        self.kind = kind
+        self.token = None  # `collection_token` the index was built at
+        self.keys = []
+        self.records = []
+
+    def _refresh(self):
+        """Rebuild the index if the collection changed since it was built."""
+        if self.token == main.collection_token(self.collection):
+            return
+        with main.store_lock:
+            token = main.collection_token(self.collection)
+            records = [record for record in main.collections_by_name[self.collection]
+                       if isinstance(record.get(self.field), self.kind) and not isinstance(record[self.field], bool)]
+        records.sort(key=operator.itemgetter(self.field))
+        self.keys = [record[self.field] for record in records]
+        self.records = records
+        self.token = token
+
+    def bounds(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        """
+        Find the positions of a range.
+        :return: A (start, end) slice of `records`.
+        """
+        self._refresh()
+        start = 0 if low is None else (bisect.bisect_left if low_inclusive else bisect.bisect_right)(self.keys, low)
+        end = len(self.keys) if high is None else \
+            (bisect.bisect_right if high_inclusive else bisect.bisect_left)(self.keys, high)
+        return start, max(start, end)
+
+
+def _category_index(field):
+    """Build the index of trip legs by the dictionary code of an encoded field."""
+    if field in main.legs_by_location:
+        return main.legs_by_location[field]  # Shared with the emergency contact roster
+    return main.CollectionIndex("trip_legs", lambda leg: main.leg_categories[field].encode(leg.get(field, "")))
+
+
+# Indexes the planner can use: hash indexes for equality, range indexes for comparisons.
+# Each store has its own copy of every index (see `main.StoreLocal`).
+HASH_INDEXES = {
+    ("trips", "id"): main.trips_by_id,
+    ("travelers", "id"): main.travelers_by_id,
+    ("trip_legs", "id"): main.StoreLocal(lambda: main.CollectionIndex("trip_legs", operator.itemgetter("id"))),
+    ("users", "id"): main.users_by_id,
+    ("trip_legs", "trip_id"): main.legs_by_trip,
+    ("trips", "coordinator"): main.trips_by_coordinator,
+    ("users", "username"): main.users_by_username,
+}
+CATEGORY_INDEXES = {  # Legs grouped by the dictionary code of each encoded field
+    ("trip_legs", field): main.StoreLocal(lambda field=field: _category_index(field))
+    for field in main.LEG_CATEGORY_FIELDS
+}
+RANGE_INDEXES = {key: main.StoreLocal(lambda key=key, kind=kind: RangeIndex(*key, kind)) for key, kind in (
+    (("trips", "start_date"), datetime.date),
+    (("trip_legs", "cost"), int),
+    (("trip_legs", "departure"), datetime.datetime),
+    (("travelers", "dob"), datetime.date),
+)}
+_RANGE_OPERATORS = {"==", "<", "<=", ">", ">=", "between"}
+
+
+def _range_arguments(op, value):
+    """Turn a comparison into `RangeIndex.bounds` arguments."""
+    if op == "==":
+        return value, value, True, True
+    if op == "between":
+        return value[0], value[1], True, True
+    if op in ("<", "<="):
+        return None, value, True, op == "<="
+    return value, None, op == ">=", True
+
+
+class AccessPath:
+    """One way of finding the candidate records of a query."""
+
+    def __init__(self, description, estimate, fetch):
+        """
+        :param description: Text shown by `explain`.
+        :param estimate: Number of candidate records the path produces.
+        :param fetch: Function returning the candidate records (called while holding `store_lock`).
+        """
+        self.description = description
+        self.estimate = estimate
+        self.fetch = fetch
+
+
+def _index_paths(collection, conditions, prefix=""):
+    """
+    List the index lookups that can answer one of the conditions.
+    :param collection: The collection to look up.
+    :param conditions: (field, op, value) conditions on that collection, without any prefix.
+    :param prefix: Prefix of the fields as written in the query (for descriptions).
+    :return: A list of `AccessPath`s.
+    """
+    paths = []
+    for field, op, value in conditions:
+        shown = f"{collection}.{field} {op} {value!r}"
+        keys = [value] if op == "==" else list(dict.fromkeys(value)) if op == "in" else None
+
+        index = HASH_INDEXES.get((collection, field))
+        if index is not None and keys is not None:
+            paths.append(AccessPath(f"index lookup {shown}", sum(len(index.lookup(key)) for key in keys),
+                                    lambda index=index, keys=keys: [r for key in keys for r in index.lookup(key)]))
+
+        index = CATEGORY_INDEXES.get((collection, field))
+        if index is not None and keys is not None:
+            index.refresh()  # Building the index encodes every leg, so all categories are known
+            codes = [code for code in (main.leg_categories[field].find(key) for key in keys) if code is not None]
+            paths.append(AccessPath(f"dictionary-encoded index {shown}", sum(len(index.lookup(c)) for c in codes),
+                                    lambda index=index, codes=codes: [r for c in codes for r in index.lookup(c)]))
+
+        index = RANGE_INDEXES.get((collection, field))
+        if index is not None and op in _RANGE_OPERATORS:
+            try:
+                start, end = index.bounds(*_range_arguments(op, value))
+            except TypeError:
+                continue  # The value cannot be compared with the indexed values
+            paths.append(AccessPath(f"range index {shown}", end - start,
+                                    lambda index=index, start=start, end=end: index.records[start:end]))
+    return paths
+
+
+def _normalize(field, value):
+    """Normalize values of dictionary-encoded leg fields, so they match regardless of case and spacing."""
+    if field.rpartition(".")[2] in main.LEG_CATEGORY_FIELDS and isinstance(value, str):
+        return main.normalize_category(value)
+    return value
+
+
+class Query:
+    """
+    A composable query. Each method returns the query, so calls can be chained.
+    Iterate over the query (or call `run`) to get the results.
+    """
+
+    def __init__(self, collection):
+        """:param collection: "trips", "travelers", "trip_legs" or "users"."""
+        if collection not in main.collections_by_name:
+            raise ValueError(f"Unknown collection: {collection}")
+        self.collection = collection
+        self.conditions = []  # (field, op, value) tuples
+        self.predicates = []  # Functions of a row
+        self.joined = None  # Name of the joined collection
+        self.ordering = None  # (field, descending)
+        self.maximum = None  # Limit
+        self.columns = None  # Projection
+
+    def where(self, field, op=None, value=None):
+        """
+        Keep only rows matching a condition.
+        :param field: Field name (joined fields are prefixed, e.g. "trip.name"), or a function of the row.
+        :param op: One of `OPERATORS`.
+        :param value: Value to compare with (a pair for "between", a collection for "in").
+        """
+        if callable(field):
+            self.predicates.append(field)
+        elif op not in OPERATORS:
+            raise ValueError(f"Unknown operator: {op}")
+        else:
+            self.conditions.append((field, op, value))
+        return self
+
+    def join(self, collection):
+        """Join each row with its trip (for trip legs) or with each of its legs (for trips)."""
+        if (self.collection, collection) not in JOINS:
+            raise ValueError(f"Cannot join {self.collection} with {collection}")
+        self.joined = collection
+        return self
+
+    def order_by(self, field, descending=False):
+        """Sort the results by a field."""
+        self.ordering = (field, descending)
+        return self
+
+    def limit(self, count):
+        """Return at most `count` results."""
+        self.maximum = count
+        return self
+
+    def select(self, *fields):
+        """Return only some fields of each row."""
+        self.columns = fields
+        return self
+
+    def _split_conditions(self):
+        """Split the conditions into those on the collection and those on the joined collection."""
+        own, joined = [], []
+        prefix = JOINS[(self.collection, self.joined)][2] if self.joined else None
+        for field, op, value in self.conditions:
+            if prefix and field.startswith(prefix):
+                joined.append((field[len(prefix):], op, value))
+            else:
+                own.append((field, op, value))
+        return own, joined
+
+    def plan(self):
+        """
+        Choose how to find the candidate records.
+        :return: A tuple of (chosen `AccessPath`, list of all paths considered).
+        """
+        records = main.collections_by_name[self.collection]
+        own, joined = self._split_conditions()
+        with main.store_lock:
+            paths = _index_paths(self.collection, own)
+
+            if self.joined and joined:
+                # Start from the joined collection and follow the join back through an index
+                field, joined_field, prefix = JOINS[(self.collection, self.joined)]
+                back = HASH_INDEXES.get((self.collection, field))
+                joined_size = len(main.collections_by_name[self.joined]) or 1
+                for path in _index_paths(self.joined, joined, prefix):
+                    if back is None:
+                        break
+                    per_record = len(records) / joined_size  # Average matches per joined record
+                    paths.append(AccessPath(
+                        f"{path.description}, then index lookup {self.collection}.{field}",
+                        round(path.estimate * per_record),
+                        lambda path=path, back=back, joined_field=joined_field: list({
+                            r['id']: r for other in path.fetch() for r in back.lookup(other[joined_field])}.values())))
+
+            paths.append(AccessPath(f"full scan of {self.collection}", len(records), lambda: list(records)))
+        return min(paths, key=lambda path: path.estimate), paths
+
+    def _rows(self, candidates):
+        """Join and filter the candidate records, one row at a time."""
+        checks = [(field, OPERATORS[op], _normalize(field, value) if op != "in" else
+                   {_normalize(field, option) for option in value}) for field, op, value in self.conditions]
+        if self.joined:
+            field, joined_field, prefix = JOINS[(self.collection, self.joined)]
+            lookup = HASH_INDEXES[(self.joined, joined_field)]
+        for record in candidates:
+            if self.joined:
+                with main.store_lock:
+                    others = list(lookup.lookup(record[field]))
+                rows = ({**record, **{prefix + key: value for key, value in other.items()}} for other in others)
+            else:
+                rows = (record,)
+            for row in rows:
+                if self._matches(row, checks):
+                    yield row
+
+    def _matches(self, row, checks):
+        """Check a row against the conditions and predicates."""
+        for field, compare, value in checks:
+            try:
+                if not compare(_normalize(field, row.get(field)), value):
+                    return False
+            except TypeError:  # Values that cannot be compared (such as a missing date) do not match
+                return False
+        return all(predicate(row) for predicate in self.predicates)
+
+    def run(self):
+        """
+        Run the query.
+        :return: A generator of result rows (dictionaries).
+        """
+        chosen, _ = self.plan()
+        with main.store_lock:
+            candidates = chosen.fetch()
+        rows = self._rows(candidates)
+
+        if self.ordering:
+            field, descending = self.ordering
+            key = lambda row: row.get(field)
+            if self.maximum is not None:
+                rows = (heapq.nlargest if descending else heapq.nsmallest)(self.maximum, rows, key=key)
+            else:
+                rows = sorted(rows, key=key, reverse=descending)
+        elif self.maximum is not None:
+            rows = itertools.islice(rows, self.maximum)
+
+        for row in rows:
+            yield {column: row.get(column) for column in self.columns} if self.columns else row
+
+    def __iter__(self):
+        return self.run()
+
+    def explain(self):
+        """
+        Describe how the query would run.
+        :return: The plan as text, one step per line.
+        """
+        chosen, paths = self.plan()
+        lines = [f"Query on {self.collection}"]
+        if self.joined:
+            field, joined_field, prefix = JOINS[(self.collection, self.joined)]
+            lines.append(f"Join: {self.joined} on {self.collection}.{field} = {self.joined}.{joined_field} "
+                         f"(fields prefixed '{prefix}', index lookup per row)")
+        lines.append(f"Access: {chosen.description} (about {chosen.estimate} records)")
+        for path in paths:
+            if path is not chosen:
+                lines.append(f"  Not chosen: {path.description} (about {path.estimate} records)")
+        if self.conditions or self.predicates:
+            filters = [f"{field} {op} {value!r}" for field, op, value in self.conditions]
+            filters += [f"<function {getattr(predicate, '__name__', 'predicate')}>" for predicate in self.predicates]
+            lines.append(f"Filter: {' and '.join(filters)}")
+        if self.ordering:
+            field, descending = self.ordering
+            how = f"top {self.maximum} with a heap" if self.maximum is not None else "full sort"
+            lines.append(f"Order: {field} {'descending' if descending else 'ascending'} ({how})")
+        if self.maximum is not None:
+            lines.append(f"Limit: {self.maximum}")
+        if self.columns:
+            lines.append(f"Columns: {', '.join(self.columns)}")
+        return "\n".join(lines)
@@ -0,0 +1,225 @@
+# Record and replay console sessions
+# Records the answers typed into the console application, then feeds them back through the real menus
+# (from `main()` and the login down to every submenu) with the output captured instead of printed.
+# Each answer is one action; replaying reports how long the application took to respond to each one.
+# Run `python replay.py --help` for usage.
+
+import argparse  # For the command line interface
+import contextlib  # For redirecting output
+import io  # For capturing output
+import json  # For session files
+import os  # For temporary file paths
+import re  # For finding menu headings in the output
+import tempfile  # For a scratch change feed
+import time  # For timing actions
+from unittest import mock  # For replacing `input` inside `main`
+
+import numpy as np  # For latency percentiles
+
+import main as app
+
+
+MENU_PROMPT = "Enter your choice"  # Prompts whose answers are part of the action name
+_HEADING = re.compile(r"=== (.+?) ===")
+
+
+class ScriptExhausted(Exception):
+    """Raised when the application asks for more input than the session script holds."""
+
+
+class ReplayMismatch(Exception):
+    """Raised in strict mode when the application asks for something other than the recorded prompt."""
+
+
+def load_session(path):
+    """
+    Read a session script.
+    :param path: JSON file holding a list of {"prompt": ..., "input": ...} steps.
+    :return: The list of steps.
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_session(path, steps):
+    """Write a session script."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(steps, f, indent=1)
+
+
+def record_session(path):
+    """
+    Run the application interactively, recording every prompt and answer.
+    The session is saved when the application exits (or on Ctrl+C / end of input).
+    :param path: Where to save the session script.
+    :return: The recorded steps.
+    """
+    steps = []
+
+    def recording_input(prompt=""):
+        answer = input(prompt)
+        steps.append({"prompt": prompt, "input": answer})
+        return answer
+
+    with mock.patch("main.input", recording_input, create=True):
+        try:
+            app.main()
+        except (KeyboardInterrupt, EOFError):
+            print()
+    save_session(path, steps)
+    print(f"Recorded {len(steps)} steps to '{path}'")
+    return steps
+
+
+class _CapturedOutput(io.StringIO):
+    """Captured output that also remembers the last menu heading written."""
+
+    def __init__(self):
+        super().__init__()
+        self.context = "Start"
+
+    def write(self, text):
+        headings = _HEADING.findall(text)
+        if headings:
+            self.context = headings[-1]
+        return super().write(text)
+
+
+class _Replayer:
+    """Stands in for `input`: answers each prompt from the script and times the responses."""
+
+    def __init__(self, steps, output, strict=False):
+        self.steps = steps
+        self.output = output
+        self.strict = strict
+        self.position = 0
+        self.actions = []  # One dictionary per answered prompt
+        self.mismatches = 0
+        self._pending = None  # (action, time the answer was given) awaiting the next prompt
+
+    def finish(self):
+        """Close the timing of the last action."""
+        now = time.perf_counter()
+        if self._pending:
+            action, started = self._pending
+            action["seconds"] = now - started
+            self.actions.append(action)
+            self._pending = None
+
+    def __call__(self, prompt=""):
+        self.finish()
+        if self.position >= len(self.steps):
+            raise ScriptExhausted(f"The application asked for more input after {self.position} steps: {prompt!r}")
+        step = self.steps[self.position]
+        self.position += 1
+        if step.get("prompt") is not None and step["prompt"] != prompt:
+            self.mismatches += 1
+            if self.strict:
+                raise ReplayMismatch(f"Step {self.position}: expected prompt {step['prompt']!r}, got {prompt!r}")
+
+        answer = step["input"]
+        self.output.write(f"{prompt}{answer}\n")  # Keep the transcript readable, as on a console
+        name = f"{self.output.context} > {prompt.strip()}"
+        if MENU_PROMPT in prompt:
+            name += f" [{answer}]"
+        self._pending = ({"step": self.position, "action": name, "input": answer}, time.perf_counter())
+        return answer
+
+
+def replay_session(steps, strict=False):
+    """
+    Feed a session script through `main()`, capturing the output and timing every action.
+    If a change feed is enabled, a temporary one is used so replays do not add to the real one.
+    :param steps: The session script (see `load_session`).
+    :param strict: Raise `ReplayMismatch` if a prompt differs from the recorded one.
+    :return: A dictionary with the timed "actions", the captured "output", the number of prompt "mismatches"
+             and whether the script ran to the end of the program ("completed").
+    """
+    output = _CapturedOutput()
+    replayer = _Replayer(steps, output, strict)
+    completed = True
+    with tempfile.TemporaryDirectory() as tmp, \
+            mock.patch("main.CHANGE_FEED_PATH", os.path.join(tmp, "changes.jsonl") if app.CHANGE_FEED_PATH else None), \
+            mock.patch("main.input", replayer, create=True), \
+            contextlib.redirect_stdout(output):
+        try:
+            app.main()
+        except ScriptExhausted as e:
+            completed = False
+            print(f"\n{e}")
+        finally:
+            replayer.finish()
+            app.disable_change_feed()
+    return {"actions": replayer.actions, "output": output.getvalue(),
+            "mismatches": replayer.mismatches, "completed": completed}
+
+
+def summarize(actions):
+    """
+    Group action timings by action name.
+    :param actions: Timed actions from one or more replays.
+    :return: A list of (name, count, mean, p95, max) tuples in seconds, slowest total first.
+    """
+    timings = {}
+    for action in actions:
+        timings.setdefault(action["action"], []).append(action["seconds"])
+    rows = []
+    for name, seconds in timings.items():
+        seconds = np.array(seconds)
+        rows.append((name, len(seconds), seconds.mean(), np.percentile(seconds, 95), seconds.max()))
+    return sorted(rows, key=lambda row: row[1] * row[2], reverse=True)
+
+
+def print_summary(rows):
+    """Print the latency table produced by `summarize`."""
+    width = max([len(row[0]) for row in rows] + [6])
+    print(f"{'Action':<{width}}{'Count':>8}{'Mean (ms)':>12}{'p95 (ms)':>12}{'Max (ms)':>12}")
+    for name, count, mean, p95, longest in rows:
+        print(f"{name:<{width}}{count:>8}{mean * 1000:>12.2f}{p95 * 1000:>12.2f}{longest * 1000:>12.2f}")
+
+
+def main():
+    """Parse command line arguments and record or replay a session."""
+    parser = argparse.ArgumentParser(description="Record and replay console sessions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="Use the application and record the session")
+    record.add_argument("session", help="Session file to write")
+
+    replay = commands.add_parser("replay", help="Replay a session and report action latencies")
+    replay.add_argument("session", help="Session file to replay")
+    replay.add_argument("--repeat", type=int, default=1, help="Number of times to replay the session")
+    replay.add_argument("--trips", type=int, default=0, help="Load a generated dataset with this many trips first")
+    replay.add_argument("--transcript", help="Write the captured output of the last replay to this file")
+    replay.add_argument("--strict", action="store_true", help="Stop if a prompt differs from the recording")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_session(args.session)
+        return
+
+    if args.trips:
+        import benchmarks  # Imported here so recording does not need the benchmark module
+        benchmarks.load_sample_data(args.trips)
+    steps = load_session(args.session)
+
+    actions, result = [], None
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        result = replay_session(steps, args.strict)
+        actions.extend(result["actions"])
+    elapsed = time.perf_counter() - started
+
+    print(f"Replayed {len(steps)} steps x {args.repeat} in {elapsed:.2f} seconds")
+    if not result["completed"]:
+        print("Warning: the session ended before the program exited.")
+    if result["mismatches"]:
+        print(f"Warning: {result['mismatches']} prompt(s) differed from the recording.")
+    print_summary(summarize(actions))
+    if args.transcript:
+        with open(args.transcript, "w", encoding="utf-8") as f:
+            f.write(result["output"])
+
+
+if __name__ == "__main__":
+    main()
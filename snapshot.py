@@ -0,0 +1,316 @@
+# Binary snapshot format for the travel management data
+# Stores trips, travelers, trip legs and users as fixed-width rows plus a shared string table,
+# so a snapshot can be opened with `mmap` and records decoded only when they are accessed.
+
+import datetime  # For converting dates to and from day ordinals
+import mmap  # For mapping the snapshot file into memory
+import struct  # For packing and unpacking fixed-width rows
+from collections.abc import Sequence  # Base class for the lazy collections
+
+
+# File layout:
+#   header   - magic, format version and one (offset, count) entry per section
+#   sections - fixed-width rows for each collection, in `COLLECTIONS` order
+#   lists    - (string offset, string length) pairs referenced by list fields
+#   strings  - UTF-8 bytes of every distinct string, each stored once
+MAGIC = b"TMSNAP01"
+FORMAT_VERSION = 3
+
+# Field types:
+#   "s" - string, stored as (offset, length) into the string table
+#   "d" - date, stored as a day ordinal (0 means no date)
+#   "t" - date and time, stored as seconds since the start of day ordinal 0 (0 means no time)
+#   "i" - integer, stored as a signed 64-bit value
+#   "l" - list of strings, stored as (start, count) into the list table
+SCHEMAS = {
+    "trips": (
+        ("id", "s"), ("name", "s"), ("start_date", "d"), ("duration", "i"),
+        ("coordinator", "s"), ("contact", "s"), ("travelers", "l"), ("legs", "l"),
+    ),
+    "travelers": (
+        ("id", "s"), ("name", "s"), ("address", "s"), ("dob", "d"),
+        ("emergency_contact", "s"), ("gov_id_type", "s"), ("gov_id_number", "s"),
+    ),
+    "trip_legs": (
+        ("id", "s"), ("trip_id", "s"), ("start_location", "s"), ("destination", "s"),
+        ("transport_provider", "s"), ("transport_mode", "s"), ("leg_type", "s"), ("cost", "i"),
+        ("currency", "s"), ("departure", "t"), ("arrival", "t"),
+    ),
+    "users": (
+        ("id", "s"), ("username", "s"), ("password", "s"), ("role", "s"),
+    ),
+}
+COLLECTIONS = ("trips", "travelers", "trip_legs", "users")
+
+# Schemas of older format versions that can still be read
+LEGACY_SCHEMAS = {
+    1: {**SCHEMAS, "trip_legs": SCHEMAS["trip_legs"][:-3]},  # Before legs had a currency
+    2: {**SCHEMAS, "trip_legs": SCHEMAS["trip_legs"][:-2]},  # Before legs had departure and arrival times
+}
+
+_FIELD_CODES = {"s": "II", "d": "i", "t": "q", "i": "q", "l": "II"}
+_NO_STRING = 0xFFFFFFFF  # String offset used to store `None`
+_SECTION = struct.Struct("<QQ")  # (offset, count) of a section
+_HEADER = struct.Struct("<8sII")  # Magic, format version, number of sections
+_HEADER_SIZE = _HEADER.size + _SECTION.size * (len(COLLECTIONS) + 2)
+_LIST_ENTRY = struct.Struct("<II")  # (string offset, string length) of one list item
+
+
+def _row_struct(schema):
+    """
+    Build the `struct.Struct` describing one fixed-width row of a collection.
+    :param schema: Tuple of (field name, field type) pairs.
+    :return: A `struct.Struct` for the row.
+    """
+    return struct.Struct("<" + "".join(_FIELD_CODES[field_type] for _, field_type in schema))
+
+
+class _StringTable:
+    """Collect distinct strings while a snapshot is written, storing each value only once."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = {}  # Maps a string to its (offset, length) in `data`
+
+    def add(self, value):
+        """
+        Return the (offset, length) reference for a string, adding it if it is new.
+        :param value: The string to store (or `None`).
+        :return: A tuple of (offset, length).
+        """
+        if value is None:
+            return _NO_STRING, 0
+        value = str(value)
+        ref = self.offsets.get(value)
+        if ref is None:
+            encoded = value.encode("utf-8")
+            ref = (len(self.data), len(encoded))
+            self.data += encoded
+            self.offsets[value] = ref
+        return ref
+
+
+def _date_to_ordinal(value):
+    """Convert a `datetime.date` to a day ordinal, using 0 for missing or invalid dates."""
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    return 0
+
+
+def _datetime_to_seconds(value):
+    """Convert a `datetime.datetime` to seconds since day ordinal 0, using 0 for missing times."""
+    if isinstance(value, datetime.datetime):
+        return value.toordinal() * 86400 + value.hour * 3600 + value.minute * 60 + value.second
+    return 0
+
+
+def _seconds_to_datetime(seconds):
+    """Convert seconds since day ordinal 0 back to a `datetime.datetime` (None for 0)."""
+    if not seconds:
+        return None
+    days, seconds = divmod(seconds, 86400)
+    return datetime.datetime.fromordinal(days) + datetime.timedelta(seconds=seconds)
+
+
+def _encode_row(record, schema, strings, lists):
+    """
+    Flatten one record into the values packed into its fixed-width row.
+    :param record: The record dictionary.
+    :param schema: Tuple of (field name, field type) pairs.
+    :param strings: The `_StringTable` being written.
+    :param lists: The bytearray holding list items.
+    :return: A list of values matching the row struct.
+    """
+    values = []
+    for field, field_type in schema:
+        value = record.get(field)
+        if field_type == "s":
+            values.extend(strings.add(value))
+        elif field_type == "d":
+            values.append(_date_to_ordinal(value))
+        elif field_type == "t":
+            values.append(_datetime_to_seconds(value))
+        elif field_type == "i":
+            values.append(int(value or 0))
+        else:  # List of strings
+            items = value or []
+            values.extend((len(lists) // _LIST_ENTRY.size, len(items)))
+            for item in items:
+                lists += _LIST_ENTRY.pack(*strings.add(item))
+    return values
+
+
+def save_snapshot(path, collections=None):
+    """
+    Write the four collections to a binary snapshot file.
+    :param path: Destination file path.
+    :param collections: Dictionary mapping collection names to lists of records.
+                        Defaults to the live data in `main`.
+    :return: A dictionary with the number of records written per collection.
+    """
+    if collections is None:
+        import main  # Imported here so reading a snapshot does not load the whole application
+        collections = {name: getattr(main, name) for name in COLLECTIONS}
+
+    strings = _StringTable()
+    lists = bytearray()
+    sections = []
+
+    with open(path, "wb") as f:
+        f.write(b"\0" * _HEADER_SIZE)  # Header is written last, once all offsets are known
+
+        # Write the fixed-width rows of each collection
+        for name in COLLECTIONS:
+            schema = SCHEMAS[name]
+            row = _row_struct(schema)
+            records = collections.get(name, [])
+            sections.append((f.tell(), len(records)))
+            for record in records:
+                f.write(row.pack(*_encode_row(record, schema, strings, lists)))
+
+        # Write the list table and the string table
+        sections.append((f.tell(), len(lists) // _LIST_ENTRY.size))
+        f.write(lists)
+        sections.append((f.tell(), len(strings.data)))
+        f.write(strings.data)
+
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        for offset, count in sections:
+            f.write(_SECTION.pack(offset, count))
+
+    return {name: count for name, (_, count) in zip(COLLECTIONS, sections)}
+
+
+class SnapshotCollection(Sequence):
+    """
+    A read-only, lazily decoded view of one collection in a snapshot.
+    Records are decoded from the memory-mapped file each time they are accessed.
+    """
+
+    def __init__(self, snapshot, name, offset, count, schema=None):
+        self._snapshot = snapshot
+        self._schema = schema or SCHEMAS[name]
+        self._row = _row_struct(self._schema)
+        self._offset = offset
+        self._count = count
+        self.name = name
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(f"{self.name} index out of range")
+        return self._decode(self._row.unpack_from(self._snapshot.buffer, self._offset + index * self._row.size))
+
+    def _decode(self, values):
+        """Rebuild a record dictionary from the unpacked row values."""
+        record = {}
+        position = 0
+        for field, field_type in self._schema:
+            if field_type == "s":
+                record[field] = self._snapshot.read_string(values[position], values[position + 1])
+                position += 2
+            elif field_type == "d":
+                record[field] = datetime.date.fromordinal(values[position]) if values[position] else None
+                position += 1
+            elif field_type == "t":
+                record[field] = _seconds_to_datetime(values[position])
+                position += 1
+            elif field_type == "i":
+                record[field] = values[position]
+                position += 1
+            else:  # List of strings
+                record[field] = self._snapshot.read_list(values[position], values[position + 1])
+                position += 2
+        return record
+
+
+class Snapshot:
+    """
+    An open binary snapshot.
+    Opening only maps the file and reads the header, so it costs the same for any dataset size.
+    Use as a context manager, or call `close()` when finished.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files cannot be mapped
+            self._file.close()
+            raise ValueError(f"'{path}' is not a snapshot file.")
+
+        if len(self.buffer) < _HEADER_SIZE:  # Too short to hold the header and section table
+            self.close()
+            raise ValueError(f"'{path}' is not a snapshot file.")
+        magic, version, num_sections = _HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or num_sections != len(COLLECTIONS) + 2:
+            self.close()
+            raise ValueError(f"'{path}' is not a snapshot file.")
+        schemas = SCHEMAS if version == FORMAT_VERSION else LEGACY_SCHEMAS.get(version)
+        if schemas is None:
+            self.close()
+            raise ValueError(f"Unsupported snapshot version {version}.")
+
+        sections = [_SECTION.unpack_from(self.buffer, _HEADER.size + i * _SECTION.size)
+                    for i in range(num_sections)]
+        self._lists_offset = sections[-2][0]
+        self._strings_offset = sections[-1][0]
+        self.collections = {
+            name: SnapshotCollection(self, name, offset, count, schemas[name])
+            for name, (offset, count) in zip(COLLECTIONS, sections)
+        }
+
+    def __getattr__(self, name):
+        # Allow `snapshot.trips`, `snapshot.travelers`, etc.
+        collections = self.__dict__.get("collections", {})
+        if name in collections:
+            return collections[name]
+        raise AttributeError(name)
+
+    def read_string(self, offset, length):
+        """Decode a string from the string table."""
+        if offset == _NO_STRING:
+            return None
+        start = self._strings_offset + offset
+        return self.buffer[start:start + length].decode("utf-8")
+
+    def read_list(self, start, count):
+        """Decode a list of strings from the list table."""
+        base = self._lists_offset + start * _LIST_ENTRY.size
+        return [self.read_string(*_LIST_ENTRY.unpack_from(self.buffer, base + i * _LIST_ENTRY.size))
+                for i in range(count)]
+
+    def materialize(self):
+        """
+        Decode every record into plain lists, in the same shape as the lists in `main`.
+        :return: A dictionary mapping collection names to lists of records.
+        """
+        return {name: list(collection) for name, collection in self.collections.items()}
+
+    def close(self):
+        """Unmap the snapshot and close the underlying file."""
+        if not self.buffer.closed:
+            self.buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_snapshot(path):
+    """
+    Open a snapshot file for lazy reading.
+    :param path: Path of the snapshot file.
+    :return: An open `Snapshot`.
+    """
+    return Snapshot(path)